@@ -0,0 +1,70 @@
+# Measures how many calls of user defined functions each evaluation engine
+#   makes in a second, on recursion the likes of "samples/factorial.lispy".
+#   Each engine runs in a fresh interpreter, with the prelude loaded before
+#   timing starts, and the best of a few runs is kept.
+#
+#   usage: python3 benchmarks/calls.py [repeats] [rounds]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'bytecode', 'python', 'machine')
+
+DEPTH = 8  # How deep each round recurses.
+
+PROGRAM = '''
+(define (factorial n)
+  (unless (< n 1)
+    (* (factorial (- n 1)) n)
+    1))
+(times {} (λ (i) (factorial {})))
+(puts (factorial {}))
+'''
+
+# Calls made by a program of `rounds' rounds.  Arithmetic evaluates its
+#   arguments twice (once to check they're numbers), so `factorial' of n
+#   makes 2^(n + 1) - 1 calls, and each round calls the `λ' as well.
+def calls(rounds):
+    factorial = 2 ** (DEPTH + 1) - 1
+    return rounds * (factorial + 1) + factorial
+
+# Runs in the child process: one engine.
+def child(engine, rounds):
+    from lispy import visitor, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    visitor.EX = err.Thrower(err.EXEC, 'calls.lispy')
+    visitor.load_prelude()
+    string = PROGRAM.format(rounds, DEPTH, DEPTH)
+    AST = parsing.parse(lexing.lex(string, 'calls.lispy'))
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    print('{:.6f}'.format(took))
+    print(output.getvalue(), end='')
+
+def run(engine, rounds):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, str(rounds)],
+        capture_output=True, text=True, check=True)
+    took, output = result.stdout.split('\n', 1)
+    return float(took), output
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], int(sys.argv[3]))
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print('{:<10}{:>12}{:>16}'.format('engine', 'time', 'calls/s'))
+    outputs = set()
+    for engine in ENGINES:
+        runs = [run(engine, rounds) for _ in range(repeats)]
+        took = min(t for t, _ in runs)
+        outputs.update(output for _, output in runs)
+        print('{:<10}{:>11.3f}s{:>16,.0f}'.format(engine, took, calls(rounds) / took))
+    if len(outputs) != 1:
+        print('engines disagree!')
+
+if __name__ == '__main__':
+    main()
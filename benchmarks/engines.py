@@ -0,0 +1,89 @@
+# Times running a few programs with each evaluation engine (see
+#   `conf.ENGINE'): the tree walker against compiled closures, against
+#   bytecode run by a virtual machine, and against the program translated
+#   to Python (translating it is timed too).  Each program is run in
+#   a fresh interpreter per engine, with the prelude loaded before
+#   timing starts, and their outputs are checked to agree.  Speedups
+#   are over the tree walker.
+#
+#   usage: python3 benchmarks/engines.py [repeats]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'bytecode', 'python', 'machine')
+
+PROGRAMS = {
+    'recursion': '''
+(define (fib n)
+  (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(puts (fib 16))
+''',
+    'loop': '''
+(let (i 0) (total 0))
+(while (< i 3000) (do
+  (mutate (total (+ total (* i i))))
+  (mutate (i (+ i 1)))))
+(puts total)
+''',
+    'lists': '''
+(define (build n)
+  (do (let (l '()))
+      (times n (λ (i) (push (* 2 i) l)))
+      (size l)))
+(puts (build 300))
+(puts (map (-> (+ %1 1)) (range 0 300)))
+''',
+    'samples': '''
+(define (factorial n)
+  (unless (< n 1)
+    (* (factorial (- n 1)) n)
+    1))
+(times 20 (λ (i) (factorial 8)))
+(puts (factorial 8))
+''',
+}
+
+# Runs in the child process: one program, one engine.
+def child(engine, name):
+    from lispy import visitor, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    visitor.EX = err.Thrower(err.EXEC, name)
+    visitor.load_prelude()
+    AST = parsing.parse(lexing.lex(PROGRAMS[name], name))
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    print('{:.6f}'.format(took))
+    print(output.getvalue(), end='')
+
+def run(engine, name):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, name],
+        capture_output=True, text=True, check=True)
+    took, output = result.stdout.split('\n', 1)
+    return float(took), output
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(*sys.argv[2:4])
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print('{:<12}'.format('program') + ''.join(
+        '{:>12}'.format(engine) for engine in ENGINES) + ''.join(
+        '{:>12}'.format(engine + ' x') for engine in ENGINES[1:]))
+    for name in PROGRAMS:
+        times, outputs = [], set()
+        for engine in ENGINES:
+            runs = [run(engine, name) for _ in range(repeats)]
+            times.append(min(took for took, _ in runs))
+            outputs.update(output for _, output in runs)
+        if len(outputs) != 1:
+            print('{}: engines disagree!'.format(name))
+        print('{:<12}'.format(name) + ''.join(
+            '{:>11.3f}s'.format(t) for t in times) + ''.join(
+            '{:>11.2f}x'.format(times[0] / t) for t in times[1:]))
+
+if __name__ == '__main__':
+    main()
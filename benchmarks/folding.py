@@ -0,0 +1,68 @@
+# Measures what folding constants (see "folding.py") saves, with a loop
+#   of the prelude's `while' and `+1' (each wrapping its arguments in an
+#   `eval' of a quoted form) doing arithmetic on literals, and a branch
+#   on a constant.  Each engine runs in a fresh interpreter, unoptimised
+#   (`--opt-level=0') then optimised, and the best of a few runs is kept.
+#
+#   usage: python3 benchmarks/folding.py [repeats] [iterations]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'bytecode', 'python', 'machine')
+
+LEVELS = (0, 1)
+
+PROGRAM = '''
+(let ($DEBUG :false))
+(define (spin n) (do
+  (let (i 0) (total 0))
+  (while (< i n) (do
+    (if $DEBUG (puts i))
+    (if (= 0 (% 60 (* 2 3))) (incr! total (* 60 60)))
+    (+1 i)))
+  (yield total)))
+(puts (spin {}))
+'''
+
+# Runs in the child process: one engine, at one level.
+def child(engine, level, iterations):
+    from lispy import visitor, folding, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    conf.OPT_LEVEL = level
+    visitor.EX = err.Thrower(err.EXEC, 'folding.lispy')
+    visitor.load_prelude()
+    AST = parsing.parse(lexing.lex(PROGRAM.format(iterations), 'folding.lispy'))
+    output = io.StringIO()
+    folding.reset_stats()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    print('{:.6f} {}'.format(took, sum(folding.STATS.values())))
+    print(output.getvalue(), end='')
+
+def run(engine, level, iterations):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, str(level),
+        str(iterations)], capture_output=True, text=True, check=True)
+    line, output = result.stdout.split('\n', 1)
+    took, folded = line.split()
+    assert output == '{}\n'.format(3600 * iterations), output
+    return float(took), int(folded)
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    print('{:<10}{:>6}{:>12}{:>16}{:>10}'.format(
+        'engine', 'level', 'time', 'iterations/s', 'folded'))
+    for engine in ENGINES:
+        for level in LEVELS:
+            took, folded = min(run(engine, level, iterations) for _ in range(repeats))
+            print('{:<10}{:>6}{:>11.3f}s{:>16,.0f}{:>10,}'.format(
+                engine, level, took, iterations / took, folded))
+
+if __name__ == '__main__':
+    main()
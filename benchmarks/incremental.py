@@ -0,0 +1,60 @@
+# Compares re-lexing and re-parsing a whole buffer after a one
+#   character edit with letting `incremental.Document' do it.  Every
+#   node of the edited document is then checked to be where the same
+#   node of the buffer parsed from scratch is, after a few more edits.
+#
+#   usage: python3 benchmarks/incremental.py [size in KB]
+import sys, os, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lispy
+from lispy import incremental, source, tree
+from lexer import program
+
+# The line and column of every node of `forms', in order.
+def places(forms):
+    found = []
+    stack = list(reversed(forms))
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, tree.Node):
+            continue
+        found.append(source.resolve(node.location)[1:])
+        if isinstance(node, tree.Operator):
+            stack.extend(reversed(node.operands))
+        stack.append(node.value)
+    return found
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    string = program(size * 1024)
+    offset = len(string) // 2
+    offset = string.index('(+ x', offset) + 4
+
+    start = time.perf_counter()
+    edited = string[:offset] + '1' + string[offset:]
+    lispy.parsing.parse(lispy.lexing.lex(edited, 'bench.lispy'))
+    full = time.perf_counter() - start
+
+    document = incremental.Document(string, 'bench.lispy')
+    kept = list(document.tree)
+    start = time.perf_counter()
+    document.edit(offset, 0, '1')
+    partial = time.perf_counter() - start
+
+    same = sum(1 for a, b in zip(kept, document.tree) if a is b)
+    print('full lex + parse:  {:.4f}s'.format(full))
+    print('incremental edit:  {:.4f}s ({} tokens re-lexed, {} forms re-parsed)'.format(
+        partial, document.relexed, document.reparsed))
+    print('forms reused by identity: {} of {}'.format(same, len(document.tree)))
+
+    for at, removed, inserted in [(offset, 1, ''), (0, 0, '\n(puts 0)\n'),
+                                  (offset + 10, 0, '\n\n')]:
+        document.edit(at, removed, inserted)
+        edited = edited[:at] + inserted + edited[at + removed:]
+    fresh = lispy.parsing.parse(lispy.lexing.lex(document.string, 'fresh.lispy'))
+    assert document.string == edited
+    assert places(document.tree) == places(fresh), 'nodes out of place'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Measures what inlining small functions (see `folding.inline') saves,
+#   with a loop calling the prelude's little wrappers (`first', `last',
+#   `empty?', `zero?', `divisible?' and `nil?').  Each engine that makes
+#   use of it runs in a fresh interpreter, with constants folded only
+#   (`--opt-level=1') then with functions inlined as well, and the best
+#   of a few runs is kept.
+#
+#   usage: python3 benchmarks/inlining.py [repeats] [iterations]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'machine')
+
+LEVELS = (1, 2)
+
+PROGRAM = '''
+(define (spin n l) (do
+  (let (i 0) (total 0))
+  (while (< i n) (do
+    (unless (empty? l)
+      (incr! total (+ (first l) (last l))))
+    (if (&& (zero? (% i 2)) (divisible? i 3) (! (nil? l)))
+      (+1 total))
+    (+1 i)))
+  (yield total)))
+(puts (spin {} '(1 2 3)))
+'''
+
+# What the program prints, given how many times round it goes.
+def expected(iterations):
+    return '{}\n'.format(4 * iterations + (iterations + 5) // 6)
+
+# Runs in the child process: one engine, at one level.
+def child(engine, level, iterations):
+    from lispy import visitor, folding, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    conf.OPT_LEVEL = level
+    visitor.EX = err.Thrower(err.EXEC, 'inlining.lispy')
+    visitor.load_prelude()
+    AST = parsing.parse(lexing.lex(PROGRAM.format(iterations), 'inlining.lispy'))
+    output = io.StringIO()
+    folding.reset_stats()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    print('{:.6f} {}'.format(took, folding.STATS['inlined']))
+    print(output.getvalue(), end='')
+
+def run(engine, level, iterations):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, str(level),
+        str(iterations)], capture_output=True, text=True, check=True)
+    line, output = result.stdout.split('\n', 1)
+    took, inlined = line.split()
+    assert output == expected(iterations), output
+    return float(took), int(inlined)
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    print('{:<10}{:>6}{:>12}{:>16}{:>10}'.format(
+        'engine', 'level', 'time', 'iterations/s', 'inlined'))
+    for engine in ENGINES:
+        for level in LEVELS:
+            took, inlined = min(run(engine, level, iterations) for _ in range(repeats))
+            print('{:<10}{:>6}{:>11.3f}s{:>16,.0f}{:>10,}'.format(
+                engine, level, took, iterations / took, inlined))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Times `lexing.lex' over generated programs of growing size.
+#   The per-byte cost should stay flat as the program grows,
+#   since the lexer scans the source exactly once.  Then the
+#   streaming `lexing.tokenize' is run over the largest one from
+#   a file, and its peak memory use reported.
+#
+#   usage: python3 benchmarks/lexer.py [max size in KB]
+import sys, os, time, tempfile, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lispy
+
+FORM = '(define (f{n} x) (+ x {n} 2.5 "str {n}\\n" :atom \'(a b))) ;; comment\n'
+
+def program(size):
+    parts = []
+    total = 0
+    n = 0
+    while total < size:
+        form = FORM.format(n=n)
+        parts.append(form)
+        total += len(form)
+        n += 1
+    return ''.join(parts)
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    size = 64
+    print('{:>10} {:>10} {:>10} {:>12}'.format('KB', 'tokens', 'seconds', 'MB/s'))
+    while size <= limit:
+        string = program(size * 1024)
+        start = time.perf_counter()
+        stream = lispy.lexing.lex(string, 'bench.lispy')
+        took = time.perf_counter() - start
+        print('{:>10} {:>10} {:>10.3f} {:>12.2f}'.format(
+            size, stream.size(), took, len(string) / took / 1e6))
+        size *= 2
+
+    with tempfile.NamedTemporaryFile('w', suffix='.lispy', delete=False) as f:
+        f.write(string)
+    tracemalloc.start()
+    tokens = sum(1 for _ in lispy.lexing.tokenize(f.name))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    os.remove(f.name)
+    print('\nstreamed {} tokens from a {} KB file, peak memory: {:.1f} KB'.format(
+        tokens, len(string) // 1024, peak / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Times compiling the bytecode of each file in `samples/' (see "bytecode.py")
+#   against reading it back from "__lispycache__", the prelude's included.
+#   Each file is run three times, in a fresh interpreter each: once with
+#   the tree walker, once with the bytecode engine (compiling, and keeping
+#   the code), and once more with it (loading the kept code).  The loaded
+#   code is checked to be what was run, and all three outputs to agree.
+#
+#   usage: python3 benchmarks/loading.py
+import sys, os, glob, time, tempfile, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+# Runs in the child process: one file, one engine.
+def child(engine, file, directory):
+    import io
+    import lispy
+    from lispy import bytecode, conf
+    conf.ENGINE = engine
+    conf.CACHE_DIR = directory
+    took, loaded = [0.0], []
+    prepare, load = bytecode.prepare, bytecode.load
+    def timed(AST):
+        start = time.perf_counter()
+        prepare(AST)
+        took[0] += time.perf_counter() - start
+    def counted(*args):
+        codes = load(*args)
+        loaded.append(codes is not None)
+        return codes
+    bytecode.prepare, bytecode.load = timed, counted
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        lispy.run(file)
+    print('{:.6f} {}'.format(took[0], int(bool(loaded) and all(loaded))))
+    print(output.getvalue(), end='')
+
+def run(engine, file, directory):
+    result = subprocess.run([sys.executable, __file__, '--child', engine,
+        file, directory], capture_output=True, text=True, check=True,
+        stdin=subprocess.DEVNULL)
+    line, output = result.stdout.split('\n', 1)
+    took, loaded = line.split()
+    return float(took), loaded == '1', output
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(*sys.argv[2:5])
+    files = sorted(glob.glob(os.path.join(here, '..', 'samples', '*.lispy')))
+    print('{:<20} {:>12} {:>12}'.format('file', 'compile ms', 'load ms'))
+    with tempfile.TemporaryDirectory() as directory:
+        for file in files:
+            kept = glob.glob(os.path.join(here, '..', 'prelude',
+                '__lispycache__', '*.lbc'))
+            kept.append(os.path.join(os.path.dirname(file), '__lispycache__',
+                os.path.basename(file) + '.lbc'))
+            for name in kept:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(name)
+            _, _, expected = run('tree', file, directory)
+            compiling, _, compiled = run('bytecode', file, directory)
+            loading, loaded, output = run('bytecode', file, directory)
+            assert loaded, 'code for {} was not read back'.format(file)
+            assert compiled == expected, compiled
+            assert output == expected, output
+            print('{:<20} {:>12.2f} {:>12.2f}'.format(os.path.basename(file),
+                compiling * 1000, loading * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Times macro expansion over every file in `prelude/' and `samples/'.
+#   Each file is lexed and parsed once, and then expanded (as `visit'
+#   would: the whole tree, then each form again where needed) on fresh
+#   copies of its tree, as many times as asked.  The prelude files go
+#   first, so the samples see all of the prelude's macros, as they
+#   would when run.  The counters in `parsing.STATS' are shown per file.
+#
+#   usage: python3 benchmarks/macros.py [repeats]
+import sys, os, io, glob, copy, time, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+from lispy import lexing, parsing
+
+def files():
+    root = os.path.join(here, '..')
+    prelude = [os.path.join(root, 'prelude', 'prelude.lispy')]
+    prelude += sorted(set(glob.glob(os.path.join(root, 'prelude', '*.lispy')))
+        - set(prelude))
+    return prelude + sorted(glob.glob(os.path.join(root, 'samples', '*.lispy')))
+
+def expand(AST):
+    AST = parsing.preprocess(AST)
+    for i in range(1, len(AST)):
+        if parsing.unsettled(AST, i):
+            AST[i] = parsing.macro_expansion(AST, i)
+        else:
+            parsing.STATS['skipped'] += 1
+    return AST
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print('{:<20} {:>6} {:>8} {:>6} {:>8} {:>8} {:>10}'.format(
+        'file', 'forms', 'invoked', 'hits', 'built', 'skipped', 'ms/expand'))
+    total = 0.0
+    for file in files():
+        with open(file, encoding='utf-8') as f:
+            string = f.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            AST = parsing.parse(lexing.lex(string, file))
+        trees = [copy.deepcopy(AST) for _ in range(repeats)]
+        known = dict(parsing.MACROS)
+
+        parsing.reset_stats()
+        start = time.perf_counter()
+        for tree in trees:
+            # Every run starts off knowing the same macros.
+            parsing.MACROS.clear()
+            parsing.MACROS.update(known)
+            expand(tree)
+        took = (time.perf_counter() - start) / repeats
+        total += took
+        stats = {key: value // repeats for key, value in parsing.STATS.items()
+            if key != 'seconds'}
+        print('{:<20} {:>6} {:>8} {:>6} {:>8} {:>8} {:>10.3f}'.format(
+            os.path.basename(file), len(AST), stats['invocations'],
+            stats['hits'], stats['built'], stats['skipped'], took * 1000))
+    print('\ntotal: {:.3f} ms per expansion of every file'.format(total * 1000))
+
+if __name__ == '__main__':
+    main()
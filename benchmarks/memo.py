@@ -0,0 +1,79 @@
+# Measures what memoising a function (see `visitor.Memo') saves, with a
+#   naive recursive Fibonacci, called over and over on the same numbers,
+#   and on the size of a quoted list, which is keyed by its contents.  Each
+#   engine runs in a fresh interpreter, with the functions defined with
+#   `(define (f ...) ...)' then `(define memo (f ...) ...)', and the
+#   best of a few runs is kept.
+#
+#   usage: python3 benchmarks/memo.py [repeats] [n]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'bytecode', 'python', 'machine')
+
+KINDS = ('define', 'memo')
+
+PROGRAM = '''
+(define {0}(fib n)
+  (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(define {0}(weight l)
+  (fib (size l)))
+(define (spin n) (do
+  (let (i 0) (total 0))
+  (while (< i n) (do
+    (incr! total (+ (fib i) (weight '(1 2 3 4 5 6 7 8 9 10 11 12))))
+    (+1 i)))
+  (yield total)))
+(puts (spin {1}))
+'''
+
+def program(kind, n):
+    return PROGRAM.format('memo ' if kind == 'memo' else '', n)
+
+# What the program prints, given how many Fibonacci numbers it sums.
+def expected(n):
+    a, b, total = 0, 1, 0
+    for _ in range(n):
+        total += a + 144
+        a, b = b, a + b
+    return '{}\n'.format(total)
+
+# Runs in the child process: one engine, one kind of definition.
+def child(engine, kind, n):
+    from lispy import visitor, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    visitor.EX = err.Thrower(err.EXEC, 'memo.lispy')
+    visitor.load_prelude()
+    AST = parsing.parse(lexing.lex(program(kind, n), 'memo.lispy'))
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    hits = sum(memo.hits for memo in visitor.MEMOS)
+    print('{:.6f} {}'.format(took, hits))
+    print(output.getvalue(), end='')
+
+def run(engine, kind, n):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, kind,
+        str(n)], capture_output=True, text=True, check=True)
+    line, output = result.stdout.split('\n', 1)
+    took, hits = line.split()
+    assert output == expected(n), output
+    return float(took), int(hits)
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 18
+    print('{:<10}{:>8}{:>12}{:>10}'.format('engine', 'kind', 'time', 'hits'))
+    for engine in ENGINES:
+        for kind in KINDS:
+            took, hits = min(run(engine, kind, n) for _ in range(repeats))
+            print('{:<10}{:>8}{:>11.3f}s{:>10,}'.format(engine, kind, took, hits))
+
+if __name__ == '__main__':
+    main()
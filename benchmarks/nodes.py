@@ -0,0 +1,98 @@
+# Measures the memory taken by each AST node, and the time taken to
+#   build them: first for the tree of a large generated program (see
+#   `lexer.py'), counting everything traced while parsing it, then
+#   for plain construction of the most common kinds of node.  Every
+#   kind of node is first checked to come back the same out of pickle,
+#   as it must for the tree cache (see "cache.py").
+#
+#   usage: python3 benchmarks/nodes.py [size in KB] [nodes]
+import sys, os, time, pickle, tracemalloc
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+sys.path.insert(0, here)
+
+from lispy import lexing, parsing, tree, source
+from lexer import program
+
+def count(AST):
+    nodes = 0
+    stack = list(AST)
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, tree.Node):
+            continue
+        nodes += 1
+        if isinstance(node, tree.Operator):
+            stack.extend(node.operands)
+        if isinstance(node.value, tree.Node):
+            stack.append(node.value)
+    return nodes
+
+# One of every kind of node, pickled and unpickled (as `cache.store'
+#   and `cache.load' would), should come back with the same fields.
+def round_trip():
+    loc = source.lookup('bench.lispy').base
+    symbol = tree.Symbol('f', loc)
+    nodes = [
+        tree.Node(1, loc), tree.Data(1, loc), tree.Nil(loc),
+        tree.Yield(symbol, loc), tree.Symbol('x', loc), tree.Atom(':a', loc),
+        tree.Numeric(1.5, loc), tree.String('s', loc),
+        tree.Uneval(tree.Nil(loc), loc),
+        tree.Operator(symbol, loc, tree.Numeric(1, loc)),
+        tree.Call(symbol, loc, tree.Nil(loc), tree.String('s', loc))]
+    kinds = {type(node) for node in nodes}
+    stack = [tree.Node]
+    while stack:
+        kind = stack.pop()
+        assert kind in kinds, 'no round trip for ' + kind.__name__
+        stack.extend(kind.__subclasses__())
+    AST = tree.Tree('bench.lispy')
+    AST.extend(nodes)
+    loaded = pickle.loads(pickle.dumps(AST, pickle.HIGHEST_PROTOCOL))
+    for before, after in zip(AST, loaded):
+        assert type(after) is type(before)
+        assert str(after) == str(before), str(after)
+        assert after.location == before.location
+    assert len(loaded) == len(AST)
+
+def construct(n):
+    loc = source.lookup('bench.lispy').base
+    results = []
+    for kind, make in (
+        ('Symbol', lambda: tree.Symbol('x', loc)),
+        ('Numeric', lambda: tree.Numeric(1, loc)),
+        ('Nil', lambda: tree.Nil(loc)),
+        ('Call', lambda: tree.Call(None, loc, None, None))):
+        start = time.perf_counter()
+        for _ in range(n):
+            make()
+        results.append((kind, (time.perf_counter() - start) / n * 1e9))
+    return results
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    round_trip()
+
+    string = program(size * 1024)
+    start = time.perf_counter()
+    AST = parsing.parse(lexing.lex(string, 'bench.lispy'))
+    took = time.perf_counter() - start
+    del AST
+    stream = lexing.lex(string, 'bench.lispy')
+    tracemalloc.start()
+    AST = parsing.parse(stream)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = count(AST)
+    print('{} KB program, {} nodes'.format(size, nodes))
+    print('  lex and parse: {:.3f}s, {:.0f} ns per node'.format(took, took / nodes * 1e9))
+    print('  memory: {:.1f} bytes per node (including operand lists)'.format(
+        used / nodes))
+
+    print('\nconstruction, {} each:'.format(n))
+    for kind, ns in construct(n):
+        print('  {:<8} {:>8.0f} ns'.format(kind, ns))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Times the front end (lexing and parsing, no macro expansion) in one
+#   process against the pool of `parallel.py': first over a number of
+#   generated files, all prefetched up front, as `execute' does with the
+#   prelude and its arguments, then over one large file, which is cut
+#   into pieces at its top-level forms.
+#
+#   usage: python3 benchmarks/parallel.py [files] [size of each in KB] [workers]
+import sys, os, time, tempfile
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+sys.path.insert(0, here)
+
+from lispy import parallel, config as conf
+from lexer import program
+
+def front(files):
+    for file in files:
+        with open(file, encoding='utf-8', newline='') as f:
+            parallel.parse(f.read(), file)
+
+def timed(files, workers):
+    conf.PARALLEL = workers > 0
+    conf.WORKERS = workers or None
+    parallel.shutdown()
+    if conf.PARALLEL:
+        parallel.pool().submit(int).result()  # Don't count starting up.
+    start = time.perf_counter()
+    parallel.prefetch(files)
+    front(files)
+    return time.perf_counter() - start
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    print('{} cores, {} workers'.format(os.cpu_count(), workers))
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for n in range(count):
+            files.append(os.path.join(directory, 'f{}.lispy'.format(n)))
+            with open(files[-1], 'w') as f:
+                f.write(program(size * 1024))
+        large = os.path.join(directory, 'large.lispy')
+        with open(large, 'w') as f:
+            f.write(program(count * size * 1024))
+
+        for name, group in (('{} files of {} KB'.format(count, size), files),
+                ('1 file of {} KB'.format(count * size), [large])):
+            one = timed(group, 0)
+            many = timed(group, workers)
+            print('{:<22} 1 process: {:.3f}s  pool: {:.3f}s  ({:.2f}x)'.format(
+                name, one, many, one / many))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Compares running a large file the usual way (the whole file is lexed
+#   and parsed before anything is evaluated) with the pipelined mode
+#   (`lispy.run(file, pipelined=True)'), where each top-level form is
+#   evaluated as soon as it's parsed and then let go of.  Reports the
+#   time until the first line of output, the total time and the peak
+#   memory traced while running.  Each mode runs in its own process.
+#
+#   usage: python3 benchmarks/pipeline.py [forms]
+import sys, os, io, time, tempfile, tracemalloc, subprocess, contextlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+FORM = '(mutate (n (+ n 1)))\n'
+
+class Output(io.StringIO):
+    first = None
+    def write(self, string):
+        if self.first is None:
+            self.first = time.perf_counter()
+        return super().write(string)
+
+def measure(file, pipelined):
+    import lispy
+    output = Output()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        lispy.run(file, pipelined=pipelined)
+    took = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{:<10} {:>12.3f} {:>10.2f} {:>12.1f}'.format(
+        'pipelined' if pipelined else 'batch',
+        output.first - start, took, peak / 1024 / 1024))
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--measure':
+        return measure(sys.argv[2], sys.argv[3] == 'pipelined')
+
+    forms = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.NamedTemporaryFile('w', suffix='.lispy', delete=False) as f:
+        f.write('(let (n 0))\n(puts "started")\n')
+        f.write(FORM * forms)
+        f.write('(puts n)\n')
+
+    print('{} forms, {} KB'.format(forms, os.path.getsize(f.name) // 1024))
+    print('{:<10} {:>12} {:>10} {:>12}'.format(
+        'mode', 'first out/s', 'total/s', 'peak MB'))
+    for mode in ('batch', 'pipelined'):
+        subprocess.run([sys.executable, __file__, '--measure', f.name, mode])
+    os.remove(f.name)
+
+if __name__ == '__main__':
+    main()
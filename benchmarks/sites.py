@@ -0,0 +1,74 @@
+# Measures the caches at call sites (see `visitor.callee'), with a tight
+#   loop calling a global function.  The loop runs in a function, where
+#   the counter is bound in the function's frame, so the site calling
+#   `inc' finds it there every time; and at the top level, where the
+#   counter is global, so binding it (with `mutate') forgets what every
+#   site knew, and each call looks its callee up again.  Each engine
+#   runs in a fresh interpreter, and the best of a few runs is kept.
+#
+#   usage: python3 benchmarks/sites.py [repeats] [iterations]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'machine')
+
+SETUP = '''
+(define (inc n) (+ n 1))
+(define (spin n) (do
+  (let (i 0))
+  (while (< i n) (mutate (i (inc i))))
+  (yield i)))
+'''
+
+PROGRAMS = {
+    'local': '(puts (spin {}))',
+    'global': '''
+(let (j 0))
+(while (< j {}) (mutate (j (inc j))))
+(puts j)
+''',
+}
+
+# Runs in the child process: one program, on one engine.
+def child(engine, program, iterations):
+    from lispy import visitor, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    visitor.EX = err.Thrower(err.EXEC, 'sites.lispy')
+    visitor.load_prelude()
+    AST = parsing.parse(lexing.lex(SETUP + PROGRAMS[program].format(iterations),
+        'sites.lispy'))
+    output = io.StringIO()
+    visitor.reset_stats()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    print('{:.6f} {} {}'.format(took, visitor.STATS['hits'], visitor.STATS['misses']))
+    print(output.getvalue(), end='')
+
+def run(engine, program, iterations):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, program,
+        str(iterations)], capture_output=True, text=True, check=True)
+    line, output = result.stdout.split('\n', 1)
+    took, hits, misses = line.split()
+    assert output == '{}\n'.format(iterations), output
+    return float(took), int(hits), int(misses)
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    print('{:<10}{:<10}{:>12}{:>16}{:>12}{:>12}'.format(
+        'engine', 'loop', 'time', 'iterations/s', 'hits', 'misses'))
+    for engine in ENGINES:
+        for program in PROGRAMS:
+            runs = [run(engine, program, iterations) for _ in range(repeats)]
+            took, hits, misses = min(runs)
+            print('{:<10}{:<10}{:>11.3f}s{:>16,.0f}{:>12,}{:>12,}'.format(
+                engine, program, took, iterations / took, hits, misses))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Soak test for environments: ten million closures are made, each by a
+#   call whose frame it keeps, and each dropped as soon as the next one
+#   replaces it.  Frames and closures should be reclaimed as they go, so
+#   the memory in use is sampled every tenth of the way, and should stay
+#   where it was after the first tenth.
+#
+#   usage: python3 benchmarks/soak.py [closures] [engine]
+import sys, os, io, gc, time, contextlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lispy import lexing, parsing, visitor
+from lispy import config as conf
+
+SETUP = '''
+(define (adder n) (λ (x) (+ x n)))
+(let (i 0) (f '()))
+'''
+
+# Makes another `count' closures.
+LOOP = '''
+(while (< i {}) (do
+  (mutate (f (adder i)))
+  (mutate (i (+ i 1)))))
+'''
+
+# Memory in use (resident, in MiB), read from "/proc" where there is one.
+def memory():
+    gc.collect()
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+def run(string):
+    AST = parsing.parse(lexing.lex(string, 'soak.lispy'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        return visitor.walk(AST)
+
+def main():
+    closures = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    conf.ENGINE = sys.argv[2] if len(sys.argv) > 2 else 'closure'
+    step = max(closures // 10, 1)
+
+    run(SETUP)
+    start = time.perf_counter()
+    samples = []
+    for made in range(step, closures + 1, step):
+        run(LOOP.format(made))
+        samples.append(memory())
+        print('{:>12} closures {:>10.1f} MiB {:>10.2f}s'.format(
+            made, samples[-1], time.perf_counter() - start))
+    assert visitor.execute_method(visitor.lookup('f'), [1]) == closures
+    growth = samples[-1] - samples[0]
+    print('grew {:.1f} MiB after the first tenth'.format(growth))
+    assert growth < 8, 'memory in use keeps growing'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Stress test for the front end and top-level driver:
+#   a program of a million top-level forms is lexed, parsed and run,
+#   then a single expression nested a hundred thousand lists deep is
+#   lexed, parsed, macro expanded and run (by the machine, the engine
+#   whose stack isn't Python's).  Neither should come anywhere near the
+#   Python recursion limit.
+#
+#   usage: python3 benchmarks/stress.py [forms] [depth]
+import sys, os, io, time, contextlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lispy import lexing, parsing, visitor, tree, conf
+
+def timed(message, f):
+    start = time.perf_counter()
+    result = f()
+    print('{:<40} {:>8.2f}s'.format(message, time.perf_counter() - start))
+    return result
+
+def main():
+    forms = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    string = '(let (n 0))\n' + '(mutate (n (+ n 1)))\n' * (forms - 1)
+    stream = timed('lex {} forms'.format(forms),
+        lambda: lexing.lex(string, 'stress.lispy'))
+    AST = timed('parse {} forms'.format(forms),
+        lambda: parsing.parse(stream))
+    assert len(AST) == forms
+    def visit():
+        with contextlib.redirect_stdout(io.StringIO()):
+            visitor.walk(AST)
+    timed('visit {} forms'.format(forms), visit)
+    assert visitor.lookup('n') == forms - 1
+
+    string = '(let (deep ' + '(list ' * depth + '1' + ')' * depth + '))'
+    stream = timed('lex {} deep'.format(depth),
+        lambda: lexing.lex(string, 'deep.lispy'))
+    AST = timed('parse {} deep'.format(depth),
+        lambda: parsing.parse(stream))
+    node, levels = AST[0].operands[0].operands[0], 0
+    while type(node) is tree.Call:
+        node, levels = node.operands[0], levels + 1
+    assert levels == depth
+    timed('expand {} deep'.format(depth),
+        lambda: parsing.preprocess(AST))
+    conf.ENGINE = 'machine'
+    timed('visit {} deep'.format(depth),
+        lambda: visitor.visit(AST))
+    node, levels = visitor.lookup('deep'), 0
+    while type(node) is tree.Uneval:
+        node, levels = node.value.value, levels + 1
+    assert levels == depth
+
+if __name__ == '__main__':
+    main()
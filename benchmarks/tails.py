@@ -0,0 +1,67 @@
+# Checks that calls in tail position take no room on the stack, with the
+#   loops of the prelude that are written as recursive functions: making
+#   a list of a million numbers with `range', and a million steps of a
+#   `from' loop.  Each engine runs in a fresh interpreter, with Python's
+#   recursion limit lowered to `LIMIT', far below a million.
+#
+#   usage: python3 benchmarks/tails.py [steps]
+import sys, os, io, time, subprocess, contextlib
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'bytecode', 'python', 'machine')
+
+LIMIT = 1000
+
+PROGRAM = '''
+(puts (size (range 0 {0})))
+(let (seen '()))
+(from 1 {0} (λ (i) (push i seen)))
+(puts (size seen))
+(puts (index (- {0} 1) seen))
+'''
+
+# Runs in the child process: one engine.
+def child(engine, steps):
+    from lispy import visitor, conf, lexing, parsing, err
+    conf.ENGINE = engine
+    conf.CACHE = False
+    visitor.EX = err.Thrower(err.EXEC, 'tails.lispy')
+    visitor.load_prelude()
+    sys.setrecursionlimit(LIMIT)
+    AST = parsing.parse(lexing.lex(PROGRAM.format(steps), 'tails.lispy'))
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        visitor.visit(AST)
+    took = time.perf_counter() - start
+    print('{:.6f}'.format(took))
+    print(output.getvalue(), end='')
+
+def run(engine, steps):
+    result = subprocess.run([sys.executable, __file__, '--child', engine, str(steps)],
+        capture_output=True, text=True)
+    if result.returncode != 0 or not result.stdout:
+        return None, result.stdout + result.stderr
+    took, output = result.stdout.split('\n', 1)
+    return float(took), output
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(sys.argv[2], int(sys.argv[3]))
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    expected = '{}\n{}\n{}\n'.format(steps + 1, steps, steps)
+    print('{:<10}{:>12}{:>16}'.format('engine', 'time', 'steps/s'))
+    failed = []
+    for engine in ENGINES:
+        took, output = run(engine, steps)
+        if took is None or output != expected:
+            failed.append(engine)
+            print('{:<10}{:>12}'.format(engine, 'failed'))
+            print(output)
+            continue
+        print('{:<10}{:>11.3f}s{:>16,.0f}'.format(engine, took, 2 * steps / took))
+    assert not failed, 'failed on: ' + ', '.join(failed)
+
+if __name__ == '__main__':
+    main()
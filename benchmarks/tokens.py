@@ -0,0 +1,41 @@
+# Measures the memory held per token by a plain `TokenStream' (one
+#   `Token' object each) against the array backed
+#   `CompactTokenStream', over the same generated program, and the
+#   most memory in use at once while lexing it and parsing the stream
+#   (the tree included, which is the same either way).
+#
+#   usage: python3 benchmarks/tokens.py [size in KB]
+import sys, os, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lispy
+from lexer import program
+
+def held(lexer, string):
+    tracemalloc.start()
+    stream = lexer(string, 'bench.lispy')
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return stream.size(), size
+
+def peak(lexer, string):
+    tracemalloc.start()
+    lispy.parsing.parse(lexer(string, 'bench.lispy'))
+    most = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return most
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    string = program(size * 1024)
+    print('{:>20} {:>10} {:>14} {:>14} {:>14}'.format(
+        'stream', 'tokens', 'bytes', 'bytes/token', 'parse peak'))
+    for name, lexer in [('TokenStream', lispy.lexing.lex),
+                        ('CompactTokenStream', lispy.lexing.lex_compact)]:
+        tokens, bytes = held(lexer, string)
+        most = peak(lexer, string)
+        print('{:>20} {:>10} {:>14} {:>14.1f} {:>14}'.format(
+            name, tokens, bytes, bytes / tokens, most))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Checks what's reported as unbound before a file is run (see `check'
+#   in "resolving.py"), on every engine: a function calling on a global
+#   no file binds is reported, one calling on a global bound by a file
+#   `require'd further on isn't, and both run as they should.  Each file
+#   is run in a fresh interpreter, and the time it took is shown.
+#
+#   usage: python3 benchmarks/unbound.py
+import sys, os, time, tempfile, subprocess
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+
+ENGINES = ('tree', 'closure', 'bytecode', 'python', 'machine')
+
+FILES = {
+    'b.lispy': '(define (g x) (* x 10))\n',
+    'required.lispy': '(define (f x) (g x))\n(require "b")\n(puts (f 2))\n',
+    'unbound.lispy': '(define (f x) (h x))\n(puts 1)\n',
+}
+
+REPORT = 'isn\'t bound in any scope around it'
+
+# Runs in the child process: one file, on one engine.
+def child(engine, file):
+    import lispy
+    from lispy import conf
+    conf.ENGINE = engine
+    conf.CACHE = False
+    conf.COLORS = False
+    start = time.perf_counter()
+    lispy.run(file)
+    print('{:.6f}'.format(time.perf_counter() - start), file=sys.stderr)
+
+def run(engine, file):
+    result = subprocess.run([sys.executable, __file__, '--child', engine,
+        file], capture_output=True, text=True, check=True,
+        stdin=subprocess.DEVNULL)
+    errors, _, took = result.stderr.rstrip('\n').rpartition('\n')
+    return float(took), result.stdout, errors
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        return child(*sys.argv[2:4])
+    print('{:<10} {:>14} {:>14}'.format('engine', 'required ms', 'unbound ms'))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, text in FILES.items():
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(text)
+        for engine in ENGINES:
+            required, output, errors = run(engine,
+                os.path.join(directory, 'required.lispy'))
+            assert REPORT not in errors, errors
+            assert output == '20\n', output
+            unbound, output, errors = run(engine,
+                os.path.join(directory, 'unbound.lispy'))
+            assert REPORT in errors and '`h\'' in errors, errors
+            assert output == '1\n', output
+            print('{:<10} {:>14.2f} {:>14.2f}'.format(engine,
+                required * 1000, unbound * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -34,3 +34,11 @@ expanded = lispy.parsing.preprocess(ast)
 
 print("\n\n=== Macro Expanded ===\n")
 print(expanded)
+
+# === Constant Folding === #
+#   Then what comes to the same thing every time
+#   it's evaluated is folded, ahead of time.
+folded = lispy.folding.optimise_tree(expanded)
+
+print("\n\n=== Constant Folded ===\n")
+print(folded)
@@ -2,47 +2,40 @@ from . import lexing
 from . import tree
 from . import parsing
 from . import visitor
+from . import cache
+from . import parallel
 
 from . import err
 from . import config as conf
 
-import pickle, sys, os
+import sys
 import codecs
 
 TEST_FILE = 'testing.lispy'
 
-def run(file):
+def run(file, pipelined=None):
+    if pipelined is None:
+        pipelined = conf.PIPELINED
+    if pipelined and not conf.DEBUG:
+        # Lex, parse, expand and evaluate in step, form by form.
+        stream = lexing.lex_file(file)
+        return visitor.walk_forms(parsing.forms(stream), file)
+
+    if not conf.DEBUG:
+        return visitor.walk_file(file)
+
     PROGRAM_STRING = None
     with codecs.open(file, 'r', 'utf-8') as f:
         PROGRAM_STRING = f.read()
-
-    if conf.DEBUG:
-        print('--- GIVEN PROGRAM ---\n' + PROGRAM_STRING + '\n-------- END --------')
+    print('--- GIVEN PROGRAM ---\n' + PROGRAM_STRING + '\n-------- END --------')
 
     stream = lexing.lex(PROGRAM_STRING, file)
-    if conf.DEBUG:
-        print("\n\nToken Stream:\n")
-        print(stream)
+    print("\n\nToken Stream:\n")
+    print(stream)
 
     AST = parsing.parse(stream)
-    if conf.DEBUG:
-        print("\n\nAbstract Syntax Tree:\n")
-        print(AST)
-
-    dir = './serialised_trees'
-    try:
-        os.mkdir(dir)
-    except:
-        pass
-    coded = '_'.join(file.split('/'))
-    tree_file = '{}/{}'.format(
-        dir,
-        '.'.join(coded.split('.')[:-1]) + '_serialised.ast')
-    with open(tree_file, 'w+', encoding='utf-8') as f:
-        f.write('VISUALISED_ABSTRACT_SYNTAX_TREE\n')
-        f.write(str(AST))
-        f.write('\nSERIALISED_PICKLE_AST\n')
-        f.write(str(pickle.dumps(AST)))
+    print("\n\nAbstract Syntax Tree:\n")
+    print(AST)
     visitor.walk(AST)
 
 if __name__ == '__main__':
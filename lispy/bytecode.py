@@ -0,0 +1,1012 @@
+from . import tree
+from . import err
+from . import source
+from . import closures
+from . import visitor as V
+from . import resolving
+
+from . import config as conf
+
+from array import array
+from copy import deepcopy
+from types import FunctionType as function
+import os, io, sys, pickle, hashlib, tempfile
+
+# Bytecode:
+#   Each (macro expanded) top-level form, and the body of each `Definition'
+#   it makes, is compiled to a `Code': a flat array of instructions, each
+#   an operation and its one argument, a pool of the constants they refer
+#   to (nodes, names, the `Code' of bodies, ...), and the position in the
+#   source of each instruction.  The virtual machine (`run') steps through
+#   the instructions in a loop, keeping values on a stack of its own, and
+#   a call of a compiled `Definition' pushes a frame, instead of recursing
+#   in Python as `visitor.evaluate' does.
+#
+#   The effect of running a form's code is the same as that of evaluating
+#   it (see "closures.py", whose shortcuts it shares), down to the values
+#   of `CURRENT_LOCATION' and `LAST_EVALUATED' along the way, so errors
+#   point where they always did.  Built-ins not compiled to instructions
+#   of their own are handed their node, and compiled code may be called
+#   from the tree walker, which runs it in a machine of its own.
+#
+#   Symbols are looked up by name, at the address the scope of the frame
+#   they're looked up from resolves it to (see "resolving.py"), so code
+#   holds nothing that depends on where it's run, and can be kept as is.
+#
+#   i.e.  (if (< n 2) n 1)  ;; compiles to
+#
+#         0 GUARD    19      ; Skip it all, if recovering from an error.
+#         1 HEAD     'if'
+#         2 GUARD    14
+#         3 HEAD     '<'
+#         4 LOAD     'n'
+#         5 NUMBERS   8      ; Check it's a number, as `<' does...
+#           ...
+#         8 LOAD     'n'     ; ... and evaluate it once more.
+#         9 CONST    2
+#        10 LESS     13
+#           ...
+#        14 FALSE    17
+#        15 LOAD     'n'
+#        16 JUMP     18
+#        17 CONST    1
+#        18 RESULT
+#
+#   See `disassemble', or `execute --disassemble'.  The forms of a file are
+#   compiled before it's run (see `prepare'), and kept on disk, next to the
+#   source, under "__lispycache__", for as long as the key of its tree in
+#   the tree cache is the same.
+#
+#   Select the engine with `conf.ENGINE', or `--engine=bytecode'.
+
+# Operations.
+CONST, VALUE, LOAD, LAST, JUMPER, QUOTE, EMPTY, GUARD, HEAD, RESULT, \
+MACRO, STRICT, CALLEE, INVOKE, RETURN, JUMP, FALSE, TRUE, NIL, STEP, \
+POP, RECALL, LOOP, RETURNED, TABLE, BIND, SYMBOL, MAKE, DEFINE, \
+NUMBER, NUMBERS, ARITH, PUSH, LESS, MORE, ATMOST, ATLEAST, APPLY, TAIL, \
+TAILSTEP = range(40)
+
+NAMES = ('CONST', 'VALUE', 'LOAD', 'LAST', 'JUMPER', 'QUOTE', 'EMPTY',
+    'GUARD', 'HEAD', 'RESULT', 'MACRO', 'STRICT', 'CALLEE', 'INVOKE',
+    'RETURN', 'JUMP', 'FALSE', 'TRUE', 'NIL', 'STEP', 'POP', 'RECALL',
+    'LOOP', 'RETURNED', 'TABLE', 'BIND', 'SYMBOL', 'MAKE', 'DEFINE',
+    'NUMBER', 'NUMBERS', 'ARITH', 'PUSH', 'LESS', 'MORE', 'ATMOST',
+    'ATLEAST', 'APPLY', 'TAIL', 'TAILSTEP')
+
+# Operations whose argument is the index of an instruction.
+JUMPS = {GUARD, JUMP, FALSE, TRUE, STEP, LOOP, NUMBER, NUMBERS,
+    LESS, MORE, ATMOST, ATLEAST, TAILSTEP}
+# And those whose argument is a count, rather than a constant.
+COUNTS = {INVOKE, TAIL}
+
+# Comparisons, and when they fail.
+COMPARISONS = {'<': LESS, '>': MORE, '<=': ATMOST, '>=': ATLEAST}
+
+DIRECTORY = '__lispycache__'
+SUFFIX = '.lbc'
+
+# Compiled top-level forms: the code of each, by the form's `id'
+#   (along with the form, to be sure it's the same one).
+FORMS = {}
+
+# `Code` is a compiled form, or body of a definition (`body' is set),
+#        whose nodes holding quoted lists are copied for each call (see
+#        `closures.mine'), that is, the constants in `owned'.
+#        The operation of each instruction is a byte of `ops', and its
+#        argument and position in the source are in `args' and `locs'.
+#        The scopes of the body, by the scope it's made in, are kept in
+#        `scopes', but not on disk.
+class Code(object):
+    __slots__ = ('name', 'ops', 'args', 'locs', 'consts', 'owned', 'body',
+        'scopes')
+    def __init__(self, name, ops, args, locs, consts, owned, body):
+        self.name = name
+        self.ops = ops
+        self.args = args
+        self.locs = locs
+        self.consts = consts
+        self.owned = owned
+        self.body = body
+        self.scopes = {}
+
+    # Running the code by itself, e.g. when a `Definition' made
+    #   by compiled code is called by the tree walker.
+    def __call__(self):
+        return run(self)
+
+    def __getstate__(self):
+        return (self.name, self.ops, self.args.tobytes(), self.locs.tobytes(),
+            self.consts, tuple(self.owned), self.body)
+
+    def __setstate__(self, state):
+        name, ops, args, locs, consts, owned, body = state
+        self.name, self.ops, self.consts, self.body = name, ops, consts, body
+        self.owned = frozenset(owned)
+        self.scopes = {}
+        self.args = array('l')
+        self.args.frombytes(args)
+        self.locs = array('q')
+        self.locs.frombytes(locs)
+
+    def __repr__(self):
+        return '<code {} at {}>'.format(self.name, '{}:{}:{}'.format(
+            *source.resolve(self.locs[0])) if self.locs else '?')
+
+# `Assembler` collects the instructions and constants of a `Code'.
+#             Jumps are given labels, placed once their instruction
+#             is known, see `label' and `place'.
+class Assembler(object):
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.ops = bytearray()
+        self.args = array('l')
+        self.locs = array('q')
+        self.consts = []
+        self.indices = {}
+        self.owned = set()
+        self.labels = []
+
+    def const(self, value, owned=False):
+        # Names, strings and numbers are pooled by value,
+        #   everything else by identity.
+        if type(value) in (str, int, float):
+            key = (type(value), value)
+        else:
+            key = id(value)
+        index = self.indices.get(key)
+        if index is None:
+            index = self.indices[key] = len(self.consts)
+            self.consts.append(value)
+        if owned:
+            self.owned.add(index)
+        return index
+
+    def emit(self, op, arg=0, loc=source.IMPLICIT):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.locs.append(loc)
+
+    def label(self):
+        self.labels.append(None)
+        return len(self.labels) - 1
+
+    def place(self, label):
+        self.labels[label] = len(self.ops)
+
+    def assemble(self):
+        for pc, op in enumerate(self.ops):
+            if op in JUMPS:
+                self.args[pc] = self.labels[self.args[pc]]
+        return Code(self.name, bytes(self.ops), self.args, self.locs,
+            self.consts, frozenset(self.owned), self.body)
+
+# Compiles a top-level form (or a body of a definition, which
+#   ends in a tail position).
+def compile(node, body=False, name='<form>'):
+    asm = Assembler(name, body)
+    emit(asm, node, body)
+    asm.emit(RETURN)
+    return asm.assemble()
+
+# Emits the instructions evaluating `node', leaving its value on the stack.
+#   A call in `tail' position is made in place of the call running it.
+def emit(asm, node, tail=False):
+    if not isinstance(node, tree.Node):
+        return asm.emit(VALUE, asm.const(node))
+
+    t = node.type
+    loc = node.location
+    if t is tree.Yield or t is tree.Uneval:
+        owned = asm.body and closures.sensitive(node)
+        return asm.emit(QUOTE, asm.const(node, owned), loc)
+    if t is tree.Nil:
+        return asm.emit(CONST, asm.const(node), loc)
+    if t is tree.Atom:
+        if node.value not in V.ATOMS:
+            V.ATOMS[node.value] = V.Atomise(node.value)
+        return asm.emit(CONST, asm.const(V.ATOMS[node.value]), loc)
+    if t is tree.Numeric or t is tree.String:
+        return asm.emit(CONST, asm.const(node.value), loc)
+    if t is tree.Symbol:
+        return symbol(asm, node)
+    if t is tree.Call:
+        if node.value is None:
+            return asm.emit(EMPTY, 0, loc)
+        head = node.value
+        if type(head) is tree.Symbol and head.value in V.MACROS:
+            return builtin(asm, node, tail)
+        return call(asm, node, tail)
+    raise Exception("Don't know what to do with %s, this is a bug" % str(node))
+
+def symbol(asm, node):
+    loc = node.location
+    name = node.value
+    if name == '_':
+        return asm.emit(LAST, 0, loc)
+    if name in ('break', 'next'):
+        return asm.emit(JUMPER, asm.const(node), loc)
+    if name in V.MACROS:
+        # Built-ins are looked up by name when run, so they
+        #   needn't be kept along with the code.
+        return asm.emit(MACRO, asm.const(name), loc)
+    return asm.emit(LOAD, asm.const(name), loc)
+
+# A call to whatever its head evaluates to: a `Definition' is given the
+#   values of its arguments, anything else that can be called its node.
+def call(asm, node, tail=False):
+    done, end = asm.label(), asm.label()
+    asm.emit(GUARD, end, node.location)
+    emit(asm, node.value)
+    owned = asm.body and closures.sensitive(node)
+    asm.emit(CALLEE, asm.const(node, owned), node.location)
+    asm.emit(JUMP, done)
+    for op in node.operands:
+        emit(asm, op)
+    asm.emit(TAIL if tail else INVOKE, len(node.operands), node.location)
+    asm.place(done)
+    asm.emit(RESULT)
+    asm.place(end)
+
+# A call to a built-in macro, which we know at compile time, since
+#   built-ins take precedence over anything bound to their name.
+def builtin(asm, node, tail=False):
+    name = node.value.value
+    end = asm.label()
+    asm.emit(GUARD, end, node.value.location)
+    asm.emit(HEAD, asm.const(name), node.value.location)
+    special = SPECIAL.get(name)
+    if tail and name in V.TAILS:
+        made = special(asm, node, tail)
+    else:
+        made = special and special(asm, node)
+    if not made and not strict(asm, node):
+        owned = asm.body and closures.sensitive(node)
+        asm.emit(APPLY, asm.const(node, owned), node.location)
+    asm.emit(RESULT)
+    asm.place(end)
+
+def strict(asm, node):
+    if node.value.value not in closures.STRICT:
+        return False
+    least, most, evaluated = closures.STRICT[node.value.value]
+    count = len(node.operands)
+    if count < least or (most is not None and count > most):
+        return False
+    operands = node.operands[:evaluated]
+    for op in operands:
+        emit(asm, op)
+    asm.emit(STRICT, asm.const((node, len(operands))), node.location)
+    return True
+
+def _if(asm, node, tail=False, unless=False):
+    if len(node.operands) < 2:
+        return False
+    otherwise, end = asm.label(), asm.label()
+    emit(asm, node.operands[0])
+    asm.emit(TRUE if unless else FALSE, otherwise)
+    emit(asm, node.operands[1], tail)
+    asm.emit(JUMP, end)
+    asm.place(otherwise)
+    if len(node.operands) > 2:
+        emit(asm, node.operands[2], tail)
+    else:
+        asm.emit(NIL, 0, node.location)
+    asm.place(end)
+    return True
+
+def _unless(asm, node, tail=False):
+    return _if(asm, node, tail, unless=True)
+
+# A `yield' makes `STEP' (`TAILSTEP' in tail position) evaluate its value.
+def _do(asm, node, tail=False):
+    if not node.operands:
+        asm.emit(NIL, 0, node.location)
+        return True
+    end = asm.label()
+    for i, op in enumerate(node.operands):
+        last = i == len(node.operands) - 1
+        emit(asm, op, tail and last)
+        asm.emit(TAILSTEP if tail else STEP, end)
+        if not last:
+            asm.emit(POP)
+    asm.place(end)
+    return True
+
+def _iterate(asm, node):
+    if len(node.operands) != 1:
+        return False
+    start = asm.label()
+    asm.emit(RECALL)
+    asm.place(start)
+    emit(asm, node.operands[0])
+    asm.emit(LOOP, start)
+    asm.emit(RETURNED)
+    return True
+
+# `(eval 'x)', as macros leave it, is just `x'.
+def _eval(asm, node):
+    if len(node.operands) != 1 or type(node.operands[0]) is not tree.Uneval:
+        return False
+    emit(asm, node.operands[0])
+    asm.emit(POP)
+    emit(asm, node.operands[0].value)
+    return True
+
+def _let(asm, node, mutable=False):
+    if len(node.operands) == 0:
+        return False
+    for arg in node.operands:
+        if (type(arg) is not tree.Call or not V.name_node(arg.value)
+        or len(arg.operands) == 0):
+            return False  # Leave it to `let' to complain.
+    asm.emit(TABLE)
+    for arg in node.operands:
+        name = V.name_value(arg.value).name[1:]
+        emit(asm, arg.operands[0])
+        asm.emit(BIND, asm.const((name, mutable)))
+    asm.emit(POP)
+    asm.emit(SYMBOL, asm.const(name))
+    return True
+
+def _mutate(asm, node):
+    return _let(asm, node, mutable=True)
+
+# The constant from which a `Definition' is made, see `make'.
+def definition(asm, node, name, args, names, branch):
+    code = compile(branch, body=True, name=name)
+    return asm.const((node, name, args, names, branch, code))
+
+def _lambda(asm, node):
+    if (len(node.operands) < 2 or type(node.operands[0]) is not tree.Call
+    or node.operands[0].value is None):
+        return False
+    args = [node.operands[0].value] + node.operands[0].operands
+    names = [e.value for e in args]
+    made = definition(asm, node, '_lambda', args, names, node.operands[1])
+    asm.emit(MAKE, made, node.location)
+    return True
+
+def _shorthand(asm, node):
+    if len(node.operands) < 1 or node.shorthand is None:
+        return False
+    args = [('%' + str(i)) for i in range(1, node.shorthand + 1)]
+    made = definition(asm, node, '_short_lambda', args, args, node.operands[0])
+    asm.emit(MAKE, made, node.location)
+    return True
+
+def _define(asm, node):
+    if len(node.operands) < 2:
+        return False
+    kind = node.operands[0]
+    if type(kind) is tree.Call:
+        signature, branch = kind, node.operands[1]
+    elif kind.value == 'function' and len(node.operands) > 2:
+        signature, branch = node.operands[1], node.operands[2]
+    else:
+        return False
+    if type(signature) is not tree.Call or not isinstance(signature.value, tree.Node):
+        return False
+    name = signature.value.value
+    names = [e.value for e in signature.operands]
+    made = definition(asm, node, name, names, names, branch)
+    asm.emit(DEFINE, made, node.location)
+    return True
+
+# Arithmetic checks all of its arguments are numbers first, and
+#   then evaluates them (all over again) to work out its result.
+def _arithmetic(asm, node):
+    if len(node.operands) == 0:
+        return False
+    end = asm.label()
+    for op in node.operands:
+        emit(asm, op)
+        asm.emit(NUMBER, end, op.location)
+    for op in node.operands:
+        emit(asm, op)
+    asm.emit(ARITH, asm.const((node.value.value, len(node.operands))))
+    asm.place(end)
+    return True
+
+# Comparisons don't mind if the check fails, and stop evaluating
+#   their arguments as soon as one is out of order.
+def _comparison(asm, node):
+    if len(node.operands) == 0:
+        return False
+    start, fail, end = asm.label(), asm.label(), asm.label()
+    for op in node.operands:
+        emit(asm, op)
+        asm.emit(NUMBERS, start, op.location)
+    asm.place(start)
+    emit(asm, node.operands[0])
+    for op in node.operands[1:]:
+        emit(asm, op)
+        asm.emit(COMPARISONS[node.value.value], end)
+    asm.emit(POP)
+    asm.emit(PUSH, asm.const(V.ATOMS[':true']))
+    asm.place(end)
+    return True
+
+SPECIAL = {
+    'if': _if,
+    'unless': _unless,
+    'do': _do,
+    'prog': _do,
+    'iterate': _iterate,
+    'eval': _eval,
+    'let': _let,
+    'mutate': _mutate,
+    'λ': _lambda,
+    '->': _shorthand,
+    'define': _define,
+    '-': _arithmetic,
+    '*': _arithmetic,
+    '/': _arithmetic,
+    '%': _arithmetic,
+    '<': _comparison,
+    '>': _comparison,
+    '<=': _comparison,
+    '>=': _comparison,
+}
+
+# Makes the `Definition' of a `λ', `->' or `define', as `visitor' would.
+#   Its scope is resolved once for each scope it's made in.
+def make(made):
+    node, name, args, names, branch, code = made
+    outside = V.FRAME.scope
+    inside = code.scopes.get(outside)
+    if inside is None:
+        inside = code.scopes[outside] = resolving.scope(
+            outside, name, names, branch)
+    return V.Definition(branch, inside, args, V.FRAME, code)
+
+def arithmetic(operation, values):
+    result = values[0]
+    if operation == '-':
+        if len(values) == 1:
+            return -result
+        return result - sum(values[1:])
+    for value in values[1:]:
+        if operation == '*':
+            result = result * value
+        elif operation == '/':
+            result = result / value
+        else:
+            result = result % value
+    return result
+
+# Runs `code', giving the value it leaves.  The operations most often
+#   run are checked for first.  A call in tail position (`TAIL') made
+#   from the code `run' was given, to a `Definition' that isn't compiled
+#   to a `Code', is given back as a `visitor.TailCall' for its caller to
+#   make, any other is made right away, in place of the call making it.
+#
+#   `CURRENT_LOCATION' and `LAST_EVALUATED' are kept in `location' and
+#   `last' while running, and only handed over to `visitor' (and taken
+#   back after) when something else may look at them: a built-in, the
+#   tree walker, an error, or whoever `run' returns to.  The same goes
+#   for whether an error is being recovered from, which only ever
+#   starts to be so elsewhere (i.e. in `EX.throw').
+def run(code):
+    stack = []
+    frames = []  # Callers' code, where they were, their copies, ...
+    ops, args, locs = code.ops, code.args, code.locs
+    consts, owned = code.consts, code.owned
+    copies = {} if code.owned else None  # This call's copies of nodes.
+    definition = None                    # What this call is of.
+    Definition, Symbol, Yield = V.Definition, tree.Symbol, tree.Yield
+    Frame, TailCall, Cell = V.Frame, V.TailCall, resolving.Cell
+    MACROS, UNBOUND, NIL_ERROR = V.MACROS, resolving.UNBOUND, err.NIL_ERROR
+    false = V.ATOMS[':false']
+    location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+    recovering = conf.RECOVERING_FROM_ERROR
+    pc = 0
+    while True:
+        op = ops[pc]
+        arg = args[pc]
+        pc += 1
+
+        if op == GUARD:
+            if recovering:
+                stack.append(NIL_ERROR)
+                pc = arg
+                continue
+            location = locs[pc - 1]
+        elif op == LOAD:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            location = locs[pc - 1]
+            # What `visitor.search' does, when the name is bound.
+            name = consts[arg]
+            frame = V.FRAME
+            scope = frame.scope
+            address = (scope.addresses.get(name)
+                if scope.changes == resolving.CHANGES else None)
+            if address is None:
+                address = scope.address(name)
+            if type(address) is Cell:
+                value = address.value
+            else:
+                depth, slot = address
+                while depth:
+                    frame = frame.parent
+                    depth -= 1
+                slots = frame.slots
+                value = slots[slot] if slot < len(slots) else UNBOUND
+            if value is UNBOUND:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                value = V.search(V.FRAME, name)
+                recovering = conf.RECOVERING_FROM_ERROR
+            last = value
+            stack.append(value)
+        elif op == CONST:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            location = locs[pc - 1]
+            last = value = consts[arg]
+            stack.append(value)
+        elif op == HEAD:
+            location = locs[pc - 1]
+            last = MACROS[consts[arg]]
+        elif op == RESULT:
+            last = stack[-1]
+        elif op == NUMBER or op == NUMBERS:
+            value = stack.pop()
+            t = type(value)
+            if t is not int and t is not float and V.to_type(value) != 'Numeric':
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                error = V.EX.throw(locs[pc - 1],
+                    'All arguments to this macro must\n'
+                    + 'be of type `Numeric`!')
+                recovering = conf.RECOVERING_FROM_ERROR
+                if op == NUMBER:
+                    stack.append(error)
+                pc = arg
+        elif op == ARITH:
+            operation, count = consts[arg]
+            try:
+                if count == 2:  # Most are, worked out as `arithmetic' would.
+                    after = stack.pop()
+                    if operation == '*':
+                        stack[-1] = stack[-1] * after
+                    elif operation == '-':
+                        stack[-1] = stack[-1] - (0 + after)  # As `sum' gives it.
+                    elif operation == '/':
+                        stack[-1] = stack[-1] / after
+                    else:
+                        stack[-1] = stack[-1] % after
+                    continue
+                base = len(stack) - count
+                values = stack[base:]
+                del stack[base:]
+                stack.append(arithmetic(operation, values))
+            except BaseException:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                raise
+        elif op == CALLEE:
+            callee = stack[-1]
+            if type(callee) is Definition:
+                pc += 1  # On to its arguments.
+                continue
+            node = consts[arg]
+            if arg in owned:
+                node = own(node, arg, copies)
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            if type(callee) is function:
+                stack[-1] = callee(node)
+            else:
+                stack[-1] = V.not_callable(node, callee)
+            location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+            recovering = conf.RECOVERING_FROM_ERROR
+        elif op == JUMP:
+            pc = arg
+        elif op == INVOKE:
+            base = len(stack) - arg
+            values = stack[base:]
+            del stack[base:]
+            callee = stack.pop()
+            body = callee.code
+            scope = callee.scope
+            if type(body) is not Code or scope.arity != arg:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                stack.append(V.execute_method(callee, values))
+                location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+                recovering = conf.RECOVERING_FROM_ERROR
+                continue
+            # What `visitor.enter' does, before the call...
+            if V.DEPTH >= conf.DEPTH_LIMIT:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                raise V.TooDeep()
+            frames.append((code, pc, copies, definition, V.FRAME))
+            if scope.blank:
+                values += scope.blank
+            V.FRAME = Frame(scope, values, callee.frame)
+            V.DEPTH += 1
+            code, definition = body, callee
+            copies = {} if code.owned else None
+            ops, args, locs = code.ops, code.args, code.locs
+            consts, owned = code.consts, code.owned
+            pc = 0
+        elif op == RETURN:
+            if definition is None:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                return stack.pop()
+            # ... and after it.
+            last = V.LAST_RETURNED = stack[-1]
+            code, pc, copies, definition, V.FRAME = frames.pop()
+            V.DEPTH -= 1
+            ops, args, locs = code.ops, code.args, code.locs
+            consts, owned = code.consts, code.owned
+        elif op == STEP:
+            e = stack[-1]
+            if type(e) is Yield:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                stack[-1] = V.evaluate(e.value)
+                location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+                recovering = conf.RECOVERING_FROM_ERROR
+                pc = arg
+            elif type(e) is Symbol and e.value in ['break', 'next']:
+                pc = arg
+        elif op == POP:
+            stack.pop()
+        elif op == STRICT:
+            node, count = consts[arg]
+            base = len(stack) - count
+            values = stack[base:]
+            del stack[base:]
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            stack.append(MACROS[node.value.value](node, values))
+            location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+            recovering = conf.RECOVERING_FROM_ERROR
+        elif op == FALSE:
+            c = stack.pop()
+            if c is false or not c:
+                pc = arg
+        elif op == TRUE:
+            c = stack.pop()
+            if c is not false and c:
+                pc = arg
+        elif op == LESS or op == MORE or op == ATMOST or op == ATLEAST:
+            after = stack.pop()
+            before = stack[-1]
+            if ((op == LESS and before >= after) or (op == MORE and before <= after)
+            or (op == ATMOST and before > after) or (op == ATLEAST and before < after)):
+                stack[-1] = false
+                pc = arg
+            else:
+                stack[-1] = after
+        elif op == PUSH:
+            stack.append(consts[arg])
+        elif op == TAIL:
+            base = len(stack) - arg
+            values = stack[base:]
+            del stack[base:]
+            callee = stack.pop()
+            body = callee.code
+            scope = callee.scope
+            if scope.arity != arg or type(body) is not Code:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                if scope.arity == arg and definition is None:
+                    return TailCall(callee, values)
+                stack.append(V.execute_method(callee, values))
+                location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+                recovering = conf.RECOVERING_FROM_ERROR
+                continue
+            # The frame and code of this call give way to the callee's.
+            if scope.blank:
+                values += scope.blank
+            V.FRAME = Frame(scope, values, callee.frame)
+            code = body
+            copies = {} if code.owned else None
+            ops, args, locs = code.ops, code.args, code.locs
+            consts, owned = code.consts, code.owned
+            pc = 0
+        elif op == TAILSTEP:
+            e = stack[-1]
+            if type(e) is Yield:
+                V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+                e = V.evaluate_tail(e.value)
+                if type(e) is TailCall:
+                    if definition is None:
+                        return e
+                    frame = V.FRAME
+                    e = V.bounce(e)
+                    V.FRAME = frame
+                location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+                recovering = conf.RECOVERING_FROM_ERROR
+                stack[-1] = e
+                pc = arg
+            elif type(e) is Symbol and e.value in ['break', 'next']:
+                pc = arg
+        elif op == TABLE:
+            stack.append(V.FRAME)
+        elif op == BIND:
+            name, mutable = consts[arg]
+            value = stack.pop()
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            stack[-1].bind(name, value, mutable)
+            recovering = conf.RECOVERING_FROM_ERROR
+        elif op == SYMBOL:
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            stack.append(V.lookup(consts[arg]))
+            recovering = conf.RECOVERING_FROM_ERROR
+        elif op == QUOTE:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            value = consts[arg]
+            if arg in owned:
+                value = own(value, arg, copies)
+            location = locs[pc - 1]
+            last = value
+            stack.append(value)
+        elif op == APPLY:
+            node = consts[arg]
+            if arg in owned:
+                node = own(node, arg, copies)
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            stack.append(MACROS[node.value.value](node))
+            location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+            recovering = conf.RECOVERING_FROM_ERROR
+        elif op == LOOP:
+            e = stack.pop()
+            if type(e) is Symbol:
+                if e.value == 'break':
+                    continue
+                if e.value == 'next':
+                    pc = arg
+                    continue
+            stack[-1] = e
+            pc = arg
+        elif op == RECALL:
+            stack.append(last)
+        elif op == RETURNED:
+            V.LAST_RETURNED = stack[-1]
+        elif op == MAKE:
+            stack.append(make(consts[arg]))
+        elif op == DEFINE:
+            made = make(consts[arg])
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            V.FRAME.bind(consts[arg][1], made)
+            recovering = conf.RECOVERING_FROM_ERROR
+            stack.append(made)
+        elif op == NIL:
+            stack.append(tree.Nil(locs[pc - 1]))
+        elif op == MACRO:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            location = locs[pc - 1]
+            last = value = MACROS[consts[arg]]
+            stack.append(value)
+        elif op == VALUE:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            last = value = consts[arg]
+            stack.append(value)
+        elif op == LAST:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            location = locs[pc - 1]
+            stack.append(V.LAST_RETURNED)
+        elif op == JUMPER:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            location = locs[pc - 1]
+            stack.append(consts[arg])
+        elif op == EMPTY:
+            if recovering:
+                stack.append(NIL_ERROR)
+                continue
+            location = locs[pc - 1]
+            V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+            stack.append(V.EX.throw(locs[pc - 1],
+                'Cannot make empty call. Evaluating an\n'+
+                'empty list does not make sense.'))
+            recovering = conf.RECOVERING_FROM_ERROR
+        else:
+            raise Exception('Unknown operation {} at {} in {}, this is a bug'
+                .format(op, pc - 1, code))
+
+# This call's own copy of a node holding a quoted list.
+def own(node, index, copies):
+    copy = copies.get(index)
+    if copy is None:
+        copy = copies[index] = deepcopy(node)
+    return copy
+
+
+# Prints the instructions of `code', and of the bodies it compiled.
+def disassemble(code, file=None):
+    file = file or sys.stdout
+    bodies = []
+    file.write('Disassembly of {!r}:\n'.format(code))
+    last = None
+    for pc, op in enumerate(code.ops):
+        arg, loc = code.args[pc], code.locs[pc]
+        where = ''
+        if loc != last and not source.file(loc).pseudo:
+            where = '{1}:{2}'.format(*source.resolve(loc))
+            last = loc
+        note = ''
+        if op in JUMPS:
+            note = '(to {})'.format(arg)
+        elif op in COUNTS:
+            note = '({} given)'.format(arg)
+        elif op in (RETURN, JUMP, RESULT, POP, LAST, NIL, RECALL,
+                    RETURNED, TABLE, EMPTY):
+            note = ''
+        else:
+            const = code.consts[arg]
+            if op in (MAKE, DEFINE):
+                bodies.append(const[5])
+                note = '({})'.format(const[1])
+            elif op in (STRICT, CALLEE, APPLY):
+                node = const[0] if op == STRICT else const
+                note = '({})'.format(node.value.value
+                    if type(node.value) is tree.Symbol else 'call')
+            elif op == BIND:
+                note = '({})'.format(const[0])
+            elif type(const) is V.Atomise:
+                note = '({})'.format(const.name)
+            else:
+                note = '({!r})'.format(const if not isinstance(const, tree.Node)
+                    else const.value)
+        file.write('{:>10} {:>6} {:<10} {:>4} {}\n'.format(
+            where, pc, NAMES[op], arg, note).rstrip() + '\n')
+    for body in bodies:
+        file.write('\n')
+        disassemble(body, file)
+
+# Compiled forms on disk:
+#   A list of `Code's is kept with the names of the files their positions
+#   point into, so they can be moved over, should the files be numbered
+#   differently when read back, as with "cache.py".  What's read back is
+#   only trusted if it was written by this same version of the compiler,
+#   for the same `key'.  Nodes of the file's tree (`nodes', numbered as
+#   by `transpile.number') are kept as their number, and read back as the
+#   very nodes of the tree being run, rather than copies of them.
+
+VERSION = None
+
+def version():
+    global VERSION
+    if VERSION is None:
+        digest = hashlib.sha256(sys.version.encode('utf-8'))
+        for module in (tree, sys.modules[__name__]):
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        VERSION = digest.hexdigest()
+    return VERSION
+
+# Every `Code' in `codes', and every node among their constants,
+#   other than those in `known' (by their `id').
+def contents(codes, known=()):
+    seen = set(known)
+    stack = list(codes)
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if type(item) is Code:
+            stack.extend(item.consts)
+            yield item
+        elif type(item) in (tuple, list):
+            stack.extend(item)
+        elif isinstance(item, tree.Node):
+            for node in V.cache.nodes([item]):
+                if id(node) not in known:
+                    yield node
+
+def dump(codes, file, key='', nodes=()):
+    numbers = {id(node): i for i, node in enumerate(nodes)}
+    indices = set()
+    for item in contents(codes, numbers):
+        if type(item) is Code:
+            indices.update(loc >> source.SHIFT for loc in item.locs)
+        else:
+            indices.add(item.location >> source.SHIFT)
+    names = {}
+    for index in indices:
+        if not source.FILES[index].pseudo:
+            names[index] = source.FILES[index].name
+    data = io.BytesIO()
+    pickler = pickle.Pickler(data, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = lambda item: (numbers.get(id(item))
+        if isinstance(item, tree.Node) else None)
+    pickler.dump((version() + key, len(numbers), names, list(codes)))
+    directory = os.path.dirname(os.path.abspath(file))
+    handle, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data.getvalue())
+        os.replace(temporary, file)
+    except OSError:
+        os.remove(temporary)
+        raise
+
+# Reads back what `dump' wrote, or gives None if it can't be used.
+def load(file, key='', nodes=()):
+    try:
+        with open(file, 'rb') as f:
+            unpickler = pickle.Unpickler(f)
+            unpickler.persistent_load = nodes.__getitem__
+            written, count, names, codes = unpickler.load()
+    except (OSError, EOFError, IndexError, pickle.UnpicklingError):
+        return None
+    if written != version() + key or count != len(nodes):
+        return None
+    known = {id(node) for node in nodes}
+    moved = {}
+    for index, name in names.items():
+        now = source.lookup(name).index
+        if now != index:
+            moved[index] = now
+    def move(position):
+        index = position >> source.SHIFT
+        if index not in moved:
+            return position
+        return (moved[index] << source.SHIFT) | (position & source.MASK)
+    for item in contents(codes, known):
+        if type(item) is Code:
+            # Atoms are compared by identity, so have to be the same ones.
+            for i, const in enumerate(item.consts):
+                if type(const) is V.Atomise:
+                    item.consts[i] = V.ATOMS.setdefault(const.name, const)
+    if moved:
+        for item in contents(codes, known):
+            if type(item) is Code:
+                for i, loc in enumerate(item.locs):
+                    item.locs[i] = move(loc)
+            else:
+                item.location = move(item.location)
+    return codes
+
+def path(file):
+    directory, name = os.path.split(os.path.abspath(file))
+    return os.path.join(directory, DIRECTORY, name + SUFFIX)
+
+# The key of a file's compiled code: its tree's (see `cache.expand'),
+#   and how far its tree was optimised.
+def key(AST):
+    if AST.key is None:
+        return None
+    return str(conf.OPT_LEVEL) + AST.key
+
+# Compiles (or reads back) the code of each form of a file's expanded
+#   tree, ready for `compiled' to give.  A form too deeply nested to be
+#   compiled is left to `compiled', to be reported when it's run.
+def prepare(AST):
+    name = key(AST)
+    nodes = list(V.cache.nodes(reversed(AST)))
+    codes = name and load(path(AST.file), name, nodes)
+    if not codes:
+        codes = []
+        for form in AST:
+            try:
+                codes.append(compile(form))
+            except RecursionError:
+                codes.append(None)
+        if name is not None:
+            try:
+                os.makedirs(os.path.dirname(path(AST.file)), exist_ok=True)
+                dump(codes, path(AST.file), name, nodes)
+            except (OSError, RecursionError, pickle.PicklingError):
+                pass  # Not being able to keep it is no reason to stop.
+    for form, code in zip(AST, codes):
+        if code is not None:
+            FORMS[id(form)] = form, code
+
+# The code of a top-level form, compiled by `prepare' if it was, as it
+#   is, part of a file.
+def compiled(node):
+    found = FORMS.pop(id(node), None)
+    if found is None or found[0] is not node:
+        return compile(node)
+    return found[1]
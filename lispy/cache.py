@@ -0,0 +1,233 @@
+from . import lexing
+from . import parsing
+from . import tree
+from . import source
+from . import parallel
+
+from . import config as conf
+
+import os, sys, time, pickle, hashlib, tempfile
+
+# Front end cache:
+#   Trees that have been lexed, parsed and macro expanded are kept on
+#   disk, one file per entry, along with the macros their source file
+#   defined.  An entry is found by a hash of the interpreter's version,
+#   the file's name and contents, and the macros known before the file
+#   was expanded, so a cached tree is only ever used where expanding
+#   the source again would give the very same tree.  Positions in the
+#   tree are kept as they were (see "source.py"), along with the names
+#   of the files they point into, and only moved over if those files
+#   are numbered differently this time round.
+#
+#   Entries are written to a temporary file first, and then moved into
+#   place, so that a reader never sees half an entry.  Reading an entry
+#   touches it, and when the cache grows past `conf.CACHE_SIZE' bytes,
+#   the entries that have gone unread the longest are removed.
+
+SUFFIX = '.ast'
+
+# Counters, for the `--timing' flag.
+STATS = {
+    'hits': 0,
+    'misses': 0,
+    'seconds': 0.0  # Time spent getting expanded trees, cached or not.
+}
+
+VERSION = None
+
+# The interpreter's version, as far as the cache cares:
+#   the source of the modules that make up the front end.
+def version():
+    global VERSION
+    if VERSION is None:
+        digest = hashlib.sha256(sys.version.encode('utf-8'))
+        for module in (lexing, parsing, tree, source, sys.modules[__name__]):
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        VERSION = digest.hexdigest()
+    return VERSION
+
+# A hash of `subtree' that depends only on what's in it: the kind,
+#   value and position (by file name) of each node, in order.  Unlike
+#   its pickle, it doesn't change with how nodes or strings happen to
+#   be shared, e.g. between a serial and a parallel run.
+def canonical(subtree):
+    digest = hashlib.sha256()
+    stack = [subtree]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, tree.Node):
+            digest.update(repr(node).encode('utf-8') + b'\0')
+            continue
+        digest.update('<{} {} {}>'.format(node.name,
+            source.filename(node.location),
+            source.offset(node.location)).encode('utf-8'))
+        if isinstance(node, tree.Operator):
+            digest.update(b'%d\0' % len(node.operands))
+            stack.extend(reversed(node.operands))
+        stack.append(node.value)
+    return digest.digest()
+
+# A hash of the macros currently known.
+def environment():
+    digest = hashlib.sha256()
+    for name in sorted(parsing.MACROS):
+        macro = parsing.MACROS[name]
+        if getattr(macro, 'digest', None) is None:
+            macro.digest = canonical(macro.tree)
+        digest.update(name.encode('utf-8') + b'\0' + macro.digest)
+    return digest.digest()
+
+# The key of `file', given its contents as `chunks' of bytes.
+def key(file, chunks):
+    digest = hashlib.sha256(version().encode('utf-8'))
+    digest.update(file.encode('utf-8') + b'\0')
+    digest.update(environment())
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+# The contents of `file', read `lexing.CHUNK_SIZE' bytes at a time.
+def chunks(file):
+    with open(file, 'rb') as f:
+        yield from iter(lambda: f.read(lexing.CHUNK_SIZE), b'')
+
+def path(name):
+    return os.path.join(conf.CACHE_DIR, name + SUFFIX)
+
+# Every node in the given trees, once each (macro expansion
+#   shares nodes between trees).
+def nodes(roots):
+    seen = set()
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, tree.Node) or id(node) in seen:
+            continue
+        seen.add(id(node))
+        yield node
+        if isinstance(node, tree.Operator):
+            stack.extend(node.operands)
+        stack.append(node.value)
+
+# The names of the files positions in the trees point into, by their
+#   index, or None if any isn't a file that can be found again by name.
+def files(roots):
+    indices = {node.location >> source.SHIFT for node in nodes(roots)}
+    names = {}
+    for index in indices:
+        file = source.FILES[index]
+        if file.pseudo:
+            continue  # Always numbered the same.
+        if source.BY_NAME.get(file.name) is not file:
+            return None
+        names[index] = file.name
+    return names
+
+# Gives the cached tree for `name', bringing in the macros its file
+#   defined, or None if there's no (readable) entry.
+def load(name):
+    try:
+        with open(path(name), 'rb') as f:
+            AST, macros, names = pickle.load(f)
+        os.utime(path(name))
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    moved = {}
+    for index, file in names.items():
+        now = source.lookup(file).index
+        if now != index:
+            moved[index] = now
+    if moved:
+        roots = list(AST) + [subtree for _, subtree in macros]
+        for node in nodes(roots):
+            index = node.location >> source.SHIFT
+            if index in moved:
+                node.location = ((moved[index] << source.SHIFT)
+                    | (node.location & source.MASK))
+    for macro, subtree in macros:
+        parsing.MACROS[macro] = parsing.Macro(subtree)
+    return AST
+
+def store(name, AST, macros):
+    names = files(list(AST) + [subtree for _, subtree in macros])
+    if names is None:
+        return
+    try:
+        os.makedirs(conf.CACHE_DIR, exist_ok=True)
+        data = pickle.dumps((AST, macros, names), pickle.HIGHEST_PROTOCOL)
+        handle, temporary = tempfile.mkstemp(dir=conf.CACHE_DIR)
+    except (OSError, RecursionError, pickle.PicklingError):
+        return  # Not being able to cache is no reason to stop.
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path(name))
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return
+    evict()
+
+# Removes the least recently used entries, until the
+#   cache is back within `conf.CACHE_SIZE' bytes.
+def evict():
+    entries = []
+    with os.scandir(conf.CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, file in sorted(entries):
+        if total <= conf.CACHE_SIZE:
+            break
+        try:
+            os.remove(file)
+        except OSError:
+            pass
+        total -= size
+
+# Lexes and parses `file' (whose contents may be given as `string').
+#   The file is streamed to the lexer, unless the parallel front end,
+#   which hands whole texts to its workers, is used.
+def parse(file, string=None):
+    if string is None and conf.PARALLEL:
+        with open(file, 'r', encoding='utf-8', newline='') as f:
+            string = f.read()
+    if string is None:
+        return parsing.parse(lexing.lex_file(file))
+    return parallel.parse(string, file)
+
+# Lexes, parses and expands the macros of `file' (whose contents may
+#   be given as `string'), or gets the result from the cache.  The file
+#   is only ever read in chunks, to find its key, and again to lex it.
+def expand(file, string=None):
+    start = time.perf_counter()
+    name = None
+    if conf.CACHE:
+        name = key(file, chunks(file) if string is None
+            else [string.encode('utf-8')])
+    AST = name and load(name)
+    if AST is not None:
+        STATS['hits'] += 1
+        if string is None:
+            source.lookup(file).unload()  # Read again, if it's needed.
+        else:
+            source.lookup(file).load(string)
+    else:
+        STATS['misses'] += 1
+        known = dict(parsing.MACROS)
+        AST = parsing.preprocess(parse(file, string))
+        # Don't keep trees that came out of a syntax error.
+        if name is not None and not conf.RECOVERING_FROM_ERROR:
+            macros = [(macro, parsing.MACROS[macro].tree)
+                for macro in parsing.MACROS
+                if known.get(macro) is not parsing.MACROS[macro]]
+            store(name, AST, macros)
+    if AST is not None and name is not None and not conf.RECOVERING_FROM_ERROR:
+        AST.key = name
+    STATS['seconds'] += time.perf_counter() - start
+    return AST
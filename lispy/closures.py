@@ -0,0 +1,540 @@
+from . import tree
+from . import err
+from . import visitor as V
+from . import resolving
+
+from . import config as conf
+
+from copy import deepcopy
+from types import FunctionType as function
+
+# Closure compilation:
+#   Rather than walking a form every time it's evaluated (`visitor.evaluate'),
+#   each (macro expanded) top-level form, and each body of a `Definition' it
+#   makes, is turned into nested Python closures once, which are then just
+#   called.  The checks on the type of each node, the look up of built-in
+#   macros, and the shape of `if', `do', `let', `λ', ... are all dealt with
+#   up front, at compile time.
+#
+#   A compiled node has the very same effect as `evaluate' would have on
+#   it, down to `CURRENT_LOCATION', `LAST_EVALUATED' and friends, so the
+#   two can be mixed freely: any built-in that isn't compiled is simply
+#   handed its node, as usual, and a compiled `Definition' can be called
+#   from the tree walker.
+#
+#   Bodies are shared by every call of a `Definition', the tree walker's
+#   and compiled ones alike, but quoted lists in them (which `push' and
+#   the like change in place) are new to each call: a call makes its own
+#   copy of one the first time it's needed, see `mine'.
+#
+#   i.e.  (define (f) (push 1 '(0)))   ;; '(0 1) on every call, either way.
+#
+#   Symbols are resolved as they're compiled (see "resolving.py"), in the
+#   `scope' the code will run in, so each is looked up at its address, for
+#   as long as no scope has grown since.
+#
+#   Select the engine with `conf.ENGINE', or `--engine=closure'.
+
+FRAMES = []  # For each compiled call running, its own copies of nodes.
+OWNED = 0    # How many nodes have been given copies, see `mine'.
+
+# Forms with a built-in macro at their head that get compiled, the rest
+#   are handed their node as usual.  A built-in in `STRICT' (see the
+#   ones taking `args' in "visitor.py") is handed its evaluated arguments,
+#   as long as it would evaluate them all the same, given how many there
+#   are: the least amount, the most, and how many it evaluates.
+STRICT = {
+    'type':    (1, None, 1),
+    'name':    (1, None, 1),
+    '!':       (1, None, 1),
+    'size':    (1, 1, None),
+    'index':   (2, 2, None),
+    'push':    (2, None, None),
+    'unshift': (2, None, None),
+    'concat':  (2, None, None),
+    '=':       (2, None, None),
+    '/=':      (2, None, None),
+    '+':       (0, None, None),
+    'list':    (0, None, None),
+    '&&':      (0, None, None),
+    '||':      (0, None, None),
+    '^^':      (0, None, None),
+    'string':  (0, None, None),
+    'repr':    (0, None, None),
+    'out':     (0, None, None),
+    'puts':    (0, None, None),
+    'memo-clear': (0, 1, None),
+    'memo-stats': (1, 1, None),
+}
+
+# Whether anything in the tree of `node' could be changed in place, that
+#   is, a quoted list (see `visitor.own').
+def sensitive(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, tree.Node):
+            continue
+        if node.type is tree.Uneval and type(node.value) is tree.Call:
+            return True
+        if node.type is tree.Call:
+            stack.extend(node.operands)
+        stack.append(node.value)
+    return False
+
+# Gives the `node' as evaluation in a compiled body should see it: its
+#   copy for the current call if it's `sensitive', otherwise itself.
+def mine(node, body):
+    global OWNED
+    if not body or not sensitive(node):
+        return lambda: node
+    OWNED += 1
+    key = id(node)
+    def own():
+        frame = FRAMES[-1]
+        if frame is None:
+            frame = FRAMES[-1] = {}
+        copy = frame.get(key)
+        if copy is None:
+            copy = frame[key] = deepcopy(node)
+        return copy
+    return own
+
+# Compiles the body of a `Definition', each call getting a frame for
+#   its copies of nodes, if any are to be copied.
+def enter(node, scope):
+    owned = OWNED
+    code = compile(node, scope, body=True, tail=True)
+    if OWNED == owned:
+        return code
+    def call():
+        FRAMES.append(None)
+        try:
+            return code()
+        finally:
+            FRAMES.pop()
+    return call
+
+def constant(node, value):
+    loc = node.location
+    def run():
+        if conf.RECOVERING_FROM_ERROR:
+            return err.NIL_ERROR
+        V.CURRENT_LOCATION = loc
+        V.LAST_EVALUATED = value
+        return value
+    return run
+
+# Compiles a node of a top-level form, or of the body of a definition,
+#   to be run in a frame of `scope' (the current one, for a form).  A call
+#   in `tail' position gives the `visitor.TailCall' to be made instead.
+def compile(node, scope=None, body=False, tail=False):
+    if scope is None:
+        scope = V.FRAME.scope
+    if not isinstance(node, tree.Node):
+        def value():
+            if conf.RECOVERING_FROM_ERROR:
+                return err.NIL_ERROR
+            V.LAST_EVALUATED = node
+            return node
+        return value
+
+    t = node.type
+    loc = node.location
+    if t is tree.Yield or t is tree.Uneval:
+        own = mine(node, body)
+        def quoted():
+            if conf.RECOVERING_FROM_ERROR:
+                return err.NIL_ERROR
+            V.CURRENT_LOCATION = loc
+            V.LAST_EVALUATED = value = own()
+            return value
+        return quoted
+    if t is tree.Nil:
+        return constant(node, node)
+    if t is tree.Atom:
+        if node.value not in V.ATOMS:
+            V.ATOMS[node.value] = V.Atomise(node.value)
+        return constant(node, V.ATOMS[node.value])
+    if t is tree.Numeric or t is tree.String:
+        return constant(node, node.value)
+    if t is tree.Symbol:
+        return symbol(node, scope)
+    if t is tree.Call:
+        if node.value is None:
+            def empty():
+                if conf.RECOVERING_FROM_ERROR:
+                    return err.NIL_ERROR
+                V.CURRENT_LOCATION = loc
+                return V.EX.throw(loc,
+                    'Cannot make empty call. Evaluating an\n'+
+                    'empty list does not make sense.')
+            return empty
+        head = node.value
+        if type(head) is tree.Symbol and head.value in V.MACROS:
+            return builtin(node, scope, body, tail)
+        return call(node, scope, body, tail)
+
+    def unknown():
+        raise Exception("Don't know what to do with %s, this is a bug" % str(node))
+    return unknown
+
+def symbol(node, scope):
+    loc = node.location
+    name = node.value
+    if name == '_':
+        def last():
+            if conf.RECOVERING_FROM_ERROR:
+                return err.NIL_ERROR
+            V.CURRENT_LOCATION = loc
+            return V.LAST_RETURNED
+        return last
+    if name in ('break', 'next'):
+        def jump():
+            if conf.RECOVERING_FROM_ERROR:
+                return err.NIL_ERROR
+            V.CURRENT_LOCATION = loc
+            return node
+        return jump
+    if name in V.MACROS:
+        return constant(node, V.MACROS[name])
+    return address(node, scope.resolve(name))
+
+# Looks `node' up at the `address' it resolved to, or by its name once
+#   that may no longer be where it's bound.
+def address(node, address):
+    loc = node.location
+    name = node.value
+    changes = resolving.CHANGES
+    UNBOUND = resolving.UNBOUND
+    if type(address) is resolving.Cell:
+        cell = address
+        def lookup():
+            if conf.RECOVERING_FROM_ERROR:
+                return err.NIL_ERROR
+            V.CURRENT_LOCATION = loc
+            if resolving.CHANGES != changes:
+                value = V.search(V.FRAME, name)
+            else:
+                value = cell.value
+                if value is UNBOUND:
+                    value = V.unbound(name)
+            V.LAST_EVALUATED = value
+            return value
+        return lookup
+    depth, slot = address
+    def lookup():
+        if conf.RECOVERING_FROM_ERROR:
+            return err.NIL_ERROR
+        V.CURRENT_LOCATION = loc
+        frame = V.FRAME
+        if resolving.CHANGES == changes:
+            for _ in range(depth):
+                frame = frame.parent
+            slots = frame.slots
+            if slot < len(slots) and slots[slot] is not UNBOUND:
+                V.LAST_EVALUATED = value = slots[slot]
+                return value
+        V.LAST_EVALUATED = value = V.search(V.FRAME, name)
+        return value
+    return lookup
+
+# A call to whatever its head evaluates to.
+def call(node, scope, body, tail=False):
+    loc = node.location
+    callee = compile(node.value, scope, body)
+    args = [compile(op, scope, body) for op in node.operands]
+    own = mine(node, body)
+    count = len(args)
+    Definition = V.Definition
+    enter = V.TailCall if tail else V.enter
+    # The body in place of the call, while it's of `expected'.
+    expected, inlined = None, None
+    if node.inline is not None:
+        expected, inlined = node.inline[0], compile(node.inline[1], scope, body)
+    def run():
+        if conf.RECOVERING_FROM_ERROR:
+            return err.NIL_ERROR
+        V.CURRENT_LOCATION = loc
+        definition = callee()
+        if inlined is not None and definition is expected:
+            V.LAST_EVALUATED = V.LAST_RETURNED = result = inlined()
+            return result
+        if type(definition) is Definition:
+            values = [arg() for arg in args]
+            if definition.scope.arity == count:
+                result = enter(definition, values)
+            else:
+                result = V.execute_method(definition, values)
+        elif type(definition) is function:
+            result = definition(own())
+        else:
+            result = V.not_callable(node, definition)
+        V.LAST_EVALUATED = result
+        return result
+    return run
+
+# A call to a built-in macro, which we know at compile time, since
+#   built-ins take precedence over anything bound to their name.
+def builtin(node, scope, body, tail=False):
+    name = node.value.value
+    special = SPECIAL.get(name)
+    if tail and name in V.TAILS:
+        run = special(node, scope, body, tail)
+    else:
+        run = special and special(node, scope, body)
+    if run is None:
+        run = strict(node, scope, body)
+    if run is None:
+        macro = V.MACROS[name]
+        own = mine(node, body)
+        run = lambda: macro(own())
+
+    loc = node.value.location
+    macro = V.MACROS[name]
+    def head():
+        if conf.RECOVERING_FROM_ERROR:
+            return err.NIL_ERROR
+        # What evaluating the head would have done.
+        V.CURRENT_LOCATION = loc
+        V.LAST_EVALUATED = macro
+        V.LAST_EVALUATED = result = run()
+        return result
+    return head
+
+def strict(node, scope, body):
+    if node.value.value not in STRICT:
+        return None
+    least, most, evaluated = STRICT[node.value.value]
+    count = len(node.operands)
+    if count < least or (most is not None and count > most):
+        return None
+    macro = V.MACROS[node.value.value]
+    args = [compile(op, scope, body) for op in node.operands[:evaluated]]
+    return lambda: macro(node, [arg() for arg in args])
+
+def _if(node, scope, body, tail=False, unless=False):
+    if len(node.operands) < 2:
+        return None
+    loc = node.location
+    check = compile(node.operands[0], scope, body)
+    then = compile(node.operands[1], scope, body, tail)
+    otherwise = None
+    if len(node.operands) > 2:
+        otherwise = compile(node.operands[2], scope, body, tail)
+    false = V.ATOMS[':false']
+    def run():
+        c = check()
+        if c is not false and c:
+            return then()
+        if otherwise is not None:
+            return otherwise()
+        return tree.Nil(loc)
+    def run_unless():
+        c = check()
+        if c is false or not c:
+            return then()
+        if otherwise is not None:
+            return otherwise()
+        return tree.Nil(loc)
+    return run_unless if unless else run
+
+def _unless(node, scope, body, tail=False):
+    return _if(node, scope, body, tail, unless=True)
+
+def _do(node, scope, body, tail=False):
+    loc = node.location
+    forms = [compile(op, scope, body) for op in node.operands[:-1]]
+    forms += [compile(op, scope, body, tail) for op in node.operands[-1:]]
+    Yield, Symbol = tree.Yield, tree.Symbol
+    evaluate = V.evaluate_tail if tail else V.evaluate
+    def run():
+        result = tree.Nil(loc)
+        for form in forms:
+            e = form()
+            if type(e) is Yield:
+                return evaluate(e.value)
+            if type(e) is Symbol:
+                if e.value in ['break', 'next']:
+                    return e
+            result = e
+        return result
+    return run
+
+def _iterate(node, scope, body):
+    if len(node.operands) != 1:
+        return None
+    form = compile(node.operands[0], scope, body)
+    Symbol = tree.Symbol
+    def run():
+        last = V.LAST_EVALUATED
+        while True:
+            e = form()
+            if type(e) is Symbol:
+                if e.value == 'break':
+                    break
+                if e.value == 'next':
+                    continue
+            last = e
+        V.LAST_RETURNED = last
+        return last
+    return run
+
+# `(eval 'x)', as macros leave it, is just `x'.
+def _eval(node, scope, body):
+    if len(node.operands) != 1 or type(node.operands[0]) is not tree.Uneval:
+        return None
+    quoted = compile(node.operands[0], scope, body)
+    inside = compile(node.operands[0].value, scope, body)
+    def run():
+        quoted()
+        return inside()
+    return run
+
+def _let(node, scope, body, mutable=False):
+    if len(node.operands) == 0:
+        return None
+    for arg in node.operands:
+        if (type(arg) is not tree.Call or not V.name_node(arg.value)
+        or len(arg.operands) == 0):
+            return None  # Leave it to `let' to complain.
+    bindings = [(V.name_value(arg.value).name[1:], compile(arg.operands[0], scope, body))
+        for arg in node.operands]
+    name = bindings[-1][0]
+    def run():
+        frame = V.FRAME
+        for symbol, value in bindings:
+            frame.bind(symbol, value(), mutable)
+        return V.lookup(name)
+    return run
+
+def _mutate(node, scope, body):
+    return _let(node, scope, body, mutable=True)
+
+# Makes the `Definition' of a `λ', `->' or `define', as `visitor' would.
+def definition(node, scope, body, name, args, names, branch):
+    inside = resolving.scope(scope, name, names, branch)
+    code = enter(branch, inside)
+    def make():
+        return V.Definition(branch, inside, args, V.FRAME, code)
+    return make
+
+def _lambda(node, scope, body):
+    if (len(node.operands) < 2 or type(node.operands[0]) is not tree.Call
+    or node.operands[0].value is None):
+        return None
+    args = [node.operands[0].value] + node.operands[0].operands
+    names = [e.value for e in args]
+    return definition(node, scope, body, '_lambda', args, names, node.operands[1])
+
+def _shorthand(node, scope, body):
+    if len(node.operands) < 1 or node.shorthand is None:
+        return None
+    args = [('%' + str(i)) for i in range(1, node.shorthand + 1)]
+    return definition(node, scope, body, '_short_lambda', args, args, node.operands[0])
+
+def _define(node, scope, body):
+    if len(node.operands) < 2:
+        return None
+    kind = node.operands[0]
+    if type(kind) is tree.Call:
+        signature, branch = kind, node.operands[1]
+    elif kind.value == 'function' and len(node.operands) > 2:
+        signature, branch = node.operands[1], node.operands[2]
+    else:
+        return None
+    if type(signature) is not tree.Call or not isinstance(signature.value, tree.Node):
+        return None
+    name = signature.value.value
+    names = [e.value for e in signature.operands]
+    make = definition(node, scope, body, name, names, names, branch)
+    def run():
+        made = make()
+        V.FRAME.bind(name, made)
+        return made
+    return run
+
+# Arithmetic checks all of its arguments are numbers first, and
+#   then evaluates them (all over again) to work out its result.
+def numerics(node, args):
+    def check():
+        for arg, op in zip(args, node.operands):
+            if V.to_type(arg()) != 'Numeric':
+                return V.EX.throw(op.location,
+                    'All arguments to this macro must\n'
+                    + 'be of type `Numeric`!')
+        return None
+    return check
+
+def arithmetic(operation):
+    def special(node, scope, body):
+        if len(node.operands) == 0:
+            return None
+        args = [compile(op, scope, body) for op in node.operands]
+        check = numerics(node, args)
+        first, rest = args[0], args[1:]
+        def run():
+            e = check()
+            if e: return e
+            result = first()
+            for arg in rest:
+                result = operation(result, arg())
+            return result
+        return run
+    return special
+
+def _sub(node, scope, body):
+    if len(node.operands) == 0:
+        return None
+    args = [compile(op, scope, body) for op in node.operands]
+    check = numerics(node, args)
+    first, rest = args[0], args[1:]
+    def run():
+        e = check()
+        if e: return e
+        if not rest:
+            return -first()
+        return first() - sum(arg() for arg in rest)
+    return run
+
+def comparison(fails):
+    def special(node, scope, body):
+        if len(node.operands) == 0:
+            return None
+        args = [compile(op, scope, body) for op in node.operands]
+        check = numerics(node, args)
+        first, rest = args[0], args[1:]
+        true, false = V.ATOMS[':true'], V.ATOMS[':false']
+        def run():
+            check()
+            last = first()
+            for arg in rest:
+                after = arg()
+                if fails(last, after):
+                    return false
+                last = after
+            return true
+        return run
+    return special
+
+SPECIAL = {
+    'if': _if,
+    'unless': _unless,
+    'do': _do,
+    'prog': _do,
+    'iterate': _iterate,
+    'eval': _eval,
+    'let': _let,
+    'mutate': _mutate,
+    'λ': _lambda,
+    '->': _shorthand,
+    'define': _define,
+    '-': _sub,
+    '*': arithmetic(lambda a, b: a * b),
+    '/': arithmetic(lambda a, b: a / b),
+    '%': arithmetic(lambda a, b: a % b),
+    '<': comparison(lambda a, b: a >= b),
+    '>': comparison(lambda a, b: a <= b),
+    '<=': comparison(lambda a, b: a > b),
+    '>=': comparison(lambda a, b: a < b),
+}
@@ -8,11 +8,51 @@ DANGER     = 4000
 RECURSION_LIMIT = DANGER
 sys.setrecursionlimit(RECURSION_LIMIT)
 
+# How many calls deep Lispy code may go.  Engines that recurse in Python
+#   for every call run into `RECURSION_LIMIT' long before, but the
+#   bytecode's and the machine's calls (see "machine.py") don't.
+DEPTH_LIMIT = 100000
+
 
 DEBUG = False
 EXIT_ON_ERROR = True
 RECOVERING_FROM_ERROR = False
 
+# Evaluate each top-level form as soon as it is parsed, instead of
+#   reading in the whole file first (see `visitor.visit_forms').
+PIPELINED = False
+
+# How forms are evaluated: 'tree' walks them (see `visitor.evaluate'),
+#   'closure' compiles them to closures first (see "closures.py"),
+#   'bytecode' to bytecode for a virtual machine (see "bytecode.py"),
+#   'python' translates whole files to Python (see "transpile.py"),
+#   'machine' evaluates them with a stack of its own (see "machine.py").
+ENGINE = 'tree'
+
+# How far top-level forms are optimised once their macros are expanded:
+#   0 not at all, 1 with constants folded, 2 with calls of small functions
+#   inlined as well (see "folding.py").
+OPT_LEVEL = 1
+
+# How many values a function defined with `(define memo ...)' keeps, by
+#   default, the least recently used going first (see `visitor.Memo').
+MEMO_SIZE = 1024
+
+# Keep lexed, parsed and macro expanded trees on disk (see "cache.py"),
+#   at most `CACHE_SIZE' bytes of them.
+CACHE = True
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'lispy')
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Lex and parse files in a pool of `WORKERS' processes (all of the
+#   cores when None), files larger than `SPLIT_SIZE' characters being
+#   cut into pieces that are parsed side by side (see "parallel.py").
+PARALLEL = False
+WORKERS = None
+SPLIT_SIZE = 256 * 1024
+
 COLORS = True
 if os.name == 'nt':  # If we're on the Windows NT kernel,
     COLORS = False   #   don't use colors. Because Windows is bad.
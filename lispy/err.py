@@ -1,6 +1,7 @@
 import sys
 
 from . import tree
+from . import source
 from . import config as conf
 
 LEX   = 'Syntax'
@@ -29,31 +30,27 @@ class NoColors:
     BOLD     = ''
     UNDERLINE= ''
 
-NIL_ERROR = tree.Nil({'line': -1, 'column': -1, 'filename': 'ERROR'})
+NIL_ERROR = tree.Nil(source.ERROR)
+
+# How many characters the token at `column' (from 1) of `snip' takes up.
+def token_span(snip, column):
+    from .lexing import MASTER
+    found = MASTER.match(snip, column - 1) if 0 < column <= len(snip) else None
+    if found is None or found.lastgroup in ('SKIP', 'TERMINATOR', 'EOF'):
+        return 1
+    return max(found.end() - found.start(), 1)
 
 def Message(message_type):
-    def TypeOfMessage(err_type, loc, string, file, prog=None):
+    def TypeOfMessage(err_type, position, string, file, prog=None, span=None):
         c = NoColors
         if conf.COLORS:
             c = ANSIColors
         if conf.RECOVERING_FROM_ERROR:
             return NIL_ERROR
-        lines = ""
-        if prog is not None:
-            lines = prog + '\0'
-            lines = lines.split('\n')
-        else:
-            try:
-                with open(loc['filename'], 'r', newline=None) as f:
-                    lines = f.read()
-                lines += '\0'
-                lines = lines.split('\n')
-            except:
-                lines = "NO_FILE_AVAILABLE"
-
-        snip = lines[-1]
-        if loc['line'] <= len(lines):
-            snip = lines[loc['line'] - 1]
+        filename, line, column, snip = source.snippet(position)
+        loc = {'filename': filename, 'line': line, 'column': column}
+        if snip is None:
+            snip = ''
 
         snippet = '\n    {b}{line}|{e} {w}{snip}{e}\n'.format(
             b = c.BOLD,
@@ -63,9 +60,8 @@ def Message(message_type):
             snip = snip
         )
 
-        span = 1
-        if 'span' in loc.keys():
-            span = loc['span']
+        if span is None:
+            span = token_span(snip, column)
         offset = 3
         if conf.COLORS:
             offset = 20
@@ -90,12 +86,12 @@ def Message(message_type):
             file = loc['filename'])
         err_print(where + snippet + '\n' + message + '\n')
 
+        if message_type != 'Error':
+            return 1
         if not conf.EXIT_ON_ERROR:
             conf.RECOVERING_FROM_ERROR = True
             return NIL_ERROR
-        if message_type == 'Error':
-            sys.exit(1)
-        return 1
+        sys.exit(1)
     return TypeOfMessage
 
 Error = Message('Error')
@@ -110,7 +106,7 @@ class Thrower:
     def nofile(self, prog):
         self.prog = prog
 
-    def throw(self, loc, string):
-        return Error(self.type, loc, string, self.file, self.prog)
-    def warn(self, loc, string):
-        return Warn(self.type, loc, string, self.file, self.prog)
+    def throw(self, loc, string, span=None):
+        return Error(self.type, loc, string, self.file, self.prog, span)
+    def warn(self, loc, string, span=None):
+        return Warn(self.type, loc, string, self.file, self.prog, span)
@@ -0,0 +1,367 @@
+from . import tree
+from . import resolving
+from . import visitor as V
+
+from . import config as conf
+
+import math, weakref
+
+# Folding constants:
+#   Macro expansion leaves plenty in a form that comes to the same thing
+#   every time it's evaluated: arithmetic on literals, `if's on literal
+#   conditions, and the `(eval 'x)' that macros like `+1' and `while' wrap
+#   each of their arguments in.  Once a top-level form is expanded, and
+#   before it's evaluated, `optimise' looks it over and puts in place of
+#
+#     - a call of a pure built-in (see `PURE') on literals, its value;
+#     - an `if' or `unless' on a literal, the branch it takes;
+#     - an `eval' of a quoted form, the form itself.
+#
+#   i.e.  (while (< i (* 2 8)) (+1 i))   ;; Expands to, and is folded to
+#
+#         (iterate (do (unless (eval '(< i (* 2 8))) break)
+#           (eval '(mutate ('i (+ (eval 'i) 1))))))
+#         (iterate (do (unless (< i 16) break)
+#           (mutate ('i (+ i 1)))))
+#
+#   Nodes are never changed in place, as macro expansions share them with
+#   the bodies of macros (see `parsing.Template'): a node is made anew
+#   along the paths to whatever has been folded.  Quoted forms are left as
+#   they are, being data, as are the forms given to the built-ins that
+#   don't evaluate their arguments (see `resolving.UNEVALUATED').  Names of
+#   built-ins can't be bound to anything else, so a folded call is of the
+#   very built-in it would have called.
+#
+#   Past that, a call of a small function (see `template') may be given
+#   its body, the function's arguments put in it in place of its names,
+#   to be evaluated instead of the call, for as long as the name of the
+#   function is still bound to it, that is, in the call's `inline'.  Only
+#   functions defined at the top level, whose bodies do nothing but give
+#   a value, with built-ins or other such functions, qualify.
+#
+#   i.e.  (define (zero? n) (= n 0))
+#         (zero? (- x 1))               ;; Evaluates, while `zero?' is
+#         (= (- x 1) 0)                 ;;   the same function, this.
+#
+#   An argument may only end up somewhere its value would have been used
+#   just the same, see `suitable'.  The body is evaluated in the caller's
+#   scope, so a call is left alone if a function its body calls is named
+#   by anything bound around the call.  Only the tree walker, the closures
+#   and the machine make use of `inline', as the code of the other engines
+#   is kept on disk, where the function it depends on can't be.
+#
+#   A call can only be inlined once the function it calls is defined, so
+#   while inlining, a top-level form is optimised just before it's
+#   evaluated (see `visitor.visit'), after the forms before it have been.
+#
+#   How much is done is up to `conf.OPT_LEVEL', or `--opt-level=N':
+#   1 folds constants, 2 inlines functions as well.
+
+LITERALS = (tree.Numeric, tree.String, tree.Atom)
+
+# Counters of what's been folded, see `execute --timing'.
+STATS = {
+    'folded': 0,    # Calls of built-ins given by their value.
+    'pruned': 0,    # `if's and `unless'es given by their branch.
+    'unquoted': 0,  # `eval's of quoted forms given by the form.
+    'inlined': 0,   # Calls given the body of their function.
+}
+
+def reset_stats():
+    for key in STATS:
+        STATS[key] = 0
+
+def numbers(ops):
+    return all(type(op) is tree.Numeric for op in ops)
+
+def divisors(ops):
+    return numbers(ops) and all(op.value != 0 for op in ops[1:])
+
+# Built-ins with no effects, whose value is down to their arguments alone,
+#   and, given literals, whether they'd take them without complaint.
+PURE = {
+    '+':  lambda ops: len(ops) > 0 and (numbers(ops)
+        or all(type(op) is tree.String for op in ops)),
+    '-':  lambda ops: len(ops) > 0 and numbers(ops),
+    '*':  lambda ops: len(ops) > 0 and numbers(ops),
+    '/':  lambda ops: len(ops) > 0 and divisors(ops),
+    '%':  lambda ops: len(ops) > 0 and divisors(ops),
+    '<':  lambda ops: len(ops) > 0 and numbers(ops),
+    '>':  lambda ops: len(ops) > 0 and numbers(ops),
+    '<=': lambda ops: len(ops) > 0 and numbers(ops),
+    '>=': lambda ops: len(ops) > 0 and numbers(ops),
+    '=':  lambda ops: len(ops) > 1,
+    '/=': lambda ops: len(ops) > 1,
+    '!':  lambda ops: len(ops) > 0,
+    '^^': lambda ops: len(ops) == 2,
+    '&&': lambda ops: True,
+    '||': lambda ops: True,
+    'string': lambda ops: True,
+    'repr':   lambda ops: True,
+}
+
+# The literal node giving `value', or None if there's no such thing.
+def literal(value, location):
+    t = type(value)
+    if t is V.Atomise:
+        return tree.Atom(value.name, location)
+    if t is str:
+        return tree.String(value, location)
+    if t is int or (t is float and math.isfinite(value)):
+        return tree.Numeric(value, location)
+    return None
+
+# Whether the literal `node' counts as true, as `if' sees it.
+def truth(node):
+    if type(node) is tree.Atom:
+        return node.value != ':false'
+    return not not node.value
+
+# `node', with the given `head' and `operands', made anew if they aren't
+#   the ones it has.
+def remake(node, head, operands):
+    if head is node.value and all(map(lambda a, b: a is b, operands, node.operands)):
+        return node
+    new = type(node).adopt(head, node.location, operands)
+    new.shorthand = node.shorthand
+    return new
+
+# Where the body of the `λ', `->' or `define' in `node' is, if it's the
+#   shape of one.
+def body(name, node):
+    if name == 'define':
+        if resolving.signature(node) is None:
+            return None
+        return 1 if type(node.operands[0]) is tree.Call else 2
+    if resolving.parameters(node) is None:
+        return None
+    return 0 if name == '->' else 1
+
+# `node', folded, where the names in `bound' are bound in the scopes
+#   around it (or None, if they can't be told).
+def fold(node, bound=frozenset()):
+    t = type(node)
+    if t is tree.Yield:
+        inside = fold(node.value, bound)
+        return node if inside is node.value else tree.Yield(inside, node.location)
+    if t is not tree.Call or node.value is None:
+        return node
+    head = node.value
+    name = None
+    if type(head) is tree.Symbol and head.value in V.MACROS:
+        name = head.value
+    if name in resolving.UNEVALUATED:
+        return node
+    if name in ('λ', '->', 'define'):
+        i = body(name, node)
+        if i is None:
+            return node
+        # What the body binds is only known once its `eval's are gone,
+        #   then calls in it may be inlined.
+        inside = fold(node.operands[i], None)
+        if inlining() and bound is not None and not resolving.opaque(inside):
+            made = resolving.parameters(node) if name != 'define' else resolving.signature(node)
+            inside = fold(inside, bound.union(made[-2], resolving.binders(inside)))
+        operands = list(node.operands)
+        operands[i] = inside
+        return remake(node, head, operands)
+    if name in ('let', 'mutate'):
+        operands = [op if type(op) is not tree.Call
+            else remake(op, op.value, [fold(e, bound) for e in op.operands])
+            for op in node.operands]
+        return remake(node, head, operands)
+
+    operands = [fold(op, bound) for op in node.operands]
+    if name is None:
+        return inline(remake(node, fold(head, bound), operands), bound)
+    if name == 'eval' and len(operands) == 1 and type(operands[0]) is tree.Uneval:
+        STATS['unquoted'] += 1
+        return fold(operands[0].value, bound)
+    if (name == 'if' or name == 'unless') and len(operands) > 1:
+        if type(operands[0]) in LITERALS:
+            STATS['pruned'] += 1
+            if truth(operands[0]) != (name == 'unless'):
+                return operands[1]
+            return operands[2] if len(operands) > 2 else tree.Nil(node.location)
+    node = remake(node, head, operands)
+    if (name in PURE and all(type(op) in LITERALS for op in operands)
+    and PURE[name](operands)):
+        value = literal(V.MACROS[name](node), node.location)
+        if value is not None:
+            STATS['folded'] += 1
+            return value
+    return node
+
+SIZE = 16  # How many nodes the body of a function inlined may have.
+
+# The engines that evaluate what's in a call's `inline'.
+INLINING = ('tree', 'closure', 'machine')
+
+def inlining():
+    return conf.OPT_LEVEL >= 2 and conf.ENGINE in INLINING
+
+# Built-ins a body to be inlined may call: those that only give a value.
+SAFE = set(PURE) | {'if', 'unless', 'index', 'size', 'type', 'name', 'list'}
+
+# `Body` is what's known of the body of a function that may be inlined:
+#        its `tree', the names of its arguments (`args'), how many times
+#        each is used (`uses'), and how many of those are sure to be
+#        evaluated, those being in `order', and the names of the
+#        functions it calls (`free'), which it finds at the top level.
+class Body(object):
+    __slots__ = ('tree', 'args', 'uses', 'order', 'free')
+    def __init__(self, branch, args):
+        self.tree = branch
+        self.args = args
+        self.uses = dict((arg, [0, 0]) for arg in args)
+        self.order = []
+        self.free = set()
+
+TEMPLATES = weakref.WeakKeyDictionary()  # Bodies by `Definition'.
+
+# The `Body' of `definition', if it can be inlined: it must be defined at
+#   the top level, and be small, with a body of nothing but literals, its
+#   arguments, and calls of `SAFE' built-ins and other functions that can
+#   be inlined (other than those in `visiting', which would recurse).
+def template(definition, visiting=()):
+    if definition in TEMPLATES:
+        return TEMPLATES[definition]
+    made = None
+    if (definition.frame is V.MAIN and definition not in visiting
+    and type(definition.code) is not V.Memo):
+        made = look_over(definition, visiting + (definition,))
+    TEMPLATES[definition] = made
+    return made
+
+def look_over(definition, visiting):
+    args = definition.scope.args
+    if any(arg in V.MACROS for arg in args):
+        return None
+    made = Body(definition.tree, args)
+    size = 0
+    stack = [(definition.tree, True)]
+    while stack:
+        node, sure = stack.pop()
+        size += 1
+        if size > SIZE:
+            return None
+        t = type(node)
+        if t in LITERALS or t is tree.Nil:
+            continue
+        if t is tree.Uneval:
+            if type(node.value) is tree.Call:
+                return None  # Each call would need its own copy.
+            continue
+        if t is tree.Symbol:
+            if node.value in made.uses:
+                use = made.uses[node.value]
+                use[0] += 1
+                if sure:
+                    use[1] += 1
+                    made.order.append(node.value)
+            elif node.value not in V.MACROS:
+                return None
+            continue
+        if t is not tree.Call or type(node.value) is not tree.Symbol:
+            return None
+        name = node.value.value
+        if name in V.MACROS:
+            if name not in SAFE:
+                return None
+        else:
+            cell = resolving.GLOBALS.get(name)
+            if (name in made.uses or cell is None or type(cell.value) is not V.Definition
+            or template(cell.value, visiting) is None):
+                return None
+            made.free.add(name)
+        branches = name == 'if' or name == 'unless'
+        for i in reversed(range(len(node.operands))):
+            stack.append((node.operands[i], sure and not (branches and i > 0)))
+    return made
+
+# Whether evaluating `node' has no effect.
+def pure(node):
+    t = type(node)
+    if t in LITERALS or t is tree.Nil or t is tree.Uneval:
+        return True
+    if t is tree.Symbol:
+        return node.value not in resolving.SPECIAL
+    if t is tree.Call and type(node.value) is tree.Symbol and node.value.value in SAFE:
+        return all(map(pure, node.operands))
+    return False
+
+# Whether the arguments `args' can be put in the body `made', and give
+#   the same as evaluating each of them once, in order, beforehand: each
+#   is used just once, and is sure to be, in the order they're given,
+#   unless it's a literal, or unless none of them have an effect, and it
+#   is a name that's sure to be used.
+def suitable(made, args):
+    effects = not all(map(pure, args))
+    if effects and made.free:
+        return False  # The function called is looked up in between.
+    used = []
+    for arg, name in zip(args, made.args):
+        count, sure = made.uses[name]
+        if type(arg) in LITERALS:
+            continue
+        if not effects and type(arg) is tree.Symbol and sure > 0:
+            continue
+        if count != 1 or sure != 1:
+            return False
+        used.append(made.order.index(name))
+    return not effects or used == sorted(used)
+
+# A copy of `node', with the names in `slots' replaced by their values.
+def substitute(node, slots):
+    t = type(node)
+    if t is tree.Symbol:
+        return slots.get(node.value, node)
+    if t is not tree.Call:
+        return node
+    return tree.Call.adopt(node.value, node.location,
+        [substitute(op, slots) for op in node.operands])
+
+# The call `node', given the body of the function it's of, if that may
+#   be inlined.  Only globals not bound in any scope around it are, and
+#   only if none of the functions their body calls are either.
+def inline(node, bound):
+    head = node.value
+    if (not inlining() or bound is None or node.inline is not None
+    or type(head) is not tree.Symbol or head.value in bound):
+        return node
+    cell = resolving.GLOBALS.get(head.value)
+    if cell is None or type(cell.value) is not V.Definition:
+        return node
+    definition = cell.value
+    made = template(definition)
+    if (made is None or len(node.operands) != len(made.args)
+    or not made.free.isdisjoint(bound) or not suitable(made, node.operands)):
+        return node
+    branch = fold(substitute(made.tree, dict(zip(made.args, node.operands))), bound)
+    new = tree.Call.adopt(head, node.location, node.operands)
+    new.shorthand = node.shorthand
+    new.inline = (definition, branch)
+    STATS['inlined'] += 1
+    return new
+
+# The top-level form `form', optimised as far as `conf.OPT_LEVEL' says.
+def optimise(form):
+    if conf.OPT_LEVEL < 1 or conf.RECOVERING_FROM_ERROR:
+        return form
+    # Folding evaluates built-ins, which mustn't show.
+    location, last = V.CURRENT_LOCATION, V.LAST_EVALUATED
+    try:
+        form = fold(form)
+    except RecursionError:
+        pass  # Too deep to fold on Python's stack, it's run as it is.
+    V.CURRENT_LOCATION, V.LAST_EVALUATED = location, last
+    return form
+
+# Optimises each form of `AST', in place, unless calls are being inlined,
+#   when each form is left to be optimised as it's reached.
+def optimise_tree(AST):
+    if inlining():
+        return AST
+    for i in range(len(AST)):
+        AST[i] = optimise(AST[i])
+    return AST
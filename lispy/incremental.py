@@ -0,0 +1,218 @@
+from . import lexing
+from . import parsing
+from . import tree
+from . import source
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# `Document` keeps a buffer alongside its tokens and parse tree, so that
+#            after an edit only the damaged top-level forms are lexed and
+#            parsed again.  The buffer is cut into segments, one for each
+#            top-level form, every segment running from the first token of
+#            its form up to the first token of the next.  Each segment
+#            is positioned in a piece of the buffer of its own (see
+#            `source.Part'), so moving a segment along, after an edit
+#            ahead of it, is a matter of moving its piece, and an edit
+#            costs what's lexed and parsed again, not the size of the
+#            rest of the buffer.
+#
+#   i.e.  doc = Document('(puts 1)\n(puts 2)\n', 'buffer.lispy')
+#         doc.edit(6, 1, '10')   # (puts 1) => (puts 10)
+#         doc.tree[1]            # the same `(puts 2)' node as before.
+class Document(object):
+    def __init__(self, string, file):
+        self.file = file
+        self.origin = source.register(file)  # The buffer's own positions.
+        self.build(string)
+
+    # Lex and parse the whole buffer from scratch.
+    def build(self, string):
+        self.string = string
+        self.head   = []  # Tokens before the first form (new lines).
+        self.starts = []  # Source offset of each segment.
+        self.segments = []  # Tokens of each segment.
+        self.parts = []  # Piece of the buffer each segment is in.
+        self.eof = None
+        self.tree = tree.Tree(self.file)
+        self.relexed = 0
+        self.reparsed = 0
+        self.reused = 0
+        self.origin.load(string)
+
+        scanner = lexing.Scanner(self.reader(0), self.file,
+            make=self.token, origin=self.origin)
+        split = self.split(scanner, self.head)
+        if split is None or scanner.error is not None:
+            # Lex it all again, so the error is reported as usual.
+            if scanner.error is None:
+                lexing.lex(string, self.file)
+            self.tree.push(tree.Nil(source.IMPLICIT
+                if scanner.error is None else scanner.error))
+            return self.tree
+        self.starts, self.segments, self.eof, _ = split
+        self.parts = self.place(self.starts, self.segments)
+        self.tree.extend(self.parse(self.segments))
+        return self.tree
+
+    # Apply an edit, replacing `removed' characters at `offset' with the
+    #   `inserted' text.  Returns the (same, updated) `tree.Tree', any
+    #   form that lies wholly outside the edit is kept by identity.
+    def edit(self, offset, removed, inserted):
+        string = self.string[:offset] + inserted + self.string[offset + removed:]
+        delta = len(inserted) - removed
+        if self.eof is None:  # Last time round didn't lex, start over.
+            return self.build(string)
+        self.string = string
+        self.lines(offset, removed, inserted)
+        self.origin.text = string
+
+        # Start from the segment before the edit, since an edit right at a
+        #   boundary may join on to the end of the form before it.
+        first = bisect_left(self.starts, offset) - 1
+        start = self.starts[first] if first >= 0 else 0
+
+        edited = offset + len(inserted)  # End of the edit in the new buffer.
+        def resync(at, token):
+            return self.resync(at, token, edited, delta, first)
+
+        head = []
+        scanner = lexing.Scanner(self.reader(start), self.file,
+            make=self.token, start=start, origin=self.origin)
+        split = self.split(scanner, head, resync)
+        if split is None or scanner.error is not None:
+            return self.build(string)
+        starts, segments, eof, last = split
+        if first < 0:
+            self.head = head
+        first = max(first, 0)
+
+        # Shift everything after the point we caught up with the old tokens.
+        if last is None:
+            last = len(self.segments)
+        else:
+            segments.pop()
+            starts.pop()
+            if delta:
+                for i in range(last, len(self.segments)):
+                    self.starts[i] += delta
+                    self.parts[i].start += delta
+                self.eof.location += delta
+            eof = self.eof
+
+        self.relexed = sum(map(len, segments))
+        self.reparsed = len(segments)
+        self.reused = len(self.segments) - (last - first)
+        self.starts[first:last] = starts
+        self.segments[first:last] = segments
+        self.parts[first:last] = self.place(starts, segments)
+        self.eof = eof
+        self.tree[first:last] = self.parse(segments)
+        return self.tree
+
+    # Lets go of the buffer, once the document is done with.
+    def close(self):
+        self.origin.unload()
+
+    # Brings the line table up to date with an edit, the lines
+    #   starting after it are moved along by the change in length.
+    def lines(self, offset, removed, inserted):
+        lines = self.origin.lines
+        delta = len(inserted) - removed
+        tail = lines[bisect_right(lines, offset + removed):]
+        self.origin.lines = array('q', lines[:bisect_right(lines, offset)])
+        self.origin.scan(inserted, offset)
+        self.origin.lines.extend(start + delta for start in tail)
+
+    # A new form starting at offset `at' (in the edited buffer) lets us
+    #   stop lexing if it's past the edit, and is exactly where an old
+    #   segment started; gives that segment's index.
+    def resync(self, at, token, edited, delta, first):
+        if at < edited:
+            return None
+        i = bisect_left(self.starts, at - delta)
+        if (i <= first or i >= len(self.starts)
+        or self.starts[i] != at - delta):
+            return None
+        return i
+
+    # Groups the tokens given by `scanner' into top-level segments.  If
+    #   `resync' finds an old segment to carry on from, the new token
+    #   starting that segment is left as the last segment on its own.
+    #   Gives None on a stray R_PAREN, for the full lexer to report.
+    def split(self, scanner, head, resync=None):
+        starts = []
+        segments = []
+        depth = 0
+        quoted = False  # After a top-level `'', the next form is its own.
+        for token, at in scanner:
+            kind = token.type
+            if kind == 'EOF':
+                return starts, segments, token, None
+            if depth == 0 and kind != 'TERMINATOR':
+                if kind == 'R_PAREN':
+                    return None
+                if not quoted:
+                    last = resync and resync(at, token)
+                    starts.append(at)
+                    segments.append([token])
+                    if last is not None:
+                        return starts, segments, None, last
+                else:
+                    segments[-1].append(token)
+                quoted = kind == 'UNEVAL'
+            elif segments:
+                segments[-1].append(token)
+            else:
+                head.append(token)
+
+            if kind == 'L_PAREN':
+                depth += 1
+            elif kind == 'R_PAREN':
+                depth -= 1
+        return starts, segments, None, None
+
+    # Gives each segment a piece of the buffer, from where it starts, and
+    #   moves its tokens into that piece.
+    def place(self, starts, segments):
+        parts = []
+        zero = self.origin.base
+        for start, segment in zip(starts, segments):
+            piece = source.part(self.origin, start)
+            moved = piece.base - zero - start
+            for token in segment:
+                token.location += moved
+            parts.append(piece)
+        return parts
+
+    # Parses each segment's tokens, giving one node per segment.
+    def parse(self, segments):
+        stream = lexing.TokenStream(self.file)
+        for segment in segments:
+            stream.push(segment)
+        stream.push(self.eof or lexing.EOF_TOKEN)
+        if not segments:
+            return []
+        return list(parsing.parse(stream))
+
+    def token(self, kind, string, position):
+        return lexing.Token(kind, string, position), position - self.origin.base
+
+    def reader(self, position):
+        position = [position]
+        def read(size):
+            size = max(size, lexing.CHUNK_SIZE)
+            chunk = self.string[position[0]:position[0] + size]
+            position[0] += len(chunk)
+            return chunk
+        return read
+
+    # The token stream of the whole buffer, as `lexing.lex' would give it.
+    @property
+    def stream(self):
+        stream = lexing.TokenStream(self.file, list(self.head))
+        for segment in self.segments:
+            stream.push(segment)
+        if self.eof is not None:
+            stream.push(self.eof)
+        return stream
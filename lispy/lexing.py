@@ -1,7 +1,8 @@
 from . import err
-import re, ast
-
-import copy
+from . import source
+import re, ast, codecs
+from array import array
+from itertools import compress
 
 EOF = '\0'
 
@@ -12,39 +13,31 @@ exp = re.compile
 #   (Atoms and Symbols are the only identifiers)
 SYMS = r"_a-zA-Zα-ωΑ-Ω\+\-\=\<\>\*\/\%\^\&\:\$\£\#\~\`\|\\\¬\,\.\?\!\@"
 IDENT_STR = r"[{syms}][0-9\'{syms}]*".format(syms=SYMS)
-                                         # e.g.
-L_PAREN    = exp(r"\A\(")                # '('
-R_PAREN    = exp(r"\A\)")                # ')'
-NIL        = exp(r"\Anil")               # 'nil'
-SYMBOL     = exp(r"\A" + IDENT_STR)      # 'hello-world'
-UNEVAL     = exp(r"\A\'")                # '
-ATOM       = exp(r"\A\:+[0-9" + IDENT_STR[1:])  # ':good-bye'
-NUMERIC    = exp(r"\A[0-9]+(\.[0-9]+)?([xob][0-9a-fA-F]+)?(e[\+\-]?)?[0-9a-fA-F]*")
-TERMINATOR = exp(r"\A\n")
-STRING     = exp(r"\A([\"'])((\\{2})*|(.*?[^\\](\\{2})*))\1")
+
 # `Token` object is a chunk of the code we're interpreting;
 #         it holds the type of thing it is as well as what
-#         exactly the writer has written and at what line and
-#         column it was written as
+#         exactly the writer has written and where it was
+#         written, as a position (see "source.py")
 # i.e.  (a 3)    ==>    <Token[L_PAREN] '(' (1:1)>,
 #                       <Token[SYMBOL]  'a' (1:2)>,
 #                       <Token[NUMERIC] '3' (1:4)>,
 #                       <Token[R_PAREN] ')' (1:5)>
-impl_loc = {'line':-1,'column':-1, 'filename':'IMPLICIT'}
 class Token(object):
-    def __init__(self, token_type, string, loc=impl_loc):
+    __slots__ = ('type', 'string', 'location', 'span')
+    def __init__(self, token_type, string, loc=source.IMPLICIT):
         self.type = token_type
         self.string = string
         self.location = loc
-        self.location['span'] = len(string) + [0, 2][self.type == 'STRING']
+        self.span = len(string) + (2 if token_type == 'STRING' else 0)
 
     def __str__(self):
+        _, line, column = source.resolve(self.location)
         return "<Token({}) '{}' ({}:{}) [span: {}]>".format(
             self.type,
             self.string,
-            self.location['line'],
-            self.location['column'],
-            self.location['span']
+            line,
+            column,
+            self.span
         )
 
 EOF_TOKEN = Token('EOF', EOF)
@@ -118,7 +111,7 @@ class TokenStream(object):
 
     def __str__(self):
         def form(s): # A nice string repr. of the stream.
-            loc = [s.location['line'], s.location['column']]
+            loc = list(source.resolve(s.location)[1:])
             return '<Token({}) {} {} ... {}>'.format(
                 s.type,
                 '.' * (24 - (len(s.type) + len(str(loc)))),
@@ -127,219 +120,420 @@ class TokenStream(object):
             )
         return '\n'.join(map(form, self.tokens))
 
-# Simple stack-based algo for checking the amount of
-#  opening parens to the amount of closing, and giving a
-#  helpful error message
-def paren_balancer(stream):
-    stream = copy.copy(stream)  # Create a shallow copy of the stream
-    stack = []                  # in order to derefrence the original stream.
-    balanced = True
-    location = None
-
-    while stream.current() != EOF_TOKEN:
-        location = stream.current().location
-        if stream.current().type == 'L_PAREN':
-            stack.append(0)
-        elif stream.current().type == 'R_PAREN':
-            if len(stack) == 0:
-                balanced = False
+# The master pattern, every token kind the lexer knows about is
+#   an alternative in this one regex, tried in order, so the first
+#   kind that fits is the one given.  It is matched positionally with
+#   `MASTER.match(string, i)', so the program is never sliced.
+MASTER = exp(r"""
+ (?P<COMMENT>    ;[^\n\0]*                      )
+|(?P<L_PAREN>    \(                             )
+|(?P<R_PAREN>    \)                             )
+|(?P<NIL>        nil(?![{syms}])                )
+|(?P<UNEVAL>     '                              )
+|(?P<STRING>     "((?:[^"\\\0]|\\[^\0])*)"      )
+|(?P<OPEN_STRING>"                              )
+|(?P<ATOM>       \:+[0-9{ident}                 )
+|(?P<SYMBOL>     {ident_str}                    )
+|(?P<NUMERIC>    [0-9]+(\.[0-9]+)?([xob][0-9a-fA-F]+)?(e[\+\-]?)?[0-9a-fA-F]*)
+|(?P<TERMINATOR> \n                             )
+|(?P<EOF>        \0                             )
+|(?P<SKIP>       [ \t\r]+|.                     )
+""".replace('{syms}', SYMS).replace('{ident}', IDENT_STR[1:]).replace(
+    '{ident_str}', IDENT_STR), re.VERBOSE | re.DOTALL)
+
+# Escape sequences understood inside string literals, anything
+#   more exotic (\x.., \u...., octal, ...) is left to `literal_eval'.
+ESCAPES = {
+    '\\': '\\', "'": "'", '"': '"',
+    '\n': '', '\r': '', '\r\n': '',
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n',
+    'r': '\r', 't': '\t', 'v': '\v'
+}
+ESCAPE = exp(r"\\(\r\n|.)", re.DOTALL)
+NEWLINE_OR_ESCAPE = exp(r"\\.|\n", re.DOTALL)
+
+def unescape(body):
+    if '\\' not in body:
+        return body
+    def sub(match):
+        c = match.group(1)
+        if c in ESCAPES:
+            return ESCAPES[c]
+        if c in 'xuUN01234567':
+            raise ValueError(c)
+        return match.group()
+    try:
+        return ESCAPE.sub(sub, body)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval('"' + NEWLINE_OR_ESCAPE.sub(
+            lambda m: '\\n' if m.group() == '\n' else m.group(), body) + '"')
+    except SyntaxError:  # Malformed, so leave those escapes be.
+        return ESCAPE.sub(lambda m: ESCAPES.get(m.group(1), m.group()), body)
+
+# How much of a file is read at a time by the streaming lexer,
+#   and how many characters past the end of a match must already
+#   be buffered before we trust it (e.g. `1.' could still be `1.5').
+CHUNK_SIZE = 1 << 16
+LOOKAHEAD  = 4
+
+# `Scanner` walks over text handed to it by `read', one chunk
+#           at a time, yielding tokens as soon as they are complete.
+#           Any token (strings, comments, ...) can straddle a chunk
+#           boundary.  On a syntax error `error' holds the offending
+#           position.  What gets yielded is up to `make', which is
+#           given the kind, text and position of each token.
+#           Tokens are positioned in the `origin' source, by default
+#           the one named `file', whose line table is then filled in
+#           as it is read (and which keeps the `text' being read, if
+#           all of it was to hand).  Scanning may start part way into a source,
+#           from the `start' offset of a token known to be outside of
+#           any string or comment.
+class Scanner(object):
+    def __init__(self, read, file, EX=None, make=None, start=0, origin=None,
+                 text=None):
+        self.read = read  # read(size) returns '' once exhausted.
+        self.file = file
+        self.EX = EX or err.Thrower(err.LEX, file)
+        self.error = None
+        self.make = make or Token
+        self.start = start
+        self.lines = origin is None  # Whether to fill in the line table.
+        self.origin = origin or source.lookup(file)
+        self.text = text
+
+    def __iter__(self):
+        match = MASTER.match
+        make = self.make
+        origin = self.origin
+        if self.lines:
+            origin.reset()
+            origin.text = self.text
+
+        string = ''
+        final = False
+        # Offset in the source of the start of `string', and
+        #   the position of the start of the source.
+        base = self.start
+        zero = origin.base
+        i = 0
+
+        # Parentheses are balanced as we go, rather than in a second pass.
+        depth = 0
+        opens = 0
+        close = 0
+        excess = None
+        previous = None  # Where the last token handed out was.
+
+        while True:
+            m = match(string, i)
+            if m is None or (not final and (
+                    len(string) - m.end() < LOOKAHEAD
+                    or m.lastgroup == 'OPEN_STRING')):
+                # Read at least as much again as we're holding on to,
+                #   so a very long token is not rescanned over and over.
+                chunk = self.read(len(string) - i)
+                final = not chunk
+                if self.lines:
+                    origin.scan(chunk, base + len(string))
+                string = string[i:] + (EOF if final else chunk)
+                base += i
+                i = 0
+                continue
+
+            kind = m.lastgroup
+            end = m.end()
+
+            if kind == 'SKIP' or kind == 'COMMENT':
+                i = end
+                continue
+
+            here = zero + base + i
+            if kind == 'TERMINATOR':
+                text = "\n"
+                token = make('TERMINATOR', text, here)
+            elif kind == 'EOF':
                 break
+            elif kind == 'STRING':
+                text = unescape(string[i + 1:end - 1])
+                token = make('STRING', text, here)
+            elif kind == 'OPEN_STRING':
+                # The string runs on to the end of the source, point
+                #   at the last character of it.
+                end = len(string) - 2
+                self.error = zero + base + end
+                self.EX.throw(self.error,
+                    'Unexpected EOF while reading string,\n'
+                    + 'please check that you closed your quote...', span=1)
+                return
             else:
-                stack.pop()
-
-        stream.next()
-
-    opens = 0
-    close = 0
-    for t in stream.tokens: # Keep track of opens vs. closes
-        if t.type == 'L_PAREN': opens += 1
-        if t.type == 'R_PAREN': close += 1
-
-    # If the stack is empty, we've too many, otherwise to little closing parens.
-    message = ('Unbalanced amount of parentheses,\n'
-        + 'consider removing {} of them...'.format(close - opens))
-    if len(stack) != 0:
-        location = stream.tokens[-2].location
-        message = 'Missing {} closing parentheses...'.format(len(stack))
-    elif close - opens < 1:
-        message = 'Invalid arrangement of parentheses, this means nothing.'
-    return {
-        'balanced': balanced and len(stack) == 0,
-        'location': location,
-        'message': message
-    }
+                if kind == 'L_PAREN':
+                    opens += 1
+                    if excess is None:
+                        depth += 1
+                elif kind == 'R_PAREN':
+                    close += 1
+                    if excess is None:
+                        if depth == 0:
+                            excess = here
+                        else:
+                            depth -= 1
+                text = string[i:end]
+                token = make(kind, text, here)
+
+            # Past a stray R_PAREN nothing more is handed out, we only
+            #   keep counting parentheses for the error message.
+            if excess is None:
+                previous = here, end - i
+                yield token
+            i = end
+
+        # Check we have a balanced amount of L_PARENS to R_PARENS
+        if excess is not None or depth != 0:
+            location = excess
+            span = 1
+            # If the stack is empty, we've too many, otherwise to little closing parens.
+            message = ('Unbalanced amount of parentheses,\n'
+                + 'consider removing {} of them...'.format(close - opens))
+            if excess is None:
+                location, span = previous
+                message = 'Missing {} closing parentheses...'.format(depth)
+            elif close - opens < 1:
+                message = 'Invalid arrangement of parentheses, this means nothing.'
+            self.error = location
+            self.EX.throw(self.error, message, span=span)
+            return
+
+        yield make('EOF', EOF, zero + base + i)
+
+# Gives the whole string on the first read, and nothing after that.
+def string_reader(string):
+    chunks = [string]
+    def read(size):
+        return chunks.pop() if chunks else ''
+    return read
+
+# Where the tokens of a `string' not from the file itself go.
+def origin(string, file, nofile):
+    return source.text(file, string) if nofile else None
 
 def lex(string, file, nofile=False):
     EX = err.Thrower(err.LEX, file)
-    filename = file
     if nofile:
         EX.nofile(string)
 
-    string += EOF
-    stream = TokenStream(file)
-    i = 0
-    line = 1  # Initialise location variables
-    column = 1
-
-    match = None # Loop though the string, shifting off the string list.
-    while i < len(string):
-        partial = string[i::] # Match against the program, cut off slightly
-                              # more every time.
-
-        # Add EOF token at End Of File:
-        if partial[0] == EOF:
-            stream.add(Token('EOF', partial[0], {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            break
-
-        # Ignore comments, we dont need them in our token stream.
-        if partial[0] == ';':
-            j = 0
-            while partial[j] != '\n' and partial[j] != EOF:
-                j += 1
-            i += j
-            column += j
-            continue
-
-        # Match L_PAREN
-        if partial[0] == '(':
-            stream.add(Token('L_PAREN', partial[0], {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            i += 1
-            column += 1
-            continue
-
-        # Match R_PAREN
-        if partial[0] == ')':
-            stream.add(Token('R_PAREN', partial[0], {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            i += 1
-            column += 1
-            continue
-
-        # Match Nil token
-        if partial[:3] == 'nil' and not SYMBOL.match(partial[3]):
-            stream.add(Token('NIL', partial[:3], {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            i += 3
-            column += 3
-            continue
-
-        # Match unevaluator
-        if partial[0] == "'":
-            stream.add(Token('UNEVAL', "'", {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            i += 1
-            column += 1
-            continue
-
-        # Match string
-        if partial[0] == '"':
-            contents = ""
-            j = 1
-            loc = {'line': line, 'column': column, 'filename': filename}
-            while partial[j] != '"':
-                if partial[j+1] == EOF:
-                    l = {'line': line, 'column': column+1, 'filename': filename}
-                    EX.throw(l,
-                        'Unexpected EOF while reading string,\n'
-                        + 'please check that you closed your quote...')
-                    stream = TokenStream(stream.file)
-                    stream.add(Token('NIL', 'nil', l))
-                    return stream
-                if partial[j] == '\n':
-                    contents += '\\n'
-                    line += 1
-                    column = 1
-                    j += 1
-                    continue
-                if partial[j] == '\\':
-                    contents += '\\' + partial[j+1]
-                    j += 2
-                    column += 1
-                    continue
-                contents += partial[j]
-                column += 1
-                j += 1
-
-            contents = '"' + contents + '"'
-            stream.add(Token('STRING', ast.literal_eval(contents), loc))
-            i += j + 1
-            column += 2
-            continue
-
-        # Match an atom
-        match = ATOM.match(partial)
-        if match:
-            stream.add(Token('ATOM', match.group(), {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            span = len(match.group())
-            i += span
-            column += span
-            continue
-
-        # Match a symbol
-        match = SYMBOL.match(partial)
-        if match:
-            stream.add(Token('SYMBOL', match.group(), {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            span = len(match.group())
-            i += span
-            column += span
-            continue
-
-        # Match a numeric
-        match = NUMERIC.match(partial)
-        if match:
-            stream.add(Token('NUMERIC', match.group(), {
-                'line': line,
-                'column': column,
-                'filename': filename
-            }))
-            span = len(match.group())
-            i += span
-            column += span
-            continue
-
-        column += 1 # Terminators are useless, but I might use them.
-        if partial[0] == "\n":
-            stream.add(Token('TERMINATOR', "\n", {
-                'line': line,
-                'column': column - 1,
-                'filename': filename
-            }))
-            i += 1
-            line += 1
-            column = 1
-            continue
-        i += 1
-
-    # Check we have a balanced amount of L_PARENS to R_PARENS
-    balancer = paren_balancer(stream)
-    if not balancer['balanced']:
-        EX.throw(balancer['location'], balancer['message'])
-        stream = TokenStream(stream.file)
-        stream.add(Token('NIL', 'nil', balancer['location']))
+    scanner = Scanner(string_reader(string), file, EX,
+        origin=origin(string, file, nofile), text=string)
+    stream = TokenStream(file, list(scanner))
+    if scanner.error is not None:
+        stream = TokenStream(file)
+        stream.add(Token('NIL', 'nil', scanner.error))
+    return stream
+
+# `tokenize` lazily yields the tokens of a file, given either its
+#            path or an open file object, reading it `chunk_size'
+#            characters at a time.  A syntax error ends the tokens
+#            with a NIL token, just like `lex' would give.
+def tokenize(source, file=None, chunk_size=CHUNK_SIZE):
+    opened = isinstance(source, str)
+    if opened:
+        file = file or source
+        source = codecs.open(source, 'r', 'utf-8')
+    elif file is None:
+        file = getattr(source, 'name', '<stream>')
+
+    scanner = Scanner(lambda size: source.read(max(size, chunk_size)), file)
+    try:
+        yield from scanner
+        if scanner.error is not None:
+            yield Token('NIL', 'nil', scanner.error)
+    finally:
+        if opened:
+            source.close()
+
+# `LazyTokenStream` is a `TokenStream` filled from a token iterator
+#                   only as far as the parser has looked, tokens well
+#                   behind the current one are thrown away again.
+#                   `size' is therefore only the amount seen so far.
+class LazyTokenStream(TokenStream):
+    HISTORY = 16     # Tokens kept behind the current one, for `behind'.
+    RELEASE = 4096   # Only drop consumed tokens in batches this large.
+
+    def __init__(self, file, tokens):
+        TokenStream.__init__(self, file)
+        self.source = iter(tokens)
+        self.offset = 0  # Absolute index of `self.tokens[0]'.
+        self.ignored = set()
+        self.exhausted = False
+
+    def fill(self, j):
+        while not self.exhausted and self.offset + len(self.tokens) <= j:
+            token = next(self.source, None)
+            if token is None:
+                self.exhausted = True
+            elif token.type not in self.ignored:
+                self.tokens.append(token)
+
+    def at(self, j):
+        self.fill(j)
+        if j >= self.size():
+            return EOF_TOKEN
+        return self.tokens[j - self.offset]
+
+    def size(self):
+        return self.offset + len(self.tokens)
+
+    def release(self):
+        dead = self.i - self.offset - self.HISTORY
+        if dead > self.RELEASE:
+            del self.tokens[:dead]
+            self.offset += dead
+
+    def current(self):
+        return self.at(self.i)
+
+    def next(self, j = 1):
+        self.i += j
+        self.release()
+        return self.at(self.i)
+
+    def ahead(self, j = 1):
+        return self.at(self.i + j)
+
+    def back(self, j = 1):
+        self.i -= j
+        return self.at(self.i)
+
+    def behind(self, j = 1):
+        return self.at(self.i - j)
+
+    def purge(self, type):
+        self.ignored.add(type)
+        self.tokens = [t for t in self.tokens if t.type != type]
+        return self.tokens
+
+# Lazily lex a whole file, for handing straight to the parser.
+def lex_file(source, file=None):
+    if file is None:
+        file = source if isinstance(source, str) else getattr(
+            source, 'name', '<stream>')
+    return LazyTokenStream(file, tokenize(source, file))
+
+# `StringTable` interns lexemes, so every occurrence of e.g. `define'
+#               or `(' is one shared string referred to by its index.
+class StringTable(object):
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def intern(self, string):
+        i = self.index.get(string)
+        if i is None:
+            i = self.index[string] = len(self.strings)
+            self.strings.append(string)
+        return i
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings)
+
+KINDS = ['L_PAREN', 'R_PAREN', 'NIL', 'UNEVAL', 'STRING', 'ATOM',
+         'SYMBOL', 'NUMERIC', 'TERMINATOR', 'EOF']
+KIND_INDEX = {kind: i for i, kind in enumerate(KINDS)}
+
+# `CompactTokenStream` stores its tokens as a struct of arrays, one
+#                      `array' per field, with the lexemes kept in a
+#                      `StringTable'.  `Token' objects are only made when
+#                      asked for, through the usual `TokenStream' methods.
+class CompactTokenStream(TokenStream):
+    FIELDS = ('kinds', 'starts', 'lexemes')
+
+    def __init__(self, file, table=None, base=None):
+        self.file = file
+        self.table = table or StringTable()
+        self.base = source.lookup(file).base if base is None else base
+        self.kinds   = array('B')  # Index into `KINDS'.
+        self.starts  = array('Q')  # Offset of the token in the source.
+        self.lexemes = array('I')  # Index into `self.table'.
+        self.i = 0
+
+    def append(self, kind, string, position):
+        self.kinds.append(KIND_INDEX[kind])
+        self.starts.append(position - self.base)
+        self.lexemes.append(self.table.intern(string))
+
+    # Materialises the token at index `j' as a `Token' object.
+    def token(self, j):
+        return Token(KINDS[self.kinds[j]], self.table[self.lexemes[j]],
+            self.base + self.starts[j])
+
+    def size(self):
+        return len(self.kinds)
+
+    def current(self):
+        if self.i >= self.size():
+            return EOF_TOKEN
+        return self.token(self.i)
+
+    def push(self, token):
+        for t in (token if type(token) is list else [token]):
+            if source.file(t.location).base != self.base:
+                t = Token(t.type, t.string, self.base)  # Outside the source.
+            self.append(t.type, t.string, t.location)
+    add = push
+
+    def pop(self, j = -1):
+        token = self.token(j)
+        for field in self.FIELDS:
+            getattr(self, field).pop(j)
+        return token
+
+    def next(self, j = 1):
+        self.i += j
+        return self.current()
+
+    def ahead(self, j = 1):
+        if self.i + j >= self.size():
+            return EOF_TOKEN
+        return self.token(self.i + j)
+
+    def back(self, j = 1):
+        self.i -= j
+        return self.token(self.i)
+
+    def behind(self, j = 1):
+        return self.token(self.i - j)
+
+    def purge(self, type):
+        kind = KIND_INDEX[type]
+        keep = [k != kind for k in self.kinds]
+        for field in self.FIELDS:
+            column = getattr(self, field)
+            setattr(self, field, array(column.typecode, compress(column, keep)))
+
+    # Every token materialised, for code that wants a plain list.
+    #   (`push' and `purge' give nothing back, so as not to make them.)
+    @property
+    def tokens(self):
+        return [self.token(j) for j in range(self.size())]
+
+# Like `lex', but gives a `CompactTokenStream'.
+def lex_compact(string, file, nofile=False, table=None):
+    EX = err.Thrower(err.LEX, file)
+    if nofile:
+        EX.nofile(string)
 
+    where = origin(string, file, nofile)
+    base = (where or source.lookup(file)).base
+    stream = CompactTokenStream(file, table, base)
+    scanner = Scanner(string_reader(string), file, EX, stream.append,
+        origin=where, text=string)
+    for _ in scanner:
+        pass
+    if scanner.error is not None:
+        stream = CompactTokenStream(file, table, base)
+        stream.push(Token('NIL', 'nil', scanner.error))
     return stream
@@ -0,0 +1,354 @@
+from . import tree
+from . import closures
+from . import bytecode
+from . import visitor as V
+from . import resolving
+
+from . import config as conf
+
+from types import FunctionType as function
+
+# The CEK machine:
+#   `visitor.evaluate' recurses in Python for each node inside another, so
+#   every call of a `Definition' takes a handful of Python frames, and how
+#   deep Lispy code may recurse is bound by Python's recursion limit.  The
+#   machine (`run') evaluates a form in a loop instead, its state kept in
+#   three registers: the node being evaluated (the control), the frame it's
+#   evaluated in (the environment, `visitor.FRAME'), and a stack of what's
+#   left to do with the value it gives (the continuation), a list on the
+#   heap.  A call pushes what to go back to, popped once its body has given
+#   its value, so Lispy code may recurse for as long as there's memory, or
+#   rather, `conf.DEPTH_LIMIT' calls deep.
+#
+#   i.e.  (+ 1 (f x))  ;; Evaluating `(f x)' has pushed
+#
+#         (STRICT, <node of +>, [1], 2)  ;; and calling `f' pushes
+#         (RETURN, <frame of the caller>)  ;; before its body is evaluated.
+#
+#   A call in tail position, with nothing but a `RETURN' under it on the
+#   stack, is made in place of the call it ends (as with `visitor.TailCall'),
+#   so loops written as recursive functions don't fill the stack.
+#
+#   Built-ins whose arguments are evaluated the way `evaluate' would (`if',
+#   `do', `let', arithmetic, those in `closures.STRICT', ...) have them
+#   evaluated by the machine, the rest are handed their node as usual, as
+#   are `Definition's compiled by other engines.  A `Definition' made in the
+#   machine is walked by `evaluate' when anything but the machine calls it.
+#
+#   Select the engine with `conf.ENGINE', or `--engine=machine'.
+
+# What's left to do with a value, the first item of each continuation.
+RESULT, YIELDS, RETURN, HEAD, ARGS, IF, DO, ITERATE, LET, STRICT, \
+CHECK, ARITH, NUMBERS, COMPARE, INLINED = range(15)
+
+# Continuations that only pass the value on (`RESULT' having it kept
+#   as the last evaluated, `INLINED' as the last returned as well, from
+#   a body evaluated in place of a call, see "folding.py"), needn't be
+#   kept for a call in tail position.
+PASSING = (RESULT, YIELDS, INLINED)
+
+# Where comparisons fail.
+FAILS = {
+    '<':  lambda a, b: a >= b,
+    '>':  lambda a, b: a <= b,
+    '<=': lambda a, b: a > b,
+    '>=': lambda a, b: a < b,
+}
+
+ARITHMETIC = ('-', '*', '/', '%')
+
+# Symbols `evaluate' doesn't look up.
+UNNAMED = ('_', 'break', 'next')
+
+# The names of built-ins, by their function, for those bound to names
+#   of their own (as `unshift' is to `prepend').
+NAMES = {}
+
+# Whether `let' or `mutate' can bind what `node' gives it in the machine,
+#   otherwise it's left to complain.
+def bindable(node):
+    for arg in node.operands:
+        if (type(arg) is not tree.Call or not V.name_node(arg.value)
+        or len(arg.operands) == 0):
+            return False
+    return len(node.operands) > 0
+
+# How many arguments of `node' the built-in `name' is handed evaluated
+#   (see `closures.STRICT'), or None if it's to be handed its node.
+def strict(name, node):
+    if name not in closures.STRICT:
+        return None
+    least, most, evaluated = closures.STRICT[name]
+    count = len(node.operands)
+    if count < least or (most is not None and count > most):
+        return None
+    return count if evaluated is None else min(evaluated, count)
+
+# Evaluates `node', giving its value.
+def run(node):
+    stack = []
+    Call, Symbol, Yield, Uneval = tree.Call, tree.Symbol, tree.Yield, tree.Uneval
+    Numeric, Cell, UNBOUND = tree.Numeric, resolving.Cell, resolving.UNBOUND
+    Definition, Frame, MACROS = V.Definition, V.Frame, V.MACROS
+    false, true = V.ATOMS[':false'], V.ATOMS[':true']
+    result = (RESULT,)
+    if not NAMES:
+        NAMES.update((macro, name) for name, macro in MACROS.items())
+    while True:
+        # Evaluating `node', until there's a value to give on.  Numbers
+        #   and names (the leaves most often met) are evaluated here, as
+        #   `evaluate' would, the other leaves are left to it.
+        t = type(node)
+        if conf.RECOVERING_FROM_ERROR:
+            value = V.evaluate(node)
+        elif t is Numeric:
+            V.CURRENT_LOCATION = node.location
+            V.LAST_EVALUATED = value = node.value
+        elif (t is Symbol and node.value not in MACROS
+        and node.value not in UNNAMED):
+            V.CURRENT_LOCATION = node.location
+            # What `visitor.search' does, when the name is bound.
+            frame = V.FRAME
+            address = frame.scope.address(node.value)
+            if type(address) is Cell:
+                value = address.value
+            else:
+                depth, slot = address
+                while depth:
+                    frame = frame.parent
+                    depth -= 1
+                slots = frame.slots
+                value = slots[slot] if slot < len(slots) else UNBOUND
+            if value is UNBOUND:
+                value = V.search(V.FRAME, node.value)
+            V.LAST_EVALUATED = value
+        elif t is not Call or node.value is None:
+            value = V.evaluate(node)
+        elif type(node.value) is not Symbol or node.value.value not in MACROS:
+            V.CURRENT_LOCATION = node.location
+            stack.append((HEAD, node))
+            if type(node.value) is not Symbol:
+                node = node.value
+                continue
+            value = V.callee(node)
+        else:
+            name = node.value.value
+            ops = node.operands
+            # What evaluating the head would have done.
+            V.CURRENT_LOCATION = node.value.location
+            V.LAST_EVALUATED = MACROS[name]
+            # Evaluating something as the built-in's last step, keeps
+            #   what it gives as the last thing evaluated.
+            if not stack or stack[-1][0] not in (RESULT, RETURN):
+                stack.append(result)
+            if (name == 'if' or name == 'unless') and len(ops) >= 2:
+                stack.append((IF, node, name == 'unless'))
+                node = ops[0]
+                continue
+            if (name == 'do' or name == 'prog') and ops:
+                stack.append((DO, node, 0) if len(ops) > 1 else (YIELDS,))
+                node = ops[0]
+                continue
+            if name == 'iterate' and len(ops) == 1:
+                stack.append((ITERATE, node, V.LAST_EVALUATED))
+                node = ops[0]
+                continue
+            if name == 'eval' and len(ops) == 1 and type(ops[0]) is Uneval:
+                V.CURRENT_LOCATION = ops[0].location
+                V.LAST_EVALUATED = ops[0]
+                node = ops[0].value
+                continue
+            if (name == 'let' or name == 'mutate') and bindable(node):
+                stack.append((LET, node, 0, name == 'mutate', V.FRAME))
+                node = ops[0].operands[0]
+                continue
+            if name in ARITHMETIC and ops:
+                stack.append((CHECK, node, 0))
+                node = ops[0]
+                continue
+            if name in FAILS and ops:
+                stack.append((NUMBERS, node, 0))
+                node = ops[0]
+                continue
+            count = strict(name, node)
+            if count:
+                stack.append((STRICT, node, [], count, MACROS[name]))
+                node = ops[0]
+                continue
+            if count == 0:
+                value = MACROS[name](node, [])
+            else:
+                value = MACROS[name](node)
+
+        # Giving `value' to what's on top of the stack, until there's
+        #   something else to evaluate.
+        while True:
+            if not stack:
+                return value
+            top = stack.pop()
+            kind = top[0]
+            if kind == RESULT:
+                V.LAST_EVALUATED = value
+            elif kind == ARGS:
+                _, node, definition, values = top
+                values.append(value)
+                if len(values) < len(node.operands):
+                    stack.append(top)
+                    node = node.operands[len(values)]
+                    break
+            elif kind == CHECK or kind == NUMBERS:
+                # Checks each argument is a number, evaluating them all
+                #   over again once they are (see `visitor.all_numerics').
+                _, node, i = top
+                t = type(value)
+                if t is not int and t is not float and V.to_type(value) != 'Numeric':
+                    value = V.EX.throw(node.operands[i].location,
+                        'All arguments to this macro must\n'
+                        + 'be of type `Numeric`!')
+                    if kind == CHECK:
+                        continue
+                    i = len(node.operands)
+                else:
+                    i += 1
+                if i < len(node.operands):
+                    stack.append((kind, node, i))
+                elif kind == CHECK:
+                    stack.append((ARITH, node, []))
+                    i = 0
+                else:
+                    stack.append((COMPARE, node, 0, None))
+                    i = 0
+                node = node.operands[i]
+                break
+            elif kind == ARITH:
+                _, node, values = top
+                values.append(value)
+                if len(values) < len(node.operands):
+                    stack.append(top)
+                    node = node.operands[len(values)]
+                    break
+                value = bytecode.arithmetic(node.value.value, values)
+            elif kind == STRICT:
+                _, node, values, count, macro = top
+                values.append(value)
+                if len(values) < count:
+                    stack.append(top)
+                    node = node.operands[len(values)]
+                    break
+                value = macro(node, values)
+            elif kind == HEAD:
+                node = top[1]
+                if type(value) is Definition:
+                    if node.inline is not None and node.inline[0] is value:
+                        stack.append((INLINED,))
+                        node = node.inline[1]
+                        break
+                    if node.operands:
+                        stack.append((ARGS, node, value, []))
+                        node = node.operands[0]
+                        break
+                    definition, values = value, []
+                elif type(value) is function:
+                    count = strict(NAMES.get(value), node)
+                    if count:
+                        if not stack or stack[-1][0] not in (RESULT, RETURN):
+                            stack.append(result)
+                        stack.append((STRICT, node, [], count, value))
+                        node = node.operands[0]
+                        break
+                    value = value(node, []) if count == 0 else value(node)
+                    V.LAST_EVALUATED = value
+                    continue
+                else:
+                    value = V.not_callable(node, value)
+                    V.LAST_EVALUATED = value
+                    continue
+            elif kind == RETURN:
+                V.FRAME = top[1]
+                V.DEPTH -= 1
+                V.LAST_EVALUATED = V.LAST_RETURNED = value
+            elif kind == IF:
+                _, node, unless = top
+                taken = value is not false and value
+                if not taken if unless else taken:
+                    node = node.operands[1]
+                    break
+                if len(node.operands) > 2:
+                    node = node.operands[2]
+                    break
+                value = tree.Nil(node.location)
+            elif kind == COMPARE:
+                # Stops at the first argument out of order.
+                _, node, i, last = top
+                if i > 0 and FAILS[node.value.value](last, value):
+                    value = false
+                    continue
+                i += 1
+                if i < len(node.operands):
+                    stack.append((COMPARE, node, i, value))
+                    node = node.operands[i]
+                    break
+                value = true
+            elif kind == INLINED:
+                V.LAST_EVALUATED = V.LAST_RETURNED = value
+            elif kind == YIELDS:
+                if type(value) is Yield:
+                    node = value.value
+                    break
+            elif kind == DO:
+                _, node, i = top
+                if type(value) is Yield:
+                    node = value.value
+                    break
+                if type(value) is Symbol and value.value in ('break', 'next'):
+                    continue
+                i += 1
+                stack.append((DO, node, i) if i < len(node.operands) - 1 else (YIELDS,))
+                node = node.operands[i]
+                break
+            elif kind == ITERATE:
+                _, node, last = top
+                if type(value) is Symbol:
+                    if value.value == 'break':
+                        V.LAST_RETURNED = value = last
+                        continue
+                    if value.value != 'next':
+                        last = value
+                else:
+                    last = value
+                stack.append((ITERATE, node, last))
+                node = node.operands[0]
+                break
+            elif kind == LET:
+                _, node, i, mutable, frame = top
+                name = V.name_value(node.operands[i].value).name[1:]
+                frame.bind(name, value, mutable)
+                i += 1
+                if i < len(node.operands):
+                    stack.append((LET, node, i, mutable, frame))
+                    node = node.operands[i].operands[0]
+                    break
+                value = V.lookup(name)
+            if kind == HEAD or kind == ARGS:
+                # The call, given what its arguments evaluated to.
+                if definition.code is not None:
+                    value = V.execute_method(definition, values)
+                    continue
+                scope = definition.scope
+                if len(values) != scope.arity:
+                    values = V.arity(definition, values)
+                i = len(stack)
+                while i and stack[i - 1][0] in PASSING:
+                    i -= 1
+                if i and stack[i - 1][0] == RETURN:
+                    del stack[i:]  # In place of the call it ends.
+                else:
+                    if V.DEPTH >= conf.DEPTH_LIMIT:
+                        raise V.TooDeep()
+                    stack.append((RETURN, V.FRAME))
+                    V.DEPTH += 1
+                if scope.blank:
+                    values += scope.blank
+                V.FRAME = Frame(scope, values, definition.frame)
+                node = definition.tree
+                break
@@ -0,0 +1,210 @@
+from . import lexing
+from . import parsing
+from . import tree
+from . import source
+
+from . import config as conf
+
+from array import array
+import os, io, sys, atexit, contextlib
+import concurrent.futures
+
+# Parallel front end:
+#   Files are lexed and parsed in a pool of worker processes, which send
+#   their trees back packed flat (see `pack').  Files can be handed to
+#   the pool ahead of time, with `prefetch', so that e.g. the prelude's
+#   modules are all being parsed while the first of them is evaluated.
+#   Large files are cut at top-level forms, and the pieces parsed
+#   side by side.
+#
+#   Only lexing and parsing happens here; macro expansion is left to
+#   `parsing.preprocess', in the main process, so macros are still
+#   defined and applied in source order.  Should anything go wrong in
+#   a worker (including a syntax error), the file is lexed and parsed
+#   again in the main process, which reports any errors as usual.
+
+# The kinds of node a freshly parsed tree is made of.
+KINDS = (tree.Call, tree.Yield, tree.Uneval,
+    tree.Symbol, tree.Atom, tree.String, tree.Numeric, tree.Nil)
+KIND_INDEX = {kind: i for i, kind in enumerate(KINDS)}
+CALL, YIELD, UNEVAL, NIL = 0, 1, 2, 7
+
+POOL = None
+PREFETCHED = {}  # Pieces being parsed, by file.
+
+def pool():
+    global POOL
+    if POOL is None:
+        POOL = concurrent.futures.ProcessPoolExecutor(conf.WORKERS)
+        atexit.register(shutdown)
+    return POOL
+
+# Stops the pool, once the run is over, dropping whatever was prefetched
+#   and never asked for.  The workers are waited for, as a pool left to
+#   wind itself down races with `concurrent.futures' doing the same when
+#   the interpreter exits.  Also done at exit, should nobody else do it.
+def shutdown():
+    global POOL
+    PREFETCHED.clear()
+    if POOL is not None:
+        POOL.shutdown(wait=True, cancel_futures=True)
+        POOL = None
+
+# Flattens the trees of `forms' into arrays: each node's kind and offset
+#   from `start', in pre-order.  A call's operand count, shorthand and
+#   whether it has a caller (`()' doesn't) go into `counts', and the
+#   value of each leaf into `values'.
+def pack(forms, start=0):
+    kinds = array('B')
+    offsets = array('Q')
+    counts = array('q')
+    values = []
+    stack = list(reversed(forms))
+    while stack:
+        node = stack.pop()
+        kind = KIND_INDEX[node.type]
+        kinds.append(kind)
+        offsets.append((node.location & source.MASK) - start)
+        if kind == CALL:
+            counts.append(len(node.operands))
+            counts.append(-1 if node.shorthand is None else node.shorthand)
+            counts.append(node.value is not None)
+            stack.extend(reversed(node.operands))
+            if node.value is not None:
+                stack.append(node.value)
+        elif kind == YIELD or kind == UNEVAL:
+            stack.append(node.value)
+        elif kind != NIL:
+            value = node.value
+            values.append(sys.intern(value) if type(value) is str else value)
+    return len(forms), kinds.tobytes(), offsets, counts, values
+
+# Rebuilds the forms packed by `pack', positioned from `base'.
+def unpack(packed, base):
+    total, kinds, offsets, counts, values = packed
+    forms = []
+    # Unfinished nodes: the node, how many children it still wants,
+    #   and whether the next of them is its value (caller).
+    stack = []
+    c = v = 0
+    for i, kind in enumerate(kinds):
+        position = base + offsets[i]
+        if kind == CALL:
+            node = tree.Call.adopt(None, position, [])
+            if counts[c + 1] >= 0:
+                node.shorthand = counts[c + 1]
+            wants = counts[c] + counts[c + 2]
+            caller = bool(counts[c + 2])
+            c += 3
+            if wants:
+                stack.append([node, wants, caller])
+                continue
+        elif kind == YIELD or kind == UNEVAL:
+            stack.append([KINDS[kind](None, position), 1, True])
+            continue
+        elif kind == NIL:
+            node = tree.Nil(position)
+        else:
+            node = KINDS[kind](values[v], position)
+            v += 1
+        # Hand the finished node up to its parents.
+        while stack:
+            parent = stack[-1]
+            if parent[2]:
+                parent[0].value = node
+                parent[2] = False
+            else:
+                parent[0].operands.append(node)
+            parent[1] -= 1
+            if parent[1]:
+                break
+            node = stack.pop()[0]
+        else:
+            forms.append(node)
+    assert len(forms) == total
+    return forms
+
+# Runs in a worker: lexes and parses a piece of a file, found at offset
+#   `start' into it, giving its packed forms and line starts, or None
+#   if it doesn't lex and parse cleanly by itself.
+def front(string, file, start):
+    conf.EXIT_ON_ERROR = False
+    conf.RECOVERING_FROM_ERROR = False
+    origin = source.File(file, 0)
+    origin.reset()
+    origin.scan(string, 0)
+    with contextlib.redirect_stderr(io.StringIO()):
+        scanner = lexing.Scanner(lexing.string_reader(string), file,
+            origin=origin)
+        stream = lexing.TokenStream(file, list(scanner))
+        if scanner.error is not None:
+            return None
+        forms = list(parsing.forms(stream))
+    if conf.RECOVERING_FROM_ERROR:
+        return None
+    lines = origin.lines[1:]
+    for j in range(len(lines)):
+        lines[j] += start
+    return pack(forms), lines
+
+# Where to cut `string' into pieces of about `conf.SPLIT_SIZE': at a line
+#   starting with `(', which should be the start of a top-level form.
+#   If it isn't (say it's inside a string), the piece before it won't
+#   lex by itself, and the whole file is parsed in one go instead.
+def cuts(string):
+    cuts = [0]
+    while len(string) - cuts[-1] > conf.SPLIT_SIZE:
+        cut = string.find('\n(', cuts[-1] + conf.SPLIT_SIZE)
+        if cut == -1:
+            break
+        cuts.append(cut + 1)
+    cuts.append(len(string))
+    return cuts
+
+def submit(string, file):
+    bounds = cuts(string)
+    return [(start, pool().submit(front, string[start:end], file, start))
+        for start, end in zip(bounds, bounds[1:])]
+
+# Starts parsing the given files in the background.
+def prefetch(files):
+    if not conf.PARALLEL:
+        return
+    for file in files:
+        if os.path.realpath(file) in PREFETCHED:
+            continue
+        try:
+            with open(file, 'r', encoding='utf-8', newline='') as f:
+                string = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        PREFETCHED[os.path.realpath(file)] = string, submit(string, file)
+
+# Lexes and parses `string', the contents of `file', in the pool, picking
+#   up the pieces `prefetch' started on if they're for this same text.
+def parse(string, file):
+    if not conf.PARALLEL:
+        return parsing.parse(lexing.lex(string, file))
+    fetched = PREFETCHED.pop(os.path.realpath(file), None)
+    if fetched is not None and fetched[0] == string:
+        pieces = fetched[1]
+    elif len(string) > conf.SPLIT_SIZE:
+        pieces = submit(string, file)
+    else:  # Not worth the trip to a worker.
+        return parsing.parse(lexing.lex(string, file))
+
+    AST = tree.Tree(file)
+    origin = source.lookup(file)
+    origin.reset()
+    for start, future in pieces:
+        try:
+            result = future.result()
+        except Exception:
+            result = None
+        if result is None:
+            return parsing.parse(lexing.lex(string, file))
+        packed, lines = result
+        AST.extend(unpack(packed, origin.base + start))
+        origin.lines.extend(lines)
+    origin.text = string
+    return AST
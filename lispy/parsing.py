@@ -4,19 +4,125 @@ from . import tree
 from . import err
 from . import config as conf
 
-import sys, copy, ast, re
+import sys, copy, ast, re, time, operator
 
 EOF = '\0'
 
 EX = None
 
+DECIMAL = re.compile(r"[0-9]+\.[0-9]+\Z")
+
 def numeric(string, location):
+    # Plain integers and decimals are by far the most common, so
+    #   only the more exotic literals go through `literal_eval'.
+    if string.isdigit() and (string[0] != '0' or len(string) == 1):
+        return int(string)
+    if DECIMAL.match(string):
+        return float(string)
     try:
         return ast.literal_eval(string)
     except:
         return EX.throw(location,
             'Could not parse `{}\' as a numeric, malformed literal.'.format(string))
 
+# Counters for macro expansion, see `benchmarks/macros.py'.
+STATS = {
+    'invocations': 0,  # Calls to `Macro.invoke'.
+    'hits': 0,         # ... answered from a macro's expansion cache.
+    'built': 0,        # Nodes built, anew, for expansions.
+    'walks': 0,        # Top-level forms searched for macros.
+    'skipped': 0,      # Top-level forms not searched again in `visit'.
+    'seconds': 0.0     # Total time spent in `macro_expansion'.
+}
+
+def reset_stats():
+    for key in STATS:
+        STATS[key] = type(STATS[key])()
+
+COPY = object()  # A quoted literal to be copied whole into each expansion.
+
+# `Template` is a macro body compiled once, when the macro is defined.
+#            The paths leading from the root of the body down to each of
+#            the macro's arguments (the slots), and down to any quoted
+#            literal, are kept in a trie.  An expansion builds new nodes
+#            along those paths only, everything else in it is shared with
+#            the body.  Quoted literals are always copied, so that any
+#            destructive list operations on them don't leak between uses.
+class Template(object):
+    def __init__(self, body, args):
+        self.body = body
+        self.args = args
+        self.names = set()  # All symbols in the body.
+        self.trie = self.compile(body)
+
+    def compile(self, node, quoted=False):
+        t = type(node)
+        if t is tree.Symbol:
+            self.names.add(node.value)
+            return None
+        if issubclass(t, tree.Operator):
+            children = enumerate([node.value] + node.operands)
+        elif issubclass(t, tree.Data) and isinstance(node.value, tree.Node):
+            children = [(0, node.value)]
+            quoted = quoted or t is tree.Uneval
+        else:
+            return None
+
+        trie = {}
+        for step, child in children:
+            if type(child) is tree.Symbol and child.value in self.args:
+                # Arguments are only substituted as a caller, an operand,
+                #   or right under a quote (not e.g. directly in a yield).
+                if t is not tree.Yield:
+                    trie[step] = child.value
+                else:
+                    self.names.add(child.value)
+                continue
+            branch = self.compile(child, quoted)
+            if branch is not None:
+                trie[step] = branch
+        if trie:
+            return trie
+        return COPY if t is tree.Uneval else None
+
+    # Expands the body, with `slots' mapping argument names to what
+    #   they are substituted with.
+    def expand(self, slots):
+        if self.trie is None:
+            return self.body
+        return self.build(self.body, self.trie, slots, False)
+
+    def build(self, node, trie, slots, quoted):
+        if trie is COPY:
+            return copy.deepcopy(node)
+        STATS['built'] += 1
+        t = type(node)
+        quoted = quoted or t is tree.Uneval
+        if issubclass(t, tree.Operator):
+            new = t.adopt(None, node.location, None)
+            new.shorthand = node.shorthand
+            children = [node.value] + node.operands
+        else:
+            new = t(None, node.location)
+            children = [node.value]
+
+        for step, child in enumerate(children):
+            branch = trie.get(step)
+            if branch is None:
+                if quoted and isinstance(child, tree.Node):
+                    children[step] = copy.deepcopy(child)
+            elif type(branch) is str:
+                children[step] = slots[branch]
+            else:
+                children[step] = self.build(child, branch, slots, quoted)
+
+        new.value = children[0]
+        if issubclass(t, tree.Operator):
+            new.operands = children[1:]
+        return new
+
+CACHE_SIZE = 256  # Expansions remembered by each macro.
+
 class Macro(object):
     def __init__(self, subtree):
         self.tree = copy.deepcopy(subtree)
@@ -24,14 +130,26 @@ class Macro(object):
         self.args = list(map(lambda e: e.value, self.tree.operands[1].operands))
         self.body = self.tree.operands[2]
         self.quoted = tree.Uneval(self.body, self.body.location)
+        self.template = Template(self.body, self.args)
+        # Expansions by call site, a call gets expanded a second time
+        #   by `macro_expansion', once it reaches the macro's name.
+        self.expansions = {}
 
     def invoke(self, caller):
+        STATS['invocations'] += 1
         if len(caller.operands) != len(self.args):
             return EX.throw(caller.location,
                 'Incorrect number of arguments to macro!\n'
                 + 'Expected {} arguments, got {}'.format(
                     len(self.args), len(caller.operands)))
 
+        # The same call, with the same arguments, gets the same expansion.
+        cached = self.expansions.get(id(caller))
+        if (cached is not None
+        and all(map(operator.is_, cached[1], caller.operands))):
+            STATS['hits'] += 1
+            return cached[2]
+
         name_map = {}
         for i in range(len(self.args)):
             name_map[self.args[i]] = tree.Uneval(caller.operands[i], caller.location)
@@ -41,74 +159,44 @@ class Macro(object):
                 return name_map[self.body.value]
             return self.body
 
-        body = copy.deepcopy(self.body)
-        def replace_args(subtree, parent):
-            if not issubclass(type(subtree), tree.Node):
-                return None
-            if (type(subtree) is tree.Symbol
-            and subtree.value in self.args):
-                if parent is None:
-                    body = name_map[parent.value]
-                if issubclass(type(parent), tree.Operator):
-                    if parent.value.value in self.args:
-                        parent.value = name_map[parent.value.value]
-                    for i in range(len(parent.operands)):
-                        name = parent.operands[i].value
-                        if name in self.args:
-                            parent.operands[i] = name_map[name]
-                else:
-                    if type(parent) is tree.Uneval:
-                        parent.value = name_map[parent.value.value]
-
-            replace_args(subtree.value, subtree)
-            if issubclass(type(subtree), tree.Operator):
-                for i in range(len(subtree.operands)):
-                    replace_args(subtree.operands[i], subtree)
-            return None
-
-
-        replace_args(body, None)
+        body = self.template.expand(name_map)
+        if len(self.expansions) >= CACHE_SIZE:
+            del self.expansions[next(iter(self.expansions))]
+        # Keeping hold of `caller' keeps its id from being reused.
+        self.expansions[id(caller)] = (caller, list(caller.operands), body)
         return body
 
 
 MACROS = {}
+NAMES = set()  # Names of macros a form may yet need expanding with.
 
-def macro_expansion(ast, i):
-    def search_brach(subtree, parent=None):
-        t = type(subtree)
+# Markers for the kinds of entries on the `search_brach' stack.
+VISIT   = 0  # A node to search, with its parent.
+NEXT    = 1  # The operands of a node still to be searched, from the k-th.
+DEFINED = 2  # A macro definition, all of it searched.
 
-        if issubclass(t, tree.Operator):
-            found = False
-            operands = subtree.operands
-            if (issubclass(type(subtree.value), tree.Node)
-            and subtree.value.value == 'define'
-            and len(subtree.operands) > 0
-            and type(subtree.operands[0]) is tree.Symbol
-            and subtree.operands[0].value == 'macro'):
-                caller = subtree.operands[1]
-                found = type(caller.value.value) is str
-                operands = subtree.operands[2:]
-            else:
-                if type(subtree.value) is tree.Symbol:
-                    if subtree.value.value in MACROS:
-                        replacement = MACROS[subtree.value.value].invoke(subtree)
-                        if parent is None:
-                            ast[i] = replacement
-                        else:
-                            if (type(parent.value.value) is tree.Symbol
-                            and parent.value == subtree):
-                                parent.value = replacement
-                            else:
-                                for j in range(len(parent.operands)):
-                                    if parent.operands[j] == subtree:
-                                        parent.operands[j] = replacement
-                                        break
+def macro_expansion(ast, i):
+    # Searches the tree from `root' for macro definitions and calls, in
+    #   the same order as a recursive walk (a node, then its caller, then
+    #   each of its operands), but with what's left to search on an
+    #   explicit stack, so nesting is only limited by memory.  Operands
+    #   are looked up only once they're reached, as a replacement may
+    #   have put something else in their place by then.
+    def search_brach(root):
+        stack = [(VISIT, root, None)]
+        while stack:
+            top = stack.pop()
+            kind = top[0]
 
-            search_brach(subtree.value, parent=subtree)
-            for operand in operands:
-                search_brach(operand, parent=subtree)
+            if kind is NEXT:
+                _, subtree, operands, k = top
+                if k < len(operands):
+                    stack.append((NEXT, subtree, operands, k + 1))
+                    stack.append((VISIT, operands[k], subtree))
+                continue
 
-            if found:
+            if kind is DEFINED:
+                _, subtree, parent, caller = top
                 MACROS[caller.value.value] = Macro(subtree)
                 empty_branch = tree.Nil(subtree.location)
                 if parent is None:
@@ -121,104 +209,137 @@ def macro_expansion(ast, i):
                             if parent.operands[j] == subtree:
                                 parent.operands[j] = empty_branch
                                 break
-            return None
+                continue
 
-        if issubclass(t, tree.Data):
-            if subtree.value in MACROS and type(subtree) is tree.Symbol:
-                if parent is None:
-                    ast[i] = MACROS[subtree.value].quoted
+            _, subtree, parent = top
+            t = type(subtree)
+
+            if issubclass(t, tree.Operator):
+                operands = subtree.operands
+                if (issubclass(type(subtree.value), tree.Node)
+                and subtree.value.value == 'define'
+                and len(subtree.operands) > 0
+                and type(subtree.operands[0]) is tree.Symbol
+                and subtree.operands[0].value == 'macro'):
+                    caller = subtree.operands[1]
+                    if type(caller.value.value) is str:
+                        stack.append((DEFINED, subtree, parent, caller))
+                    operands = subtree.operands[2:]
                 else:
-                    if issubclass(type(parent), tree.Operator):
-                        if (type(parent.value) is tree.Symbol
-                        and parent.value.value == subtree.value):
-                            replacement = MACROS[subtree.value].invoke(parent)
-                            if issubclass(type(replacement), tree.Operator):
-                                parent.value = replacement.value
-                                parent.operands = replacement.operands
+                    if type(subtree.value) is tree.Symbol:
+                        if subtree.value.value in MACROS:
+                            NAMES.update(MACROS[subtree.value.value].template.names)
+                            replacement = MACROS[subtree.value.value].invoke(subtree)
+                            if parent is None:
+                                ast[i] = replacement
                             else:
-                                parent = replacement
-                        else:
-                            for j in range(len(parent.operands)):
-                                if parent.operands[j].value == subtree.value:
-                                    parent.operands[j] = MACROS[subtree.value].quoted
-            else:
-                search_brach(subtree.value, parent=subtree)
-        return None
+                                if (type(parent.value.value) is tree.Symbol
+                                and parent.value == subtree):
+                                    parent.value = replacement
+                                else:
+                                    for j in range(len(parent.operands)):
+                                        if parent.operands[j] == subtree:
+                                            parent.operands[j] = replacement
+                                            break
+
+                stack.append((NEXT, subtree, operands, 0))
+                stack.append((VISIT, subtree.value, subtree))
+                continue
 
+            if issubclass(t, tree.Data):
+                if subtree.value in MACROS and type(subtree) is tree.Symbol:
+                    NAMES.update(MACROS[subtree.value].template.names)
+                    if parent is None:
+                        ast[i] = MACROS[subtree.value].quoted
+                    else:
+                        if issubclass(type(parent), tree.Operator):
+                            if (type(parent.value) is tree.Symbol
+                            and parent.value.value == subtree.value):
+                                replacement = MACROS[subtree.value].invoke(parent)
+                                if issubclass(type(replacement), tree.Operator):
+                                    parent.value = replacement.value
+                                    parent.operands = replacement.operands
+                            else:
+                                for j in range(len(parent.operands)):
+                                    if parent.operands[j].value == subtree.value:
+                                        parent.operands[j] = MACROS[subtree.value].quoted
+                else:
+                    if t is tree.Symbol:
+                        NAMES.add(subtree.value)
+                    stack.append((VISIT, subtree.value, subtree))
+
+    global EX
+    if EX is None:  # Its tree wasn't parsed here, see "parallel.py".
+        EX = err.Thrower(err.PARSE, ast.file)
+
+    start = time.perf_counter()
+    STATS['walks'] += 1
     search_brach(ast[i])
+    STATS['seconds'] += time.perf_counter() - start
     return ast[i]
 
-def preprocess(AST, macros={}):
+def preprocess(AST, macros=None):
     global MACROS
-    MACROS = macros  # Clear the known macros, such that
-                     #   any subsequent instances of the parser
-                     #   don't use old macros, irrelevent to them
-                     #   (and to avoid name clashes...)
+    if macros is not None:
+        MACROS = macros  # Start over with the given macros, such that
+                         #   this instance of the parser doesn't use old
+                         #   macros, irrelevent to it (and to avoid name
+                         #   clashes...), by default the known ones stay.
 
+    # For each form, the names that might still need expanding, that is
+    #   the symbols which weren't known macros yet when the form was
+    #   expanded, and the symbols brought in by its expansions.  `visit'
+    #   only searches a form again if any of them are macros by then.
+    AST.names = []
     for i in range(len(AST)):
+        NAMES.clear()
         AST[i] = macro_expansion(AST, i)
+        AST.names.append(set(NAMES))
     return AST
 
-def parse(stream, string=None):
+# Whether the i-th form of a preprocessed `AST' needs expanding again.
+def unsettled(AST, i):
+    return not AST.names[i].isdisjoint(MACROS)
+
+# `forms` parses and yields one top-level form at a time, reading only
+#         as far into the token stream as the form it's working on.
+def forms(stream, string=None):
     global EX
-    AST = None
     if EX is None :
         EX = err.Thrower(err.PARSE, stream.file)
         if string is not None:
             EX.nofile(string)
-    if AST is None:
-        AST = tree.Tree(stream.file)
-        stream.purge('TERMINATOR')
+    stream.purge('TERMINATOR')
 
-    def parse_loop(AST):
+    # One top-level form at a time, in a loop, so the amount
+    #   of forms in a file has no bearing on the Python stack.
+    while True:
         if conf.DEBUG: print("TOP LEVEL PARSE: ", stream.current())
         branch = atom(stream.current(), stream)
-        if branch is not -1:
+        if branch != -1:
             if conf.DEBUG: print('Adding branch: ', branch.type)
-            AST.push(branch)
+            yield branch
         if stream.ahead().type == 'EOF':
-            return AST
-
+            return
         stream.next()
-        return parse_loop(AST)
 
-    AST = parse_loop(AST)
+def parse(stream, string=None):
+    AST = tree.Tree(stream.file)
+    AST.extend(forms(stream, string))
     if conf.DEBUG: print("Size of AST:", sys.getsizeof(AST))
     return AST
 
 SHORTHAND = None
 
-def atom(token, stream):
+# Markers for the kinds of unfinished nodes on the `atom' stack.
+LIST  = 0
+QUOTE = 1
+PENDING = object()  # A list whose caller has yet to be parsed.
+
+# Parses one leaf token, anything that isn't a list or quote.
+def leaf(token):
     global SHORTHAND
-    if conf.DEBUG: print('Atomic token type: ', token.type)
     loc = token.location
-
-    if token.type == 'L_PAREN':
-        SHORTHAND = 0
-        caller = None
-        if stream.ahead().type != 'R_PAREN':
-            caller = atom(stream.next(), stream)
-        else:
-            stream.next() # Go past the R_PAREN, so outer calls don't get closed
-            return tree.Call(caller, loc)
-        operands = []
-        while stream.ahead().type != 'R_PAREN':
-            if stream.current().type == 'EOF':
-                return EX.throw(
-                    stream.current().location,
-                    'Unexcpected EOF, missing closing parenthesis')
-            operands.append(atom(stream.next(), stream))
-        stream.next()  # Skip the R_PAREN we just spotted ahead.
-        if caller.value == 'yield':
-            if len(operands) == 0:
-                operands.append(tree.Nil(loc))
-            return tree.Yield(operands[0], loc)
-        call = tree.Call(caller, loc, *operands)
-        if (caller.type is tree.Symbol
-        and caller.value == '->'):
-            call.shorthand = SHORTHAND
-            SHORTHAND = None
-        return call
     if token.type == 'NUMERIC':
         return tree.Numeric(numeric(token.string, loc), loc)
     if token.type == 'SYMBOL':
@@ -227,11 +348,73 @@ def atom(token, stream):
         return tree.Symbol(token.string, loc)
     if token.type == 'ATOM':
         return tree.Atom(token.string, loc)
-    if token.type == 'UNEVAL':
-        return tree.Uneval(atom(stream.next(), stream), loc)
     if token.type == 'STRING':
         return tree.String(token.string, loc)
     if token.type == 'NIL':
         return tree.Nil(loc)
 
     return -1
+
+# Builds the node for a list whose closing parenthesis was just reached.
+def close_list(loc, caller, operands):
+    global SHORTHAND
+    if caller.value == 'yield':
+        if len(operands) == 0:
+            operands.append(tree.Nil(loc))
+        return tree.Yield(operands[0], loc)
+    call = tree.Call.adopt(caller, loc, operands)
+    if (caller.type is tree.Symbol
+    and caller.value == '->'):
+        call.shorthand = SHORTHAND
+        SHORTHAND = None
+    return call
+
+# Parses the form starting at `token'.  Nested lists and quotes are
+#   kept on an explicit stack of unfinished nodes, rather than the
+#   Python stack, so nesting is only limited by memory.
+def atom(token, stream):
+    global SHORTHAND
+    stack = []
+    while True:
+        if conf.DEBUG: print('Atomic token type: ', token.type)
+        # Going down, into the form starting at `token'.
+        if token.type == 'L_PAREN':
+            SHORTHAND = 0
+            if stream.ahead().type != 'R_PAREN':
+                stack.append((LIST, token.location, [PENDING]))
+                token = stream.next()
+                continue
+            stream.next() # Go past the R_PAREN, so outer calls don't get closed
+            result = tree.Call(None, token.location)
+        elif token.type == 'UNEVAL':
+            stack.append((QUOTE, token.location, None))
+            token = stream.next()
+            continue
+        else:
+            result = leaf(token)
+
+        # Coming back up, handing `result' to the unfinished nodes.
+        while stack:
+            kind, loc, elements = stack[-1]
+            if kind is QUOTE:
+                stack.pop()
+                result = tree.Uneval(result, loc)
+                continue
+            if elements[0] is PENDING:
+                elements[0] = result
+            else:
+                elements.append(result)
+            if stream.ahead().type != 'R_PAREN':
+                if stream.current().type == 'EOF':
+                    stack.pop()
+                    result = EX.throw(
+                        stream.current().location,
+                        'Unexcpected EOF, missing closing parenthesis')
+                    continue
+                token = stream.next()
+                break
+            stream.next()  # Skip the R_PAREN we just spotted ahead.
+            stack.pop()
+            result = close_list(loc, elements[0], elements[1:])
+        else:
+            return result
@@ -0,0 +1,327 @@
+from . import tree
+from . import visitor as V
+
+# Resolving symbols:
+#   The body of a `Definition' is looked over once, when the `define',
+#   `λ' or `->' making it is processed, and every name bound in it (its
+#   arguments, then whatever `let', `mutate' and `define' bind in it) is
+#   given a slot in the frames of its calls.  That is its `Scope'.  A
+#   symbol is then found at its address: how many frames up from the
+#   current one its name is bound, and in which slot, or, when no scope
+#   around it binds the name, the global `Cell' of the name.
+#
+#   i.e.  (define (f x)        ;; In the `λ', `y' is at (0, 0), `x' is
+#           (λ (y) (g x y)))   ;;   at (1, 0), and `g' is the cell of
+#                              ;;   the global `g'.
+#
+#   A slot that's yet to be bound when it's looked at (say, by a `let'
+#   further on, or one in a branch not taken) holds `UNBOUND', and the
+#   name is then looked for further out, just as before.  Code that
+#   binds names no scope knew of beforehand (strings given to `eval',
+#   or files required in a call) makes the scope grow, see `Scope.grow'.
+#
+#   Before a top-level form is evaluated, any symbol in the bodies of
+#   its definitions that couldn't possibly be bound when they're called
+#   is reported, see `check'.  Nothing is reported in the forms before
+#   one that may bind names out of sight (i.e. a `require' further on
+#   in the file), see `horizon'.
+
+# The value of a slot, or cell, with nothing bound to it.
+class Unbound(object):
+    def __repr__(self):
+        return '<unbound>'
+
+UNBOUND = Unbound()
+
+# `Cell` holds the value bound to a global name.  The same cell is
+#   kept for as long as the name is in use, so code that refers to a
+#   global can hold on to its cell, rather than look its name up.
+class Cell(object):
+    __slots__ = ('name', 'value', 'mutable')
+    def __init__(self, name):
+        self.name = name
+        self.value = UNBOUND
+        self.mutable = False
+
+GLOBALS = {}  # Cells of global names, by name.
+
+def cell(name):
+    found = GLOBALS.get(name)
+    if found is None:
+        found = GLOBALS[name] = Cell(name)
+    return found
+
+# Names bound at the top level of any file visited so far, so they may
+#   be referred to (in the body of a function) before they're bound.
+KNOWN = set()
+
+# How many times a scope has grown while running.  Addresses worked out
+#   before then are only good as long as this doesn't change.
+CHANGES = 0
+
+# How many times a global name has been bound (by `let', `mutate' or
+#   `define'), or a name deleted, or a scope has grown.  What a global
+#   name was found to be is only good as long as this doesn't change.
+BINDINGS = 0
+
+# `Scope` is the layout of the frames of calls to a `Definition': the
+#   slot of each name bound in its body, the arguments coming first.
+#   The global scope has no slots, global names having cells instead.
+class Scope(object):
+    def __init__(self, parent, name, args=(), names=()):
+        self.parent = parent
+        self.name = name
+        self.args = list(args)
+        self.arity = len(self.args)
+        self.slots = {}
+        for i, arg in enumerate(self.args):
+            self.slots[arg] = i
+        self.size = len(self.args)
+        for local in names:
+            if local not in self.slots:
+                self.slots[local] = self.size
+                self.size += 1
+        self.blank = [UNBOUND] * (self.size - len(self.args))
+        self.mutables = set()  # Names that `mutate' has rebound.
+        self.addresses = {}
+        self.changes = CHANGES
+
+    # Where `name' is to be found from a frame of this scope: either a
+    #   pair of how many frames up, and which slot, or a global cell.
+    def address(self, name):
+        if self.changes != CHANGES:
+            self.addresses.clear()
+            self.changes = CHANGES
+        found = self.addresses.get(name)
+        if found is None:
+            found = self.addresses[name] = self.resolve(name)
+        return found
+
+    def resolve(self, name):
+        scope, depth = self, 0
+        while scope.parent is not None:
+            slot = scope.slots.get(name)
+            if slot is not None:
+                return (depth, slot)
+            scope, depth = scope.parent, depth + 1
+        return cell(name)
+
+    # Gives `name' a slot it didn't have, for code that wasn't there to
+    #   be looked over when the scope was made.
+    def grow(self, name):
+        global CHANGES, BINDINGS
+        slot = self.slots[name] = self.size
+        self.size += 1
+        self.blank = self.blank + [UNBOUND]
+        CHANGES += 1
+        BINDINGS += 1
+        return slot
+
+GLOBAL = Scope(None, '_main')
+
+# The name a binding form binds to `node' (see `visitor.name_value'),
+#   if it can be told without evaluating anything.
+def naming(node):
+    t = type(node)
+    if t is tree.Symbol or t is tree.String:
+        return node.value
+    if t is tree.Atom:
+        return node.value[1:]
+    if t is tree.Uneval and type(node.value) is tree.Symbol:
+        return node.value.value
+    return None
+
+# What a `define' is of: the name, arguments and body of the function,
+#   or None if it's not the shape of one.
+def signature(node):
+    if len(node.operands) < 2:
+        return None
+    kind = node.operands[0]
+    if type(kind) is tree.Call:
+        head, body = kind, node.operands[1]
+    elif (type(kind) is tree.Symbol and kind.value in ('function', 'memo')
+    and len(node.operands) > 2):
+        head, body = node.operands[1], node.operands[2]
+    else:
+        return None
+    if type(head) is not tree.Call or not isinstance(head.value, tree.Node):
+        return None
+    return head.value.value, [e.value for e in head.operands], body
+
+# What a `λ' or `->' is of: its arguments and body, or None if it's not
+#   the shape of one.
+def parameters(node):
+    if node.value.value == '->':
+        if len(node.operands) < 1 or node.shorthand is None:
+            return None
+        return ['%' + str(i) for i in range(1, node.shorthand + 1)], node.operands[0]
+    if (len(node.operands) < 2 or type(node.operands[0]) is not tree.Call
+    or not isinstance(node.operands[0].value, tree.Node)):
+        return None
+    args = [node.operands[0].value] + node.operands[0].operands
+    return [e.value for e in args], node.operands[1]
+
+# The names `let', `mutate' and `define' bind in `body', leaving out
+#   the bodies of the `λ's, `->'s and `define's in it, which have scopes
+#   of their own.
+def binders(body):
+    names = []
+    stack = [body]
+    while stack:
+        node = stack.pop()
+        t = type(node)
+        if t is tree.Yield:
+            stack.append(node.value)
+            continue
+        if t is not tree.Call or node.value is None:
+            continue
+        head = node.value
+        if type(head) is tree.Symbol:
+            if head.value in ('λ', '->'):
+                continue
+            if head.value == 'define':
+                made = signature(node)
+                if made is not None:
+                    names.append(made[0])
+                continue
+            if head.value in ('let', 'mutate'):
+                for op in node.operands:
+                    if type(op) is tree.Call:
+                        name = naming(op.value)
+                        if name is not None:
+                            names.append(name)
+                        stack.extend(op.operands)
+                continue
+        stack.extend(node.operands)
+        stack.append(head)
+    return names
+
+# The scope of the body of a function, made in `parent'.
+def scope(parent, name, args, body):
+    return Scope(parent, name, args, binders(body))
+
+# Takes note of the names bound at the top level of `AST'.
+def survey(AST):
+    for form in AST:
+        KNOWN.update(binders(form))
+
+SPECIAL = ('_', 'break', 'next')  # Symbols that aren't looked up.
+
+# Built-ins that don't evaluate their arguments as they are.
+UNEVALUATED = ('delete', 'scope', 'ast', 'yield')
+
+REPORTED = set()  # Locations of symbols already reported.
+
+# Whether `name' can't be bound when looked up from `scope'.
+def unresolvable(name, scope):
+    if name in V.MACROS or name in SPECIAL:
+        return False
+    while scope.parent is not None:
+        if name in scope.slots:
+            return False
+        scope = scope.parent
+    found = GLOBALS.get(name)
+    return name not in KNOWN and (found is None or found.value is UNBOUND)
+
+# Whether `body' may bind names that can't be seen beforehand, by way of
+#   `eval' (of anything but a quoted symbol) or `require'.
+def opaque(body):
+    stack = [body]
+    while stack:
+        node = stack.pop()
+        if type(node) is tree.Yield:
+            stack.append(node.value)
+            continue
+        if type(node) is not tree.Call or node.value is None:
+            continue
+        head = node.value
+        if type(head) is tree.Symbol:
+            if head.value == 'require':
+                return True
+            if head.value == 'eval' and not all(type(op) is tree.Uneval
+            and type(op.value) is tree.Symbol for op in node.operands):
+                return True
+        stack.extend(node.operands)
+        stack.append(head)
+    return False
+
+# Where reports can start in `AST' (the top-level forms of a file): at
+#   the last form that's `opaque', as the names it binds can't be known
+#   before it, and the forms ahead of it may well call on them.
+#
+#   i.e.  (define (f x) (g x))  ;; Not looked over, `g' may be
+#         (require "b")         ;;   bound by "b".
+def horizon(AST):
+    for pc in range(len(AST) - 1, -1, -1):
+        if opaque(AST[pc]):
+            return pc
+    return 0
+
+# The built-in `name' is bound to at the top level, as with `lambda'
+#   in the prelude, if it isn't bound in any scope around it.
+def alias(name, scope):
+    while scope.parent is not None:
+        if name in scope.slots:
+            return None
+        scope = scope.parent
+    found = GLOBALS.get(name)
+    if found is None or not callable(found.value):
+        return None
+    for macro, value in V.MACROS.items():
+        if value is found.value:
+            return macro
+    return None
+
+# Reports each symbol in the body of a definition in `form' (a top-level
+#   form, to be evaluated in `scope') that isn't bound in any scope around
+#   it, nor at the top level, now or further on, so can only be unbound
+#   by the time it's looked up.  Nothing in a body that's `opaque' (or in
+#   one inside it, `inside' being None) is reported.
+def check(form, scope):
+    stack = [(form, scope, False)]
+    while stack:
+        node, scope, inside = stack.pop()
+        t = type(node)
+        if t is tree.Symbol:
+            if inside and unresolvable(node.value, scope):
+                report(node)
+            continue
+        if t is tree.Yield:
+            stack.append((node.value, scope, inside))
+            continue
+        if t is not tree.Call or node.value is None:
+            continue
+        head = node.value
+        name = head.value if type(head) is tree.Symbol else None
+        if name is not None and name not in V.MACROS:
+            name = alias(name, scope) or name
+        if name not in V.MACROS:
+            stack.extend((op, scope, inside) for op in node.operands)
+            stack.append((head, scope, inside))
+        elif name in ('λ', '->', 'define'):
+            made = parameters(node) if name != 'define' else signature(node)
+            if made is not None:
+                args, body = made[-2:]
+                inside = inside is not None and not opaque(body)
+                stack.append((body, Scope(scope, name, args, binders(body)),
+                    inside or None))
+        elif name in ('let', 'mutate'):
+            for op in node.operands:
+                if type(op) is tree.Call:
+                    stack.extend((value, scope, inside) for value in op.operands)
+        elif name == 'eval':
+            for op in node.operands:
+                if type(op) is tree.Uneval and type(op.value) is tree.Symbol:
+                    op = op.value  # What macros leave `(eval 'x)' as.
+                stack.append((op, scope, inside))
+        elif name not in UNEVALUATED:
+            stack.extend((op, scope, inside) for op in node.operands)
+
+def report(node):
+    if node.location in REPORTED:
+        return
+    REPORTED.add(node.location)
+    V.EX.warn(node.location,
+        'Symbol `{}\' isn\'t bound in any scope around it,\n'.format(node.value)
+        + 'nor at the top level, so will be unbound\n'
+        + 'by the time it\'s evaluated.')
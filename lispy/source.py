@@ -0,0 +1,192 @@
+from array import array
+from bisect import bisect_right
+
+# Source positions:
+#   A location anywhere in any source is a single integer, the position.
+#   Its high bits pick out the source (a `File'), and its low `SHIFT'
+#   bits are the offset into that source's text.  Lines and columns are
+#   only worked out from a position when they are needed (i.e. for a
+#   diagnostic), from the source's table of the offsets at which each
+#   of its lines starts.
+#
+#   A column is therefore the character's place in its line, as it was
+#   written.  This is not what the lexer gave before positions were kept
+#   this way, which counted an escape in a string (e.g. `\t') as one
+#   column, not two, and put whatever followed a string running over
+#   several lines one column too far on.  Diagnostics after either are
+#   now where they really are, and so aren't where they used to be.
+#
+#   i.e.  base = lookup('a.lispy').base  # Offsets in `a.lispy' from here on.
+#         resolve(base + 10)           # ('a.lispy', line, column)
+#
+#   Sources also keep their text (the buffer), once, so a diagnostic
+#   can pick its line out of it straight away, see `snippet'.
+
+SHIFT = 40  # Offsets within one source are less than 2^40.
+MASK  = (1 << SHIFT) - 1
+
+# `File` is one source: a file, a string given to `eval', ...
+#        Its line table is filled in by the lexer as it reads, and
+#        its text is kept by whoever had all of it to hand.  If the
+#        source never got lexed here (i.e. its tree came out of the
+#        cache), or was read bit by bit, both are read off of the
+#        file the first time they are needed.  The text of a source
+#        given as a string can't be read again, once it's let go of.
+class File(object):
+    __slots__ = ('name', 'index', 'lines', 'text', 'pseudo', 'given')
+    def __init__(self, name, index, pseudo=False):
+        self.name = name
+        self.index = index
+        self.lines = None
+        self.text = None
+        self.pseudo = pseudo  # Not a real source, has no lines.
+        self.given = False    # Given as a string, not read from `name'.
+
+    @property
+    def base(self):
+        return self.index << SHIFT
+
+    # Starts the line table over, for the text about to be (re-)read.
+    def reset(self):
+        self.lines = array('q', [0])
+        self.text = None
+
+    # Keeps the whole `text' of the source, with its line table.
+    def load(self, text):
+        self.reset()
+        self.scan(text, 0)
+        self.text = text
+
+    # Lets go of the text and line table, e.g. once the source is
+    #   gone.  Should they be needed again, the file is read again.
+    def unload(self):
+        self.lines = None
+        self.text = None
+
+    # Notes the lines starting in `text', found at `offset' in the source.
+    def scan(self, text, offset):
+        lines = self.lines
+        j = text.find('\n')
+        while j != -1:
+            lines.append(offset + j + 1)
+            j = text.find('\n', j + 1)
+
+    def read(self):
+        if self.given:
+            return self.reset()
+        try:
+            with open(self.name, 'r', encoding='utf-8', newline='') as f:
+                self.load(f.read())
+        except (OSError, UnicodeDecodeError):
+            self.reset()
+
+    def table(self):
+        if self.lines is None:
+            self.read()
+        return self.lines
+
+    def buffer(self):
+        if self.text is None and not (self.pseudo or self.given):
+            self.read()
+        return self.text
+
+# `Part` is a piece of another source, `whole', starting `start'
+#        characters into it.  Positions in the piece are offsets from
+#        where it starts, so it can be moved along (e.g. by an edit
+#        ahead of it, see "incremental.py") without anything positioned
+#        in it having to change.  Its lines and text are the whole's.
+class Part(File):
+    __slots__ = ('whole', 'start')
+    def __init__(self, whole, index, start):
+        super().__init__(whole.name, index)
+        self.whole = whole
+        self.start = start
+
+FILES = []    # Every source, by index.
+BY_NAME = {}  # The file of each name.
+TEXTS = {}    # Sources given as strings, by name and text.
+RECENT = 256  # How many of those to keep, least recently used go first.
+
+# A new source, of its own, even if another has the same name.
+def register(name, pseudo=False):
+    file = File(name, len(FILES), pseudo)
+    FILES.append(file)
+    return file
+
+# A new piece of the source `whole', from `start' on.
+def part(whole, start):
+    piece = Part(whole, len(FILES), start)
+    FILES.append(piece)
+    return piece
+
+# The file of the given name, registered if it hasn't been already,
+#   that is, the same name keeps giving the same positions.
+def lookup(name):
+    file = BY_NAME.get(name)
+    if file is None:
+        file = BY_NAME[name] = register(name)
+    return file
+
+# The source of text not read out of a file (i.e. a string given
+#   to `eval', named after the file it came from), the same text
+#   keeping the same positions.  Only the texts of the `RECENT' latest
+#   are kept, so e.g. a REPL doesn't hold on to every line ever entered.
+#   An older one keeps its index and line table, as positions into it
+#   may still be about, they just can't show its line any more.
+def text(name, string):
+    file = TEXTS.pop((name, string), None)
+    if file is None:
+        if len(TEXTS) >= RECENT:
+            TEXTS.pop(next(iter(TEXTS))).text = None
+        file = register(name)
+        file.given = True
+        file.load(string)
+    TEXTS[name, string] = file  # Now the most recently used.
+    return file
+
+# Lets go of the buffer of the file of the given name.
+def unload(name):
+    file = BY_NAME.get(name)
+    if file is not None:
+        file.unload()
+
+def file(position):
+    return FILES[position >> SHIFT]
+
+def offset(position):
+    return position & MASK
+
+def filename(position):
+    return FILES[position >> SHIFT].name
+
+# The source a position is in, and its offset into it, out of any piece.
+def locate(position):
+    source = FILES[position >> SHIFT]
+    if type(source) is Part:
+        return source.whole, source.start + (position & MASK)
+    return source, position & MASK
+
+# Gives the file name, line and column of a position.
+def resolve(position):
+    source, at = locate(position)
+    if source.pseudo:
+        return source.name, -1, -1
+    lines = source.table()
+    line = bisect_right(lines, at)
+    return source.name, line, at - lines[line - 1] + 1
+
+# Gives the file name, line, column and the text of the line
+#   of a position (None if the source can't be had).
+def snippet(position):
+    source = locate(position)[0]
+    name, line, column = resolve(position)
+    text = source.buffer()
+    if text is None:
+        return name, line, column, None
+    lines = source.lines
+    end = lines[line] - 1 if line < len(lines) else len(text)
+    return name, line, column, text[lines[line - 1]:end].rstrip('\r')
+
+# Positions standing in for locations nowhere in any source.
+IMPLICIT = register('IMPLICIT', pseudo=True).base
+ERROR = register('ERROR', pseudo=True).base
@@ -0,0 +1,721 @@
+from . import tree
+from . import err
+from . import source
+from . import cache
+from . import closures
+from . import visitor as V
+from . import resolving
+from . import folding
+
+from . import config as conf
+
+from copy import deepcopy
+from types import FunctionType as function
+import os, sys, ast, marshal, hashlib, tempfile, warnings
+
+# Transpiling to Python:
+#   A whole (macro expanded) file is translated to Python, one function
+#   per top-level form, and one per body of a `Definition' it makes, and
+#   that is compiled with `compile', to be run by Python itself.  Where a
+#   built-in's meaning allows, it becomes the plain Python operation:
+#
+#   i.e.  (if (< n 2) n (- n 2))  ;; is about
+#
+#         t3 = V.search(E, 'n')
+#         if type(t3) is not int and ...:   # `<' checks its arguments...
+#             _ = V.EX.throw(...)
+#         t2 = F                            # ... and compares them.
+#         if t3 < 2:
+#             t2 = T
+#         if t2 is not F and t2:
+#             t1 = V.search(E, 'n')
+#         else:
+#             t5 = V.search(E, 'n')
+#             ...
+#             t1 = t5 - (0 + 2)
+#
+#   Everything else does just what evaluating it would do (see "closures.py",
+#   which it follows), including keeping `CURRENT_LOCATION' up to date, so
+#   diagnostics point where they always did.  Python line numbers are those
+#   of the forms in the file, so a traceback points into the `.lispy' file.
+#   Symbols are looked up by name, as in "bytecode.py", at the address the
+#   scope of the frame the function runs in (`E') resolves them to.
+#
+#   The compiled code is kept next to the source, marshalled, under
+#   "__lispycache__", along with how to find the nodes it refers to in the
+#   file's expanded tree (see `number').  It's used for as long as the key
+#   of the file's tree in the tree cache is the same, that is, until the
+#   source, the interpreter, or the macros known before it change.
+#
+#   Forms that change after the file is compiled (being expanded again, see
+#   `visitor.visit'), or that were never part of a file (e.g. strings given
+#   to `eval'), are compiled to closures, see `run'.
+#
+#   Select the engine with `conf.ENGINE', or `--engine=python'.
+
+DIRECTORY = '__lispycache__'
+SUFFIX = '.pyc'
+
+# Compiled top-level forms: the function of each, by the form's `id'
+#   (along with the form, to be sure it's the same one).
+FORMS = {}
+
+# Built-ins with a plain Python counterpart, see `direct_call'.
+DIRECT = {'+', '-', '*', '/', '%', '<', '>', '<=', '>=', '=', '/=', '!',
+    '&&', '||'}
+OPERATORS = {'-': '-', '*': '*', '/': '/', '%': '%'}
+COMPARISONS = {'<': '<', '>': '>', '<=': '<=', '>=': '>='}
+
+VERSION = None
+
+def version():
+    global VERSION
+    if VERSION is None:
+        digest = hashlib.sha256(sys.version.encode('utf-8'))
+        for module in (sys.modules[__name__], folding):
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        VERSION = digest.hexdigest()
+    return VERSION
+
+# The nodes of a tree, numbered in an order that is the same every time
+#   the same tree is read (from the source or the tree cache alike).
+def number(AST):
+    return list(cache.nodes(reversed(AST)))
+
+# `Writer` collects the lines of one Python function, and the line in
+#          the source each of them came from.
+class Writer(object):
+    def __init__(self, module, body):
+        self.module = module
+        self.body = body
+        self.lines = []
+        self.places = []
+        self.indent = 1
+        self.temps = 0
+        self.line = 1
+
+    def emit(self, text, node=None):
+        if node is not None:
+            self.line = self.module.line(node, self.line)
+        self.lines.append('    ' * self.indent + text)
+        self.places.append(self.line)
+
+    def temp(self):
+        self.temps += 1
+        return 't{}'.format(self.temps)
+
+# `Module` is the Python translation of one file, being written.
+class Module(object):
+    def __init__(self, AST):
+        self.file = AST.file
+        self.origin = source.lookup(AST.file).index
+        self.nodes = number(AST)
+        self.numbers = {id(node): i for i, node in enumerate(self.nodes)}
+        self.recipe = []  # What's in `K', see `namespace'.
+        self.refs = {}
+        self.keys = []  # Those of `refs', in the order they were made.
+        self.functions = []  # Each a name, lines and their places.
+
+    # The index in `K' of a node, or of anything else (that can
+    #   be marshalled) to be kept as it is.
+    def ref(self, node):
+        key = id(node)
+        if key not in self.refs:
+            if isinstance(node, tree.Node):
+                self.recipe.append(('node', self.numbers[id(node)]))
+            elif type(node) is V.Atomise:
+                key = ('atom', node.name)
+                if key in self.refs:
+                    return self.refs[key]
+                self.recipe.append(key)
+            else:
+                marshal.dumps(node)  # Fails if it can't be kept.
+                self.recipe.append(('value', node))
+            self.refs[key] = len(self.recipe) - 1
+            self.keys.append(key)
+        return self.refs[key]
+
+    # The line of `node', if it's in this file, otherwise `line'.
+    def line(self, node, line):
+        if not isinstance(node, tree.Node):
+            return line
+        if node.location >> source.SHIFT != self.origin:
+            return line
+        return source.resolve(node.location)[1]
+
+    def function(self, node, body):
+        name = '{}_{}'.format('body' if body else 'form', len(self.functions))
+        self.functions.append(None)  # Keep its place.
+        w = Writer(self, body)
+        w.line = self.line(node, 1)
+        w.emit('C = {}'.format('{}' if body else 'None'), node)
+        w.emit('E = V.FRAME')
+        result = emit(w, node, False, body)
+        w.emit('return {}'.format(result))
+        self.functions[int(name.split('_')[1])] = (name, w.lines, w.places)
+        return name
+
+    def source(self, functions):
+        lines, places = [], []
+        for name, body, where in functions:
+            lines.append('def {}():'.format(name))
+            places.append(where[0])
+            lines.extend(body)
+            places.extend(where)
+        return '\n'.join(lines) + '\n', places
+
+    # Compiles the given functions into a code object, with the line
+    #   numbers of the source.  Whatever Python might warn about in
+    #   them is the translation's doing, not the source's, so it isn't
+    #   shown as if it were.
+    def compile(self, functions):
+        text, places = self.source(functions)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', SyntaxWarning)
+            syntax = ast.parse(text, self.file)
+            for node in ast.walk(syntax):
+                if hasattr(node, 'lineno'):
+                    node.lineno = places[node.lineno - 1]
+                    node.end_lineno = places[(node.end_lineno or node.lineno) - 1]
+            return compile(syntax, self.file, 'exec')
+
+# Whether evaluating `node' can't do anything but give a value
+#   (and say where it was), so it needn't be done twice.
+def pure(node):
+    if not isinstance(node, tree.Node):
+        return True
+    if node.type in (tree.Numeric, tree.String, tree.Atom, tree.Nil):
+        return True
+    return node.type is tree.Symbol and node.value not in ('_', 'break', 'next')
+
+# Writes the statements evaluating `node', and gives a Python expression
+#   for its value.  `direct' is set when that value is only going to be
+#   used by a plain Python operation (see `direct_call'), which doesn't care
+#   what `LAST_EVALUATED' is in the meantime.  A call in `tail' position
+#   gives the `visitor.TailCall' to be made in its place.
+def emit(w, node, direct, tail=False):
+    if not isinstance(node, tree.Node):
+        k = w.module.ref(node)
+        if not direct:
+            w.emit('V.LAST_EVALUATED = K[{}]'.format(k))
+        return 'K[{}]'.format(k)
+
+    t = node.type
+    k = w.module.ref(node)
+    if t is tree.Yield or t is tree.Uneval:
+        value = 'K[{}]'.format(k)
+        if w.body and closures.sensitive(node):
+            value = w.temp()
+            w.emit('{} = own(C, {})'.format(value, k), node)
+        w.emit('V.CURRENT_LOCATION = L[{}]'.format(k), node)
+        w.emit('V.LAST_EVALUATED = {}'.format(value))
+        return value
+    if t is tree.Call:
+        if node.value is None:
+            result = w.temp()
+            w.emit('V.CURRENT_LOCATION = L[{}]'.format(k), node)
+            w.emit(('{} = V.EX.throw(L[{}], \'Cannot make empty call. '
+                + 'Evaluating an\\nempty list does not make sense.\')').format(result, k))
+            return result
+        head = node.value
+        if type(head) is tree.Symbol and head.value in V.MACROS:
+            return builtin(w, node, direct, tail)
+        return call(w, node, tail)
+
+    if t is tree.Nil:
+        value = 'K[{}]'.format(k)
+    elif t is tree.Atom:
+        if node.value not in V.ATOMS:
+            V.ATOMS[node.value] = V.Atomise(node.value)
+        value = 'K[{}]'.format(w.module.ref(V.ATOMS[node.value]))
+    elif t is tree.Numeric or t is tree.String:
+        value = repr(node.value)
+    elif t is tree.Symbol:
+        return symbol(w, node, direct)
+    else:
+        raise Exception("Don't know what to do with %s, this is a bug" % str(node))
+    if not direct:
+        w.emit('V.CURRENT_LOCATION = L[{}]'.format(k), node)
+        w.emit('V.LAST_EVALUATED = {}'.format(value))
+    return value
+
+def symbol(w, node, direct):
+    k = w.module.ref(node)
+    name = node.value
+    w.emit('V.CURRENT_LOCATION = L[{}]'.format(k), node)
+    if name in ('break', 'next'):
+        return 'K[{}]'.format(k)
+    value = w.temp()
+    if name == '_':
+        w.emit('{} = V.LAST_RETURNED'.format(value))
+        return value
+    if name in V.MACROS:
+        w.emit('{} = V.MACROS[{!r}]'.format(value, name))
+    else:
+        w.emit('{} = V.search(E, {!r})'.format(value, name))
+    if not direct:
+        w.emit('V.LAST_EVALUATED = {}'.format(value))
+    return value
+
+# Writes `if conf.RECOVERING_FROM_ERROR: <result> = NIL_ERROR', leaving
+#   `w' to write the `else:' of it.
+def guard(w, node, result):
+    w.emit('if conf.RECOVERING_FROM_ERROR:', node)
+    w.emit('    {} = NIL_ERROR'.format(result))
+    w.emit('else:')
+    w.indent += 1
+
+# The node to hand a built-in (or function): its own copy in a call, if it
+#   holds a quoted list (see `closures.mine').
+def given(w, node):
+    k = w.module.ref(node)
+    if w.body and closures.sensitive(node):
+        return 'own(C, {})'.format(k)
+    return 'K[{}]'.format(k)
+
+# A call to whatever its head evaluates to.
+def call(w, node, tail=False):
+    k = w.module.ref(node)
+    result = w.temp()
+    guard(w, node, result)
+    w.emit('V.CURRENT_LOCATION = L[{}]'.format(k))
+    callee = emit(w, node.value, False)
+    w.emit('if type({}) is Definition:'.format(callee))
+    w.indent += 1
+    args = [emit(w, op, False) for op in node.operands]
+    w.emit('if {}.scope.arity == {}:'.format(callee, len(args)))
+    w.emit('    {} = V.{}({}, [{}])'.format(result,
+        'TailCall' if tail else 'enter', callee, ', '.join(args)))
+    w.emit('else:')
+    w.emit('    {} = V.execute_method({}, [{}])'.format(result, callee, ', '.join(args)))
+    w.indent -= 1
+    w.emit('elif type({}) is function:'.format(callee))
+    w.emit('    {} = {}({})'.format(result, callee, given(w, node)))
+    w.emit('else:')
+    w.emit('    {} = V.not_callable(K[{}], {})'.format(result, k, callee))
+    w.emit('V.LAST_EVALUATED = {}'.format(result))
+    w.indent -= 1
+    return result
+
+# A call to a built-in macro, which we know at compile time, since
+#   built-ins take precedence over anything bound to their name.
+def builtin(w, node, direct, tail=False):
+    name = node.value.value
+    if name in DIRECT:
+        result = direct_call(w, node)
+        if result is not None:
+            if not direct:
+                w.emit('V.LAST_EVALUATED = {}'.format(result))
+            return result
+    result = w.temp()
+    guard(w, node, result)
+    # What evaluating the head would have done.
+    w.emit('V.CURRENT_LOCATION = L[{}]'.format(w.module.ref(node.value)), node)
+    w.emit('V.LAST_EVALUATED = V.MACROS[{!r}]'.format(name))
+    special = SPECIAL.get(name)
+    if tail and name in V.TAILS:
+        made = special(w, node, result, tail)
+    else:
+        made = special and special(w, node, result)
+    if not made and not strict(w, node, result):
+        w.emit('{} = V.MACROS[{!r}]({})'.format(result, name, given(w, node)))
+    w.emit('V.LAST_EVALUATED = {}'.format(result))
+    w.indent -= 1
+    return result
+
+def strict(w, node, result):
+    name = node.value.value
+    if name not in closures.STRICT:
+        return False
+    least, most, evaluated = closures.STRICT[name]
+    count = len(node.operands)
+    if count < least or (most is not None and count > most):
+        return False
+    args = [emit(w, op, False) for op in node.operands[:evaluated]]
+    w.emit('{} = V.MACROS[{!r}](K[{}], [{}])'.format(
+        result, name, w.module.ref(node), ', '.join(args)))
+    return True
+
+def _if(w, node, result, tail=False, unless=False):
+    if len(node.operands) < 2:
+        return False
+    check = held(w, node.operands[0], emit(w, node.operands[0], False))
+    w.emit(('if {0} is F or not {0}:' if unless
+        else 'if {0} is not F and {0}:').format(check))
+    w.indent += 1
+    w.emit('{} = {}'.format(result, emit(w, node.operands[1], False, tail)))
+    w.indent -= 1
+    w.emit('else:')
+    w.indent += 1
+    if len(node.operands) > 2:
+        w.emit('{} = {}'.format(result, emit(w, node.operands[2], False, tail)))
+    else:
+        w.emit('{} = Nil(L[{}])'.format(result, w.module.ref(node)))
+    w.indent -= 1
+    return True
+
+def _unless(w, node, result, tail=False):
+    return _if(w, node, result, tail, unless=True)
+
+# Stopping part way, at a `yield' or `break'/`next', is a `break' out
+#   of a loop around the lot, that only goes round once.
+def _do(w, node, result, tail=False):
+    if not node.operands:
+        w.emit('{} = Nil(L[{}])'.format(result, w.module.ref(node)))
+        return True
+    w.emit('while True:')
+    w.indent += 1
+    for op in node.operands:
+        e = emit(w, op, False, tail and op is node.operands[-1])
+        w.emit('{} = {}'.format(result, e))
+        w.emit('if type({}) is Yield:'.format(result))
+        w.emit('    {0} = V.{1}({0}.value)'.format(result,
+            'evaluate_tail' if tail else 'evaluate'))
+        w.emit('    break')
+        w.emit('if type({0}) is Symbol and {0}.value in (\'break\', \'next\'):'
+            .format(result))
+        w.emit('    break')
+    w.emit('break')
+    w.indent -= 1
+    return True
+
+def _iterate(w, node, result):
+    if len(node.operands) != 1:
+        return False
+    w.emit('{} = V.LAST_EVALUATED'.format(result))
+    w.emit('while True:')
+    w.indent += 1
+    e = emit(w, node.operands[0], False)
+    w.emit('if type({}) is Symbol:'.format(e))
+    w.emit('    if {}.value == \'break\':'.format(e))
+    w.emit('        break')
+    w.emit('    if {}.value == \'next\':'.format(e))
+    w.emit('        continue')
+    w.emit('{} = {}'.format(result, e))
+    w.indent -= 1
+    w.emit('V.LAST_RETURNED = {}'.format(result))
+    return True
+
+# `(eval 'x)', as macros leave it, is just `x'.
+def _eval(w, node, result):
+    if len(node.operands) != 1 or type(node.operands[0]) is not tree.Uneval:
+        return False
+    emit(w, node.operands[0], False)
+    w.emit('{} = {}'.format(result, emit(w, node.operands[0].value, False)))
+    return True
+
+def _let(w, node, result, mutable=False):
+    if len(node.operands) == 0:
+        return False
+    for arg in node.operands:
+        if (type(arg) is not tree.Call or not V.name_node(arg.value)
+        or len(arg.operands) == 0):
+            return False  # Leave it to `let' to complain.
+    for arg in node.operands:
+        name = V.name_value(arg.value).name[1:]
+        value = emit(w, arg.operands[0], False)
+        w.emit('E.bind({!r}, {}, {})'.format(name, value, mutable))
+    w.emit('{} = V.search(E, {!r})'.format(result, name))
+    return True
+
+def _mutate(w, node, result):
+    return _let(w, node, result, mutable=True)
+
+# The name, arguments, their names and body of the `Definition' a
+#   `λ', `->' or `define' makes, or None if it's not one we compile.
+def signature(node):
+    name = node.value.value
+    if name == 'λ':
+        if (len(node.operands) < 2 or type(node.operands[0]) is not tree.Call
+        or node.operands[0].value is None):
+            return None
+        args = [node.operands[0].value] + node.operands[0].operands
+        return '_lambda', args, [e.value for e in args], node.operands[1]
+    if name == '->':
+        if len(node.operands) < 1 or node.shorthand is None:
+            return None
+        args = [('%' + str(i)) for i in range(1, node.shorthand + 1)]
+        return '_short_lambda', args, args, node.operands[0]
+    if len(node.operands) < 2:
+        return None
+    kind = node.operands[0]
+    if type(kind) is tree.Call:
+        signature, branch = kind, node.operands[1]
+    elif kind.value == 'function' and len(node.operands) > 2:
+        signature, branch = node.operands[1], node.operands[2]
+    else:
+        return None
+    if type(signature) is not tree.Call or not isinstance(signature.value, tree.Node):
+        return None
+    names = [e.value for e in signature.operands]
+    return signature.value.value, names, names, branch
+
+def _definition(w, node, result):
+    made = signature(node)
+    if made is None:
+        return False
+    body = w.module.function(made[3], True)
+    w.emit('{} = make({}, {})'.format(result, w.module.ref(node), body))
+    if node.value.value == 'define':
+        w.emit('E.bind({!r}, {})'.format(made[0], result))
+    return True
+
+SPECIAL = {
+    'if': _if,
+    'unless': _unless,
+    'do': _do,
+    'prog': _do,
+    'iterate': _iterate,
+    'eval': _eval,
+    'let': _let,
+    'mutate': _mutate,
+    'λ': _definition,
+    '->': _definition,
+    'define': _definition,
+}
+
+NUMERIC_ERROR = 'All arguments to this macro must\\nbe of type `Numeric`!'
+
+# Writes the check that `value' is a number, as arithmetic and
+#   comparisons do, giving the condition it failed.
+def numeric(value):
+    return ('type({0}) is not int and type({0}) is not float '
+        + 'and V.to_type({0}) != \'Numeric\'').format(value)
+
+# A name for the value of `op' (given by `value'), that can be put either
+#   side of `is'.  A number or string written out is held in a temporary,
+#   `is' with a literal being something Python warns about.
+def held(w, op, value):
+    if isinstance(op, tree.Node) and op.type in (tree.Numeric, tree.String):
+        name = w.temp()
+        w.emit('{} = {}'.format(name, value))
+        return name
+    return value
+
+# Whether `node' is a number written out, which needn't be checked.
+def literal(node):
+    return (isinstance(node, tree.Node) and node.type is tree.Numeric
+        and type(node.value) in (int, float))
+
+# A built-in that is plain Python, once its arguments are evaluated,
+#   or None if it can't be written as such (say, it's given too few
+#   arguments, which the built-in complains about).  Arithmetic and
+#   comparisons evaluate their arguments twice, once to check they're
+#   numbers, but arguments that are just values are only looked at once.
+def direct_call(w, node):
+    name = node.value.value
+    ops = node.operands
+    if len(ops) == 0 or (name in ('=', '/=') and len(ops) < 2):
+        return None
+    if name == '!' and len(ops) != 1:
+        return None
+    result = w.temp()
+    if name in OPERATORS or name in COMPARISONS:
+        # Check each argument is a number...
+        checked = w.indent
+        values = []
+        for op in ops:
+            value = emit(w, op, True)
+            values.append(value)
+            if literal(op):
+                continue
+            w.emit('if {}:'.format(numeric(value)))
+            w.emit('    {} = V.EX.throw(L[{}], \'{}\')'.format(
+                result if name in OPERATORS else '_', w.module.ref(op), NUMERIC_ERROR))
+            if name in OPERATORS:
+                w.emit('else:')
+                w.indent += 1
+        if name in COMPARISONS:
+            w.indent = checked  # Comparisons carry on regardless.
+        # ... and work it out.
+        if name in COMPARISONS:
+            # Stopping at the first argument out of order.
+            w.emit('{} = F'.format(result))
+            last = value_of(w, ops[0], values[0])
+            for op, value in zip(ops[1:], values[1:]):
+                after = value_of(w, op, value)
+                w.emit('if {} {} {}:'.format(last, COMPARISONS[name], after))
+                w.indent += 1
+                last = after
+            w.emit('{} = T'.format(result))
+        else:
+            again = [value_of(w, op, value) for op, value in zip(ops, values)]
+            if name == '-' and len(again) == 1:
+                w.emit('{} = -{}'.format(result, again[0]))
+            elif name == '-':
+                w.emit('{} = {} - (0 + {})'.format(result, again[0], ' + '.join(again[1:])))
+            else:
+                w.emit('{} = {}'.format(result, (' ' + OPERATORS[name] + ' ').join(again)))
+        w.indent = checked
+        return where(w, ops, result)
+
+    values = [emit(w, op, True) for op in ops]
+    if name == '+':
+        unknown = [value for op, value in zip(ops, values) if not literal(op)]
+        if not unknown:
+            w.emit('{} = 0 + {}'.format(result, ' + '.join(values)))
+            return where(w, ops, result)
+        w.emit('if {}:'.format(' and '.join(
+            'type({0}) is int or type({0}) is float'.format(value)
+            if len(unknown) == 1 else '(type({0}) is int or type({0}) is float)'.format(value)
+            for value in unknown)))
+        w.emit('    {} = 0 + {}'.format(result, ' + '.join(values)))
+        w.emit('else:')
+        w.emit('    {} = V.MACROS[\'+\'](K[{}], [{}])'.format(
+            result, w.module.ref(node), ', '.join(values)))
+    elif name in ('=', '/='):
+        same = ' and '.join('{} == {}'.format(value, values[0]) for value in values)
+        w.emit('{} = {} if {} else {}'.format(result,
+            *(('T', same, 'F') if name == '=' else ('F', same, 'T'))))
+    elif name == '!':
+        w.emit('{0} = F if {1} is not F and {1} else T'.format(
+            result, held(w, ops[0], values[0])))
+    else:
+        truths = ['({0} is not F and not not {0})'.format(held(w, op, value))
+            for op, value in zip(ops, values)]
+        truth = (' and ' if name == '&&' else ' or ').join(truths)
+        w.emit('{} = T if {} else F'.format(result,
+            truth or str(name == '&&')))
+    return where(w, ops, result)
+
+# An argument's value once more: evaluated again, unless it's `pure'.
+def value_of(w, op, value):
+    return value if pure(op) else emit(w, op, True)
+
+# Sets the location to where evaluating the last argument would have,
+#   if evaluating it didn't already.
+def where(w, ops, result):
+    if isinstance(ops[-1], tree.Node) and ops[-1].type is not tree.Symbol and pure(ops[-1]):
+        w.emit('V.CURRENT_LOCATION = L[{}]'.format(w.module.ref(ops[-1])))
+    return result
+
+# What the compiled code needs to hand: `K' for its nodes (and the like),
+#   found from `recipe' in the file's `nodes', `L' for their positions,
+#   and the run time helpers.
+def namespace(recipe, nodes):
+    K = []
+    for kind, value in recipe:
+        if kind == 'node':
+            K.append(nodes[value])
+        elif kind == 'atom':
+            K.append(V.ATOMS.setdefault(value, V.Atomise(value)))
+        else:
+            K.append(value)
+    L = [getattr(k, 'location', source.IMPLICIT) for k in K]
+
+    # A call's own copy of a node, see `closures.mine'.
+    def own(copies, k):
+        copy = copies.get(k)
+        if copy is None:
+            copy = copies[k] = deepcopy(K[k])
+        return copy
+
+    # Makes the `Definition' of a `λ', `->' or `define', as `visitor'
+    #   would.  Its scope is resolved once for each scope it's made in.
+    scopes = {}
+    def make(k, code):
+        node = K[k]
+        name, args, names, branch = signature(node)
+        outside = V.FRAME.scope
+        inside = scopes.get((k, outside))
+        if inside is None:
+            inside = scopes[k, outside] = resolving.scope(
+                outside, name, names, branch)
+        return V.Definition(branch, inside, args, V.FRAME, code)
+
+    return {
+        '__builtins__': __builtins__,
+        'V': V, 'conf': conf, 'K': K, 'L': L,
+        'T': V.ATOMS[':true'], 'F': V.ATOMS[':false'],
+        'NIL_ERROR': err.NIL_ERROR, 'Nil': tree.Nil,
+        'Yield': tree.Yield, 'Symbol': tree.Symbol,
+        'Definition': V.Definition, 'function': function,
+        'own': own, 'make': make,
+    }
+
+# Translates the forms of `AST', giving the compiled code of each (with
+#   that of the bodies in it), how to make `K', and the name of the
+#   function of each form (None for those that couldn't be compiled, say,
+#   being nested too deeply for Python).  Each form is compiled once, on
+#   its own, so one that can't be is simply left out.
+def translate(AST):
+    module = Module(AST)
+    codes, names = [], []
+    for form in AST:
+        mark = (len(module.functions), len(module.recipe), len(module.keys))
+        try:
+            name = module.function(form, False)
+            codes.append(module.compile(module.functions[mark[0]:]))
+            names.append(name)
+        except (SyntaxError, RecursionError, MemoryError, ValueError):
+            del module.functions[mark[0]:]
+            del module.recipe[mark[1]:]
+            for made in module.keys[mark[2]:]:
+                del module.refs[made]
+            del module.keys[mark[2]:]
+            names.append(None)
+    return codes, module.recipe, names
+
+def path(file):
+    directory, name = os.path.split(os.path.abspath(file))
+    return os.path.join(directory, DIRECTORY, name + SUFFIX)
+
+# The key of a file's compiled code: its tree's (see `cache.expand'),
+#   the compiler's, and how far its tree was optimised.
+def key(AST):
+    if AST.key is None:
+        return None
+    return version() + str(conf.OPT_LEVEL) + AST.key
+
+def load(file, key):
+    try:
+        with open(path(file), 'rb') as f:
+            written, recipe, names, codes = marshal.load(f)
+    except Exception:
+        return None
+    if written != key:
+        return None
+    return codes, recipe, names
+
+def store(file, key, compiled):
+    codes, recipe, names = compiled
+    try:
+        data = marshal.dumps((key, recipe, names, codes))
+        os.makedirs(os.path.dirname(path(file)), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path(file)))
+    except (OSError, ValueError):
+        return  # Not being able to keep it is no reason to stop.
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path(file))
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+# Compiles (or reads back) the Python of a file's expanded tree, ready
+#   for `run' to use for each of its forms.
+def prepare(AST):
+    name = key(AST)
+    compiled = name and load(AST.file, name)
+    if not compiled:
+        compiled = translate(AST)
+        if name is not None:
+            store(AST.file, name, compiled)
+    codes, recipe, names = compiled
+    scope = namespace(recipe, number(AST))
+    for code in codes:
+        exec(code, scope)
+    for form, name in zip(AST, names):
+        if name is not None:
+            FORMS[id(form)] = form, scope[name]
+
+# Runs a top-level form.
+def run(node):
+    compiled = FORMS.pop(id(node), None)
+    if compiled is None or compiled[0] is not node:
+        return closures.compile(node)()
+    return compiled[1]()
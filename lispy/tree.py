@@ -1,6 +1,10 @@
 import copy
 
+from . import source
+
 class Tree(list):
+    names = None  # Set once macros are expanded, see `parsing.preprocess'.
+    key = None    # Its key in the tree cache, see `cache.expand'.
     def __init__(self, file):
         self.file = file
         list.__init__(self)
@@ -14,12 +18,19 @@ class Tree(list):
 
 
 TAB = ' ' * 3
+# Nodes keep their fields in slots, rather than in a `__dict__' each.
+#   The `type' and `name' of a node belong to its class, and are set
+#   once, when the class is made.
 class Node(object):
+    __slots__ = ('value', 'location')
     scope = None
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.type = cls
+        cls.name = cls.__name__
     def __init__(self, value, loc):
         self.value = value
-        self.type = self.__class__
-        self.name = str(self.type).split('.')[-1][:-2]
+        self.location = loc
     def __str__(self, depth=0):
         return "{}<AST::Node[{}] ({})>".format(
             '' if depth == 0 else TAB * 2,
@@ -27,17 +38,29 @@ class Node(object):
             [str, repr][type(self.value) is str](self.value)
         )
 
+Node.type = Node
+Node.name = Node.__name__
+
 
 class Operator(Node):
+    __slots__ = ('operands', 'shorthand')
     def __init__(self, value, loc, *operands):
         self.location = loc
         self.operands = list(operands)
         self.value = value
-        self.type = self.__class__
-        self.name = str(self.type).split('.')[-1][:-2]
         self.shorthand = None
+    # Makes a node taking ownership of the given `operands' list,
+    #   rather than building a new one out of them.
+    @classmethod
+    def adopt(cls, value, loc, operands):
+        node = cls.__new__(cls)
+        node.location = loc
+        node.operands = operands
+        node.value = value
+        node.shorthand = None
+        return node
     def __deepcopy__(self, memodict={}):
-        return self.__class__(copy.deepcopy(self.value), self.location, *(copy.deepcopy(self.operands)))
+        return self.adopt(copy.deepcopy(self.value), self.location, copy.deepcopy(self.operands))
     def __str__(self, depth=0):  # Don't even try to understand this.
         operands = '\n'.join(
             map(lambda e: (u'\u2503{}'.format(TAB * ([1, 2][depth>0] + depth) + (e.__str__(depth + 1) if issubclass(type(e), Node) else str(e)))), self.operands)
@@ -52,46 +75,59 @@ class Operator(Node):
         ) + (']>' if len(self.operands) == 0 else ('\n' + operands + u'\n\u2503  {}]>'.format(TAB * (depth + [2,3][depth>0]))))
 
 class Data(Node):
-    def __init__(self, value, loc):
-        self.location = loc
-        self.value = value
-        self.type = self.__class__
-        self.name = str(self.type).split('.')[-1][:-2]
+    __slots__ = ()
     def __deepcopy__(self, memodict={}):
         return  self.__class__(copy.deepcopy(self.value), self.location)
 
 class Nil(Node):
+    __slots__ = ()
     def __init__(self, loc):
-        self.location = loc
         self.value = 'nil'
-        self.type = self.__class__
-        self.name = str(self.type).split('.')[-1][:-2]
+        self.location = loc
     def __deepcopy__(self, memodict={}):
         return self
     def __hash__(self):
         return hash(self.value)
 
+# The one `Nil' to use wherever its location is of no consequence.
+NIL = Nil(source.IMPLICIT)
+
 # Declare children classes
 
 class Yield(Data):
-    pass
+    __slots__ = ()
 
+# A call keeps what it was last found to be a call of, in its `site',
+#   see `visitor.callee', and what to evaluate in its place while it's
+#   a call of a certain function, in `inline', see "folding.py".
 class Call(Operator):
-    pass
+    __slots__ = ('site', 'inline')
+    def __init__(self, value, loc, *operands):
+        Operator.__init__(self, value, loc, *operands)
+        self.site = None
+        self.inline = None
+    @classmethod
+    def adopt(cls, value, loc, operands):
+        node = super().adopt(value, loc, operands)
+        node.site = None
+        node.inline = None
+        return node
 
 class Symbol(Data):
-    pass
+    __slots__ = ()
 
 class Atom(Data):
-    pass
+    __slots__ = ()
 
 class Numeric(Data):
-    pass
+    __slots__ = ()
 
 class Uneval(Data):
+    __slots__ = ()
     def __hash__(self):
         return hash(self.value)
 
 class String(Data):
+    __slots__ = ()
     def __hash__(self):
         return hash(self.value)
@@ -1,12 +1,16 @@
 from . import lexing
 from . import tree
 from . import parsing
+from . import cache
+from . import source
+from . import parallel
 
 from . import err
+from . import resolving
 from . import config as conf
 
 from functools import reduce
-from copy import copy as clone
+from collections import OrderedDict
 from copy import deepcopy as recursive_clone
 from types import FunctionType as function
 import numbers
@@ -15,11 +19,16 @@ try:    import readline
 except: pass
 
 import sys, os
-import pickle
-import codecs
+import weakref
+
+from . import closures  # Needs the above.
+from . import bytecode
+from . import transpile
+from . import machine
+from . import folding
 
 EX = None
-CURRENT_LOCATION = {'line': 1, 'column': 1, 'filename': '.'}
+CURRENT_LOCATION = source.IMPLICIT
 LOADED_FILES = []
 
 class Atomise(object):
@@ -29,97 +38,192 @@ class Atomise(object):
     def __hash__(self):
         return self.hash
 
+# A `Definition` made by compiled code (see "closures.py" and
+#   "bytecode.py") runs its `code' when called, rather than
+#   walking its tree.  Its calls get frames laid out by its
+#   `scope', carrying on from the `frame' it was made in.
+#
+#   The tree is the very one it was defined by, shared by every
+#   call, and never changed by them: only quoted lists in it can
+#   be, by `push', `pop' and the like, so each call is given its
+#   own copy of those instead, see `own'.
 class Definition(object):
-    def __init__(self, branch, table, taking, frozen):
-        self.tree = recursive_clone(branch)
-        self.frozen = frozen
-        self.table = table
+    def __init__(self, branch, scope, taking, frame, code=None):
+        self.tree = branch
+        self.frame = frame
+        self.scope = scope
         self.args = taking
+        self.code = code
     def call(self):
-        result = evaluate(recursive_clone(self.tree))
-        self.table.clean()
-        return result
+        if self.code is not None:
+            return self.code()
+        return evaluate_tail(self.tree)
+
+# `Memo` is the code of a function made by `(define memo ...)': its body
+#   is evaluated once for each set of arguments (told apart by `memo_key')
+#   and what it gives kept in `entries', and given back on any call with
+#   the same arguments after.  Only the `size' most recently used are
+#   kept.  Arguments are taken from the frame the call is made in.
+class Memo(object):
+    def __init__(self, definition, size):
+        self.tree = definition.tree
+        self.arity = definition.scope.arity
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        MEMOS.add(self)
+    def __call__(self):
+        try:
+            key = tuple(map(memo_key, FRAME.slots[:self.arity]))
+            found = self.entries.get(key, UNBOUND)
+        except TypeError:  # Some argument can't be told apart.
+            return evaluate(self.tree)
+        if found is not UNBOUND:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return found
+        self.misses += 1
+        value = evaluate(self.tree)
+        if conf.RECOVERING_FROM_ERROR:
+            return value
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+MEMOS = weakref.WeakSet()  # The code of every memoised function.
+
+# What a memoised function keys the value `value' by: the same for any
+#   value of the same type and contents, such as lists (quoted or made
+#   by `list') with the same items, a literal in a quoted list being
+#   keyed as what it evaluates to, and a quoted item as what's quoted.
+#   Anything else is keyed by itself.
+def memo_key(value):
+    t = type(value)
+    if t is int or t is float or t is str:
+        return (t, value)
+    if t is tree.Uneval:
+        return memo_key(value.value)
+    if t is tree.Numeric or t is tree.String:
+        return memo_key(value.value)
+    if t is tree.Atom:
+        return ATOMS.setdefault(value.value, Atomise(value.value))
+    if t is tree.Call:
+        return (t, memo_key(value.value), tuple(map(memo_key, value.operands)))
+    if t is tree.Nil:
+        return (t,)
+    if isinstance(value, tree.Node):
+        return (t, memo_key(value.value))
+    return value
+
+# `TailCall` is a call left to be made once the body it ends is done
+#   with its frame: that of `definition', given `args' (as many as it
+#   takes).  The call being made then makes it instead, in its place,
+#   so a loop written as a recursive function runs in a frame at a
+#   time, however many times it goes round.  See `evaluate_tail'.
+class TailCall(object):
+    __slots__ = ('definition', 'args')
+    def __init__(self, definition, args):
+        self.definition = definition
+        self.args = args
 
 
-class SymbolTable(object):
-    def __init__(self, scope, name = 'subscope', block=None):
+UNBOUND = resolving.UNBOUND
+Cell = resolving.Cell
+
+# `Frame` holds what is bound in a call, in the slots laid out by its
+#   `scope' (see "resolving.py"), and carries on from its `parent',
+#   the frame the `Definition' called was made in.  What's bound at
+#   the top level, in `MAIN', is kept in global cells instead.
+#
+#   A `Definition' keeps the very frame it was made in (not a copy), so
+#   it sees what's bound there later on, itself included, and a frame
+#   lasts for just as long as the calls running in it, or definitions
+#   made in it, are around.
+class Frame(object):
+    __slots__ = ('scope', 'slots', 'parent', 'copies')
+    def __init__(self, scope, slots, parent):
         self.scope = scope
-        self.name = name
-        self.local = {}
-        self.mutables = []
-        self.args = []
-        self.type = __class__
-        self.block = block
-        self.frozen = False
-
-    def freeze(self):
-        new = SymbolTable(self.scope, self.name, self.block)
-        new.frozen = True
-        new.local = clone(self.local)
-        new.mutables = self.mutables
-        new.args = self.args
-        return new
-
-    def check_freeze(self):
-        if self.frozen:
-            raise "Can't modify frozen table, this is a bug."
-        return None
+        self.slots = slots
+        self.parent = parent
+        self.copies = None  # The call's own copies of nodes, see `own'.
 
     def bind(self, symbol, value, mutable=False):
-        self.check_freeze()
-        global EX
-        if symbol in self.local:
-            if not (mutable or symbol in self.mutables or symbol[0] == '$'):
-                s = (('Symbol bindings are immutable, symbol: `%s' % symbol)
-                    + "' cannot be mutated.")
-                return EX.throw(CURRENT_LOCATION, s)
-        self.local[symbol] = value
-
-    def declare(self, symbol):
-        self.check_freeze()
-        self.local[symbol] = None
-
-    def declare_args(self, *args):
-        self.check_freeze()
-        self.args = args
-
-    def give_args(self, args):
-        self.check_freeze()
-        global EX
-        if len(self.args) != len(args):
-            s = 'Wrong number of arguments to `{}\',\nexpected: {}, got {}.'.format(
-                self.name, len(self.args), len(args))
-            return EX.throw(CURRENT_LOCATION, s)
-        for i in range(len(args)):
-            self.local[self.args[i]] = args[i]
-
-    def clean(self):
-        self.check_freeze()
-        del self.local
-        self.local = {}
+        scope = self.scope
+        if self.parent is None:
+            cell = resolving.cell(symbol)
+            if cell.value is not UNBOUND:
+                if not (mutable or cell.mutable or symbol[0] == '$'):
+                    return immutable(symbol)
+            cell.value = value
+            resolving.BINDINGS += 1
+            if mutable:
+                cell.mutable = True
+            return
+        slot = scope.slots.get(symbol)
+        if slot is None:
+            slot = scope.grow(symbol)
+        slots = self.slots
+        if slot >= len(slots):
+            slots.extend([UNBOUND] * (scope.size - len(slots)))
+        if slots[slot] is not UNBOUND:
+            if not (mutable or symbol in scope.mutables or symbol[0] == '$'):
+                return immutable(symbol)
+        slots[slot] = value
+        if mutable:
+            scope.mutables.add(symbol)
+
+    # Where `symbol' is bound, as seen from this frame: a cell, or a
+    #   frame and the slot in it, or None if it isn't bound at all.
+    def find(self, symbol):
+        frame = self
+        while frame.parent is not None:
+            slot = frame.scope.slots.get(symbol)
+            if slot is not None and slot < len(frame.slots):
+                if frame.slots[slot] is not UNBOUND:
+                    return frame, slot
+            frame = frame.parent
+        cell = resolving.GLOBALS.get(symbol)
+        if cell is None or cell.value is UNBOUND:
+            return None
+        return cell
 
     def __str__(self):
-        return '<TABLE`{}`:{}{}>'.format(
-            self.name,
-            hex(self.scope),
-            ['', ' [frozen]'][self.frozen])
-
-
-def print_table(table):
-    if table.local == {}:
-        print(str(table), "is empty.")
+        return '<TABLE`{}`:{}>'.format(
+            self.scope.name,
+            hex(0 if self.parent is None else id(self.scope)))
+
+def immutable(symbol):
+    s = (('Symbol bindings are immutable, symbol: `%s' % symbol)
+        + "' cannot be mutated.")
+    return EX.throw(CURRENT_LOCATION, s)
+
+def print_table(frame):
+    if frame.parent is None:
+        bound = {cell.name: cell.value for cell in resolving.GLOBALS.values()}
+    else:
+        bound = {name: frame.slots[slot] for name, slot in frame.scope.slots.items()
+            if slot < len(frame.slots)}
+    bound = {name: value for name, value in bound.items() if value is not UNBOUND}
+    if bound == {}:
+        print(str(frame), "is empty.")
         return
     print("=" * 30)
-    print(str(table), "=>", end='')
+    print(str(frame), "=>", end='')
     prefix = '\n\t||  '
     print(prefix, end='')
-    print(prefix.join(list(map(lambda v: "sym:{} --> {}".format(v, table.local[v]), list(table.local.keys())))))
+    print(prefix.join(list(map(lambda v: "sym:{} --> {}".format(v, bound[v]), list(bound.keys())))))
     print("=" * 30)
 
 
-TABLES = [SymbolTable(0, '_main', None)]
-FROZEN_TABLES = []
-CALL_STACK = []
+# Raised by a call going deeper than `conf.DEPTH_LIMIT'.
+class TooDeep(RecursionError):
+    pass
+
+MAIN = Frame(resolving.GLOBAL, [], None)
+FRAME = MAIN  # The frame code is being evaluated in.
+DEPTH = 0     # How many calls are being made.
 
 ATOMS = {':true': Atomise(':true'), ':false': Atomise(':false')}
 
@@ -136,71 +240,61 @@ def load_file(name):
             + 'This will almost certainly cause '
             + 'immutability errors...').format(abspath))
     LOADED_FILES.append(abspath)
-    PROGRAM_STRING = None
-    with codecs.open(name, 'r', 'utf-8') as file:
-        PROGRAM_STRING = file.read()
-    stream = lexing.lex(PROGRAM_STRING, name)
-    AST = parsing.parse(stream)
-    visit(AST)
-
-def last_call():
-    global CALL_STACK
-    if len(CALL_STACK) > 0:
-        return [CALL_STACK[-1]]
-    return []
-
-def lookup_table(scope, mutable=False):
-    global TABLES, FROZEN_TABLES, CALL_STACK
-    all_tables = FROZEN_TABLES + TABLES + last_call()
-    return list(filter(lambda e: not e.frozen and (e.scope == scope), all_tables))[-1]
-
-def current_tables(current_scopes):
-    global TABLES, FROZEN_TABLES, CALL_STACK
-    tables = filter(lambda e: e.scope in current_scopes, TABLES)
-    return FROZEN_TABLES + list(tables) + last_call()
-
-def where_symbol(current_scopes, sym):
-    tables = current_tables(current_scopes)
-    for t in tables[::-1]:
-        if sym in t.local:
-            return t
-    return EX.throw(CURRENT_LOCATION,
-        'Symbol `{}\' is not bound in the current scope.'.format(
-            sym))
-
-# Searches with respect to scoping, starting with children.
-def search_tables(current, ident):
-    subtree = None
-    tables = current_tables(current)
-    if conf.DEBUG:
-        print("\n\nSearching current scopes for symbol: ", ident)
-        print("Current parent tables searching:", list(map(str, tables)))
-    for table in tables[::-1]:  # Search backwards, from children towards parents
-        if conf.DEBUG: print("Looking at:", table)
-        if conf.DEBUG: print("With bound symbols:", list(table.local.keys()))
-        if ident in list(table.local.keys()):
-            if conf.DEBUG: print("Matched symbol in table.\n" + str(table.local[ident]))
-            subtree = table.local[ident]
+    try:
+        visit(cache.expand(name))
+    finally:
+        source.unload(name)
+
+def where_symbol(sym):
+    found = FRAME.find(sym)
+    if found is None:
+        return EX.throw(CURRENT_LOCATION,
+            'Symbol `{}\' is not bound in the current scope.'.format(
+                sym))
+    return found
+
+# The value bound to `ident', as seen from `frame', looked for at its
+#   address in each scope out from it, until it's found bound.
+def search(frame, ident):
+    while True:
+        address = frame.scope.address(ident)
+        if type(address) is Cell:
+            value = address.value
             break
-    if subtree is None:
-        s = ('Unbound symbol: `{}\', in scope: {}.\n'
-            + 'Check if symbol is in scope, or has been defined').format(
-            ident, current_tables(current)[-1]
-        )
-        return EX.throw(CURRENT_LOCATION, s)
-    if conf.DEBUG: print("[!!] - Finished symbol search.\n\n")
-    return subtree
-
-search_symbol = search_tables
-
-def symbol_declared(current, ident):
-    global TABLES
-    subtree = None
-    tables = current_tables(current)
-    for table in tables[::-1]:  # Search backwards, from children towards parents
-        if ident in list(table.local.keys()):
-            return True
-    return False
+        depth, slot = address
+        while depth:
+            frame = frame.parent
+            depth -= 1
+        slots = frame.slots
+        if slot < len(slots) and slots[slot] is not UNBOUND:
+            return slots[slot]
+        frame = frame.parent
+    if value is UNBOUND:
+        return unbound(ident)
+    return value
+
+def unbound(ident):
+    s = ('Unbound symbol: `{}\', in scope: {}.\n'
+        + 'Check if symbol is in scope, or has been defined').format(
+        ident, FRAME)
+    return EX.throw(CURRENT_LOCATION, s)
+
+# Looks `ident' up from the current frame.
+def lookup(ident):
+    return search(FRAME, ident)
+
+# The current call's own copy of the quoted list `node', made the first
+#   time the call evaluates it, just as if the call had been given a
+#   copy of the whole body it's in.  The node is kept along with it, so
+#   its `id' can't be taken by another one meanwhile.
+def own(node):
+    copies = FRAME.copies
+    if copies is None:
+        copies = FRAME.copies = {}
+    mine = copies.get(id(node))
+    if mine is None:
+        mine = copies[id(node)] = (node, recursive_clone(node))
+    return mine[1]
 
 def is_node(node):
     return issubclass(node.__class__, tree.Node)
@@ -237,7 +331,7 @@ def to_s(node):
 
     if type(node) is Definition:
         return '<definition`{}\' taking{}\n  {}>'.format(
-            node.table.name, list(map(to_s, node.args)),
+            node.scope.name, list(map(to_s, node.args)),
             '\n  '.join(to_s(node.tree).strip().split('\n')))
 
     if type(node) is Atomise:
@@ -340,14 +434,13 @@ def name_value(node):
         ATOMS[s] = Atomise(s)
     return ATOMS[s]
 
-CURRENT_SCOPES = [0x0]  # Default scope is main scope (0x0).
-
-def _do_macro(node):
+def _do_macro(node, tail=False):
     ret = tree.Nil(node.location)
+    last = node.operands[-1] if tail and node.operands else None
     for op in node.operands:
-        e = evaluate(op)
+        e = evaluate_tail(op) if op is last else evaluate(op)
         if type(e) is tree.Yield:
-            return evaluate(e.value)
+            return evaluate_tail(e.value) if tail else evaluate(e.value)
         if type(e) is tree.Symbol:
             if e.value in ['break', 'next']:
                 return e
@@ -387,7 +480,7 @@ def _require_macro(node):
                 'Was not able to deduce a filename from `require\n`'+
                 + 'argument supplied...')
 
-        curren_path = os.path.dirname(node.location['filename'])
+        curren_path = os.path.dirname(source.filename(node.location))
         file_name = curren_path + '/' + file_name
         if not os.path.isfile(file_name):
             file_name = file_name + '.lispy'
@@ -409,10 +502,18 @@ def _require_macro(node):
 def _eval_macro(node):
     if len(node.operands) > 1:
         return EX.throw(node.location, '`eval\' built-in macro takes exactly one argument')
-    inside = evaluate(node.operands[0])
+    global CURRENT_LOCATION, LAST_EVALUATED
+    inside = node.operands[0]
+    if type(inside) is tree.Uneval and not conf.RECOVERING_FROM_ERROR:
+        # Nothing can change the quoted form before it's evaluated,
+        #   so it needn't be copied, as `evaluate' would.
+        CURRENT_LOCATION = inside.location
+        LAST_EVALUATED = inside
+    else:
+        inside = evaluate(inside)
     if type(inside) is str:
         inside += '\n'
-        stream = lexing.lex(inside, node.location['filename'], nofile=True)
+        stream = lexing.lex(inside, source.filename(node.location), nofile=True)
         syntax_tree = parsing.parse(stream, string=inside)
         return visit(syntax_tree, string=inside)
     if not is_node(inside):
@@ -428,51 +529,65 @@ def _scope_macro(node):
     if type(node.operands[0]) is not tree.Symbol:
         return EX.throw(node.operands[0].location,
             "Only pure symbols can be given to `scope'.")
-    t = where_symbol(CURRENT_SCOPES, node.operands[0].value)
-    if type(t) is not SymbolTable:
+    t = where_symbol(node.operands[0].value)
+    if type(t) is Cell:
+        t = MAIN
+    elif type(t) is tuple:
+        t = t[0]
+    else:
         return t
     s = str(t)
     err.err_print(s)
-    return tree.Uneval(tree.Call(t.name, CURRENT_LOCATION, t.scope), CURRENT_LOCATION)
+    return tree.Uneval(tree.Call(t.scope.name, CURRENT_LOCATION,
+        0 if t is MAIN else id(t.scope)), CURRENT_LOCATION)
 
-def _type_macro(node):
+# Built-in macros taking `args' may be handed their arguments already
+#   evaluated (see "closures.py"), otherwise they evaluate them, in order.
+
+def _type_macro(node, args=None):
     if len(node.operands) == 0:
         return EX.throw(node.value.location,
             '`type` built-in macro takes exactly one argument.')
-    return name_value(to_type(evaluate(node.operands[0])))
+    if args is None:
+        args = [evaluate(node.operands[0])]
+    return name_value(to_type(args[0]))
 
-def _name_macro(node):
+def _name_macro(node, args=None):
     if len(node.operands) == 0:
         return EX.throw(node.value.location,
             '`name` built-in macro takes exactly one argument.')
-    return name_value(evaluate(node.operands[0]))
+    if args is None:
+        args = [evaluate(node.operands[0])]
+    return name_value(args[0])
 
-def _if_macro(node):
+def _if_macro(node, tail=False):
     check = evaluate(node.operands[0])
+    branch = evaluate_tail if tail else evaluate
     if check is not ATOMS[':false'] and check:
-        return evaluate(node.operands[1])
+        return branch(node.operands[1])
     else:
         if len(node.operands) > 2:
-            return evaluate(node.operands[2])
+            return branch(node.operands[2])
     return tree.Nil(node.location)
 
 
-def _unless_macro(node):
+def _unless_macro(node, tail=False):
     check = evaluate(node.operands[0])
+    branch = evaluate_tail if tail else evaluate
     if check is ATOMS[':false'] or (not check):
-        return evaluate(node.operands[1])
+        return branch(node.operands[1])
     else:
         if len(node.operands) > 2:
-            return evaluate(node.operands[2])
+            return branch(node.operands[2])
     return tree.Nil(node.location)
 
 
-def _list_macro(node):
+def _list_macro(node, args=None):
     # `list` is simply a way of writing '(1 2 3)
     #   as (list 1 2 3), the only difference is that all
     #   the arguments are evaluated at the time of the
     #   definition of the list, as oppsed to at access time.
-    dlist = list(map(evaluate, node.operands))
+    dlist = list(map(evaluate, node.operands)) if args is None else args
     head = None
     tail = []
     if len(dlist) > 0:
@@ -482,11 +597,11 @@ def _list_macro(node):
         tree.Call(head, node.location, *tail),
         node.location)
 
-def _size_macro(node):
+def _size_macro(node, args=None):
     if len(node.operands) != 1:
         return EX.throw(node.operands[0].location,
             '`size` built-in macro takes exactly one list argument')
-    dlist = evaluate(node.operands[0])
+    dlist = evaluate(node.operands[0]) if args is None else args[0]
     check_list(dlist, node)
 
     if type(dlist) is str:
@@ -495,14 +610,15 @@ def _size_macro(node):
         return 0
     return 1 + len(dlist.value.operands)
 
-def _index_macro(node):
+def _index_macro(node, args=None):
     if len(node.operands) != 2:
         return EX.throw(node.location,
             '`index` built-in macro takes exactly two arguments,\n'
             + 'first needs to be a numeric integer index and\n'
             + 'second an unevaluated list to be indexed.')
-    index = evaluate(node.operands[0])
-    data  = evaluate(node.operands[1])
+    if args is None:
+        args = [evaluate(node.operands[0]), evaluate(node.operands[1])]
+    index, data = args
 
     # We must be absolutely certian we have the correct type of
     #   arguments supplied to the index macro.
@@ -562,13 +678,15 @@ def _iterate_macro(node):
     LAST_RETURNED = last
     return LAST_RETURNED
 
-def _push_macro(node):
+def _push_macro(node, args=None):
     if len(node.operands) < 2:
         return EX.throw(node.location,
             '`push` built-in macro needs at least\n'
             + 'two arguments.')
-    elems = list(map(evaluate, node.operands[:-1]))
-    data = evaluate(node.operands[-1])
+    if args is None:
+        args = list(map(evaluate, node.operands))
+    elems = args[:-1]
+    data = args[-1]
     # Check that data is indeed a list.
     check_list(data, node)
 
@@ -580,13 +698,15 @@ def _push_macro(node):
 
     return data
 
-def _unshift_macro(node):
+def _unshift_macro(node, args=None):
     if len(node.operands) < 2:
         return EX.throw(node.location,
             '`unshift` built-in macro needs at least\n'
             + 'two arguments.')
-    elems = list(map(evaluate, node.operands[:-1]))[::-1]
-    data = evaluate(node.operands[-1])
+    if args is None:
+        args = list(map(evaluate, node.operands))
+    elems = args[:-1][::-1]
+    data = args[-1]
     # Check that data is indeed a list.
     check_list(data, node)
 
@@ -602,11 +722,11 @@ def _unshift_macro(node):
     return data
 
 # Helper method
-def concat(node):
+def concat(node, args=None):
     if len(node.operands) < 2:
         return EX.throw(node.value.location,
             '`concat` must take two or more lists (x)or strings')
-    dlists = list(map(evaluate, node.operands))
+    dlists = list(map(evaluate, node.operands)) if args is None else args
     types = []
     for l in dlists:
         types.append(check_list(l, node))
@@ -632,18 +752,23 @@ def concat(node):
 
 
 
-def _concat_macro(node):
-    return concat(node)
+def _concat_macro(node, args=None):
+    return concat(node, args)
 
 def _concat_des_macro(node):
     concated = concat(node)
     first = evaluate(node.operands[0])
 
     if type(first) is str:
-        tab = None
-        if node.operands[0].type is tree.Symbol:
-            tab = where_symbol(CURRENT_SCOPES, node.operands[0].value)
-        tab.bind(node.operands[0].value, concated, mutable=True)
+        name = node.operands[0].value
+        found = where_symbol(name)
+        if type(found) is Cell:
+            found.value = concated
+            found.mutable = True
+        elif type(found) is tuple:
+            frame, slot = found
+            frame.slots[slot] = concated
+            frame.scope.mutables.add(name)
     else:
         first.value = concated.value
     return concated
@@ -703,8 +828,9 @@ def _composition_macro(node):
     return _composition
 
 
-def _add_macro(node):
-    args = list(map(evaluate, node.operands))
+def _add_macro(node, args=None):
+    if args is None:
+        args = list(map(evaluate, node.operands))
     if len(args) == 0:
         return EX.throw(node.value.location,
             "Please provide at least one argument.")
@@ -768,11 +894,11 @@ def _mod_macro(node):
     r = reduce(lambda a, b: a % b, map(evaluate, node.operands))
     return r
 
-def _eq_macro(node):
+def _eq_macro(node, args=None):
     if len(node.operands) < 2:
         return EX.throw(node.value.location,
             "Please provide at least two argument.")
-    r = unity(map(evaluate, node.operands))
+    r = unity(map(evaluate, node.operands) if args is None else args)
     return [ATOMS[':false'], ATOMS[':true']][r]
 
 def truthy(node):
@@ -783,26 +909,29 @@ def truthy(node):
 def internal_bool(bool):
     return [ATOMS[':false'], ATOMS[':true']][bool]
 
-def _nq_macro(node):
-    return [ATOMS[':true'], ATOMS[':false']][_eq_macro(node) == ATOMS[':true']]
+def _nq_macro(node, args=None):
+    return [ATOMS[':true'], ATOMS[':false']][_eq_macro(node, args) == ATOMS[':true']]
 
-def _ne_macro(node):
-    op = evaluate(node.operands[0])
+def _ne_macro(node, args=None):
+    op = evaluate(node.operands[0]) if args is None else args[0]
     return [ATOMS[':true'], ATOMS[':false']][truthy(op)]
 
-def _and_macro(node):
-    comp = lambda e: truthy(evaluate(e))
-    truths = list(map(comp, node.operands))
+def _and_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    truths = list(map(truthy, args))
     return internal_bool(all(truths))
 
-def _or_macro(node):
-    comp = lambda e: truthy(evaluate(e))
-    truths = list(map(comp, node.operands))
+def _or_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    truths = list(map(truthy, args))
     return internal_bool(any(truths))
 
-def _xor_macro(node):
-    comp = lambda e: truthy(evaluate(e))
-    truths = list(map(comp, node.operands))
+def _xor_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    truths = list(map(truthy, args))
     if len(truths) != 2:
         return EX.throw(node.value.location,
             '`^^` (XOR) built-in macro takes exactly two arguments.')
@@ -848,22 +977,25 @@ def _ge_macro(node):
         max = after
     return ATOMS[':true']
 
-def _string_macro(node):
-    compositon = lambda x: to_s(evaluate(x))
-    return ' '.join(map(compositon, node.operands))
+def _string_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    return ' '.join(map(to_s, args))
 
-def _repr_macro(node):
-    compositon = lambda x: unquote(evaluate(x))
-    return ' '.join(map(compositon, node.operands))
+def _repr_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    return ' '.join(map(unquote, args))
 
 def _ast_macro(node):
     if len(node.operands) == 0:
-        return str(tree.Nil(node.location))
+        return str(tree.NIL)
     return str(str(node.operands[0]))
 
-def _out_macro(node):
-    compositon = lambda x: to_s(evaluate(x))
-    result = ''.join(map(str, map(compositon, node.operands)))
+def _out_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    result = ''.join(map(str, map(to_s, args)))
     if conf.DEBUG:
         print('[out] --- <STDOUT>: `' + result + "'")
     else:
@@ -875,9 +1007,10 @@ def _read_macro(node):
         return input(to_s(evaluate(node.operands[0])))
     return input()
 
-def _puts_macro(node):
-    compositon = lambda x: to_s(evaluate(x))
-    result = '\n'.join(map(str, map(compositon, node.operands)))
+def _puts_macro(node, args=None):
+    if args is None:
+        args = map(evaluate, node.operands)
+    result = '\n'.join(map(str, map(to_s, args)))
     if conf.DEBUG:
         print('[puts] --- <STDOUT>: `' + result + "'")
     else:
@@ -885,8 +1018,7 @@ def _puts_macro(node):
     return result
 
 def _let_macro(node, mutable=False):
-    immediate_scope = CURRENT_SCOPES[-1]
-    immediate_table = lookup_table(immediate_scope, mutable=True)
+    frame = FRAME
     if len(node.operands) == 0:
         return tree.Nil(node.location)
 
@@ -903,13 +1035,10 @@ def _let_macro(node, mutable=False):
     name = LAST_EVALUATED
     for op in node.operands:
         if conf.DEBUG: print("let is defining: ", op.value.value)
-        if conf.DEBUG: print("while alredy: ", lookup_table(CURRENT_SCOPES[-1]).local, "... exist\n\n")
         name = name_value(op.value).name[1:]
-        immediate_table.bind(name, evaluate(op.operands[0]), mutable)
-        if mutable:
-            immediate_table.mutables.append(name)
-    if conf.DEBUG: print('After let, defined variables in current scope, are: ', lookup_table(CURRENT_SCOPES[-1]).local)
-    return search_symbol(CURRENT_SCOPES, name)
+        frame.bind(name, evaluate(op.operands[0]), mutable)
+    if conf.DEBUG: print_table(frame)
+    return lookup(name)
 
 def _delete_macro(node):
     for op in node.operands:
@@ -918,36 +1047,39 @@ def _delete_macro(node):
                 "Can only delete Symbols, or refrences\n"
                 + "to symbols through name nodes. ({} => {}) isn't seen as a name.".format(to_s(op), to_type(op)))
         name = op.value if type(op) is tree.Symbol else name_value(op).name[1:]
-        t = where_symbol(CURRENT_SCOPES, name)
-        del t.local[name]
+        resolving.BINDINGS += 1
+        t = where_symbol(name)
+        if type(t) is Cell:
+            t.value = UNBOUND
+        elif type(t) is tuple:
+            t[0].slots[t[1]] = UNBOUND
+        else:
+            return t
     return ATOMS[':true']
 
+# Makes the `Definition' of a function, in the current frame.
+def make_definition(node, name, args, branch, taking=None):
+    scope = resolving.scope(FRAME.scope, name, args, branch)
+    return Definition(branch, scope, args if taking is None else taking,
+        FRAME)
+
 def _lambda_macro(node):
-    table = SymbolTable(id(node), '_lambda', node)
     args = [node.operands[0].value] + node.operands[0].operands
-    table.declare_args(*list(map(lambda e: e.value, args)))
-    TABLES.append(table)
-    frozen = current_tables(CURRENT_SCOPES + [id(node)])
-    frozen = [t.freeze() for t in frozen]
-    return Definition(node.operands[1], table, args, frozen)
+    names = list(map(lambda e: e.value, args))
+    return make_definition(node, '_lambda', names, node.operands[1], args)
 
 def _shorthand_macro(node):
-    table = SymbolTable(id(node), '_short_lambda', node)
-
     args = [('%' + str(i)) for i in range(1, node.shorthand + 1)]
-    table.declare_args(*args)
-    TABLES.append(table)
-    frozen = current_tables(CURRENT_SCOPES + [id(node)])
-    frozen = [t.freeze() for t in frozen]
-    return Definition(node.operands[0], table, args, frozen)
+    return make_definition(node, '_short_lambda', args, node.operands[0])
 
 def _define_macro(node):
     definition = None
 
-    def_types = ['function', 'variadic']
+    def_types = ['function', 'variadic', 'memo']
     def_type = node.operands[0]
+    memo = type(def_type) is tree.Symbol and def_type.value == 'memo'
 
-    if type(def_type) is tree.Call or def_type.value == 'function':
+    if type(def_type) is tree.Call or def_type.value == 'function' or memo:
         name = None
         arg_list = None
         body = None
@@ -961,19 +1093,60 @@ def _define_macro(node):
             arg_list = node.operands[1].operands
             body = node.operands[2]
 
-        table = SymbolTable(id(node), name, node)
-        TABLES.append(table)
         ops = list(map(lambda e: e.value, arg_list))
-        TABLES[-1].declare_args(*ops)
+        definition = make_definition(node, name, ops, body)
+        if memo:
+            # i.e. (define memo (f n) body 100) keeps 100 values at most.
+            size, where = conf.MEMO_SIZE, node.location
+            if len(node.operands) > 3:
+                size = evaluate(node.operands[3])
+                where = node.operands[3].location
+            if type(size) is not int or size < 1:
+                return EX.throw(where,
+                    'The size of a memoised function\'s cache\n'
+                    + 'must be a positive integer.')
+            definition.code = Memo(definition, size)
+        FRAME.bind(name, definition)
 
-        frozen = current_tables(CURRENT_SCOPES + [id(node)])
-        frozen = [t.freeze() for t in frozen]
-        definition = Definition(body, table, ops, frozen)
+    return definition
 
-        immediate_scope = CURRENT_SCOPES[-1]
-        lookup_table(immediate_scope).bind(name, definition)
+# The `Memo' of the memoised function `value', given to the built-in `node'.
+def memo_of(node, value):
+    if type(value) is not Definition or type(value.code) is not Memo:
+        return EX.throw(node.operands[0].location,
+            '`{}` built-in macro takes a function\n'.format(node.value.value)
+            + 'defined with `(define memo ...)`.')
+    return value.code
 
-    return definition
+# Forgets what the given memoised function, or every one, has kept,
+#   its counts of hits, misses and evictions staying as they were.
+def _memo_clear_macro(node, args=None):
+    if args is None:
+        args = list(map(evaluate, node.operands))
+    if len(args) > 1:
+        return EX.throw(node.location,
+            '`memo-clear` built-in macro takes at most one argument.')
+    memos = list(MEMOS) if len(args) == 0 else [memo_of(node, args[0])]
+    for memo in memos:
+        if type(memo) is Memo:
+            memo.entries.clear()
+    return tree.Nil(node.location)
+
+# How a memoised function's cache has fared, as a list of atoms and
+#   numbers: '(:hits h :misses m :evictions e :size s :limit l).
+def _memo_stats_macro(node, args=None):
+    if len(node.operands) != 1:
+        return EX.throw(node.location,
+            '`memo-stats` built-in macro takes exactly one argument.')
+    memo = memo_of(node, evaluate(node.operands[0]) if args is None else args[0])
+    if type(memo) is not Memo:
+        return memo
+    stats = []
+    for name, value in (('hits', memo.hits), ('misses', memo.misses),
+    ('evictions', memo.evictions), ('size', len(memo.entries)), ('limit', memo.size)):
+        stats.append(ATOMS.setdefault(':' + name, Atomise(':' + name)))
+        stats.append(value)
+    return tree.Uneval(tree.Call(stats[0], node.location, *stats[1:]), node.location)
 
 MACROS = {
     'do': _do_macro,
@@ -1024,16 +1197,19 @@ MACROS = {
     'λ': _lambda_macro,
     '->': _shorthand_macro,
     'define': _define_macro,
+    'memo-clear': _memo_clear_macro,
+    'memo-stats': _memo_stats_macro,
 }
 
-LAST_EVALUATED = tree.Nil(CURRENT_LOCATION)
+# Built-ins which, when in tail position, leave the forms they end
+#   with in tail position as well, being given `tail'.
+TAILS = ('if', 'unless', 'do', 'prog')
+
+LAST_EVALUATED = tree.NIL
 LAST_RETURNED = LAST_EVALUATED
 
 def evaluate(node):
-    global TABLES, CURRENT_SCOPES, FROZEN_TABLES, CALL_STACK
     global EX, CURRENT_LOCATION, LAST_EVALUATED, LAST_RETURNED, ATOMS
-    # All tables and scope/call stacks need to be
-    # able to be modified by this method.
 
     if conf.RECOVERING_FROM_ERROR:
         return err.NIL_ERROR
@@ -1048,19 +1224,11 @@ def evaluate(node):
 
     CURRENT_LOCATION = node.location
     # if conf.DEBUG:
-    #     print("Current scope: {}, i.e. '{}'".format(
-    #         hex(CURRENT_SCOPES[-1]),
-    #         lookup_table(CURRENT_SCOPES[-1]).name))
-    #
-    #     print("\nAll Scope Tables: [{}]".format(', '.join(map(str, TABLES))))
-    #     print("\nCurrent Scopes:   [{}]".format(', '.join(map(str, CURRENT_SCOPES))))
-    #     print("\nCall Tables:      [{}]".format(', '.join(map(str, CALL_STACK))))
-    #     print("\nFrozen Tables:    [{}]".format(', '.join(map(str, FROZEN_TABLES))))
-
-    # for t in current_tables(CURRENT_SCOPES):
-    #     if t.name == '_main':
-    #         continue
-    #     print_table(t)
+    #     print("Current frame: {}".format(FRAME))
+    #     frame = FRAME
+    #     while frame.parent is not None:
+    #         print_table(frame)
+    #         frame = frame.parent
 
     if node.type is tree.Yield:
         LAST_EVALUATED = node
@@ -1086,9 +1254,11 @@ def evaluate(node):
         if node.value in MACROS:
             LAST_EVALUATED = MACROS[node.value]
             return LAST_EVALUATED
-        LAST_EVALUATED = search_tables(CURRENT_SCOPES, node.value)
+        LAST_EVALUATED = search(FRAME, node.value)
         return LAST_EVALUATED
     if node.type is tree.Uneval:
+        if FRAME.parent is not None and type(node.value) is tree.Call:
+            node = own(node)  # Lists may be changed in place.
         LAST_EVALUATED = node
         return LAST_EVALUATED  # Doesn't get evaluated per se.
     if node.type is tree.String:
@@ -1104,86 +1274,220 @@ def evaluate(node):
 
     raise Exception("Don't know what to do with %s, this is a bug" % str(node))
 
+# Evaluates `node' as the last thing the body of a `Definition' does
+#   (the tail position), or the last thing an `if', `unless', `do' or
+#   `yield' in the tail position does.  Rather than making a call to a
+#   `Definition' there, it gives the `TailCall' to be made in its place.
+def evaluate_tail(node):
+    global CURRENT_LOCATION, LAST_EVALUATED
+    if (type(node) is not tree.Call or node.value is None
+    or conf.RECOVERING_FROM_ERROR):
+        return evaluate(node)
+    head = node.value
+    if type(head) is tree.Symbol and head.value in MACROS:
+        if head.value not in TAILS:
+            return evaluate(node)
+        CURRENT_LOCATION = node.location
+        LAST_EVALUATED = MACROS[head.value]
+        LAST_EVALUATED = MACROS[head.value](node, True)
+        return LAST_EVALUATED
+
+    CURRENT_LOCATION = node.location
+    definition = callee(node)
+    if node.inline is not None and node.inline[0] is definition:
+        return inlined(node)
+    if type(definition) is not Definition:
+        if type(definition) is function:
+            LAST_EVALUATED = definition(node)
+        else:
+            LAST_EVALUATED = not_callable(node, definition)
+        return LAST_EVALUATED
+    args = list(map(evaluate, node.operands))
+    if len(args) != definition.scope.arity:
+        LAST_EVALUATED = execute_method(definition, args)
+        return LAST_EVALUATED
+    return TailCall(definition, args)
+
+# Counters of call sites looked at by `callee'.
+STATS = {
+    'hits': 0,    # Calls whose site knew what they were of.
+    'misses': 0,  # ... and those whose head was evaluated again.
+}
+
+def reset_stats():
+    for key in STATS:
+        STATS[key] = 0
+
+# What the call `node' is of, as evaluating its head gives it.  The call
+#   site (`site') remembers what a built-in's name gave, for good, since
+#   nothing can be bound in its place, and what the name of a global gave,
+#   for as long as no global is bound and it's made in a frame of the same
+#   scope, see `resolving.BINDINGS'.
+def callee(node):
+    global CURRENT_LOCATION, LAST_EVALUATED
+    head = node.value
+    site = node.site
+    if site is not None and site[2] is head and (site[0] is None
+    or (site[0] == resolving.BINDINGS and site[1] is FRAME.scope)):
+        STATS['hits'] += 1
+        CURRENT_LOCATION = head.location
+        LAST_EVALUATED = site[3]
+        return site[3]
+    STATS['misses'] += 1
+    value = evaluate(head)
+    if type(head) is tree.Symbol and type(value) in (Definition, function):
+        name = head.value
+        if name in MACROS:
+            node.site = (None, None, head, value)
+        elif (name not in resolving.SPECIAL
+        and type(FRAME.scope.address(name)) is Cell):
+            node.site = (resolving.BINDINGS, FRAME.scope, head, value)
+    return value
+
+# Evaluates the body put in place of the call `node' (see "folding.py"),
+#   giving what the call would have.
+def inlined(node):
+    global LAST_EVALUATED, LAST_RETURNED
+    LAST_EVALUATED = LAST_RETURNED = evaluate(node.inline[1])
+    return LAST_EVALUATED
+
+def not_callable(node, definition):
+    loc = None
+    if is_node(definition):
+        loc = node.value.location
+    else:
+        loc = CURRENT_LOCATION
+
+    return EX.throw(loc,
+        'Cannot make call to to type of `{}\''.format(
+            to_type(definition)))
+
 def execute_method(node, args=None):
-    global LAST_EVALUATED, LAST_RETURNED, FROZEN_TABLES, CALL_STACK
+    global LAST_EVALUATED, LAST_RETURNED, FRAME, DEPTH
     definition = node
     if not isinstance(node, (Definition, function)):
-        definition = evaluate(node.value)
+        definition = callee(node)
+        if node.inline is not None and node.inline[0] is definition:
+            return inlined(node)
 
     if type(definition) is function:
         return definition(node)
 
     if type(definition) is not Definition:
-        loc = None
-        if is_node(definition):
-            loc = node.value.location
-        else:
-            loc = CURRENT_LOCATION
-
-        return EX.throw(loc,
-            'Cannot make call to to type of `{}\''.format(
-                to_type(definition)))
+        return not_callable(node, definition)
 
     if definition is None:
         return EX.throw(CURRENT_LOCATION,
             'Cannot make empty call.')
 
+    # Callers may hand over arguments they've already evaluated.
     if args is None:
         args = list(map(evaluate, node.operands))
-    else:
-        print("Artificial args")
-    FROZEN_TABLES = definition.frozen
+    scope = definition.scope
+    if len(args) != scope.arity:
+        args = arity(definition, args)
+    # What `enter' does, without the call to it.
+    if DEPTH >= conf.DEPTH_LIMIT:
+        raise TooDeep()
+    if scope.blank:
+        args += scope.blank
+    caller = FRAME
+    FRAME = Frame(scope, args, definition.frame)
+    DEPTH += 1
 
-    added = definition.table.scope == CURRENT_SCOPES[-1]
-    if not added:
-        CURRENT_SCOPES.append(definition.table.scope)
+    # Aaaaand, then we finally, make the call...
+    result = definition.call()
+    if type(result) is TailCall:
+        result = bounce(result)
 
-    call_table =  clone(definition.table)
-    call_table.clean()
-    call_table.give_args(args)
-    CALL_STACK.append(call_table)
+    FRAME = caller
+    DEPTH -= 1
 
-    # Aaaaand, then we finally, make the call...
+    LAST_EVALUATED = LAST_RETURNED = result
+    return result
+
+# The call protocol: the list of arguments the caller has evaluated (and
+#   that it lets go of) becomes the slots of the frame of the call, made
+#   in place of the current one until the call returns.  Nothing else is
+#   kept about a call, so a `Definition' sees just what it was made in,
+#   however it's called.  Callers check there's the right number of
+#   arguments first, compiled ones knowing how many each call site gives.
+def enter(definition, slots):
+    global FRAME, DEPTH, LAST_EVALUATED, LAST_RETURNED
+    if DEPTH >= conf.DEPTH_LIMIT:
+        raise TooDeep()
+    scope = definition.scope
+    if scope.blank:
+        slots += scope.blank
+    caller = FRAME
+    FRAME = Frame(scope, slots, definition.frame)
+    DEPTH += 1
     result = definition.call()
-    # Back to cleaning up our Symbol tables.
-
-    definition.table.clean()
-    FROZEN_TABLES = []
-    if not added:
-        CURRENT_SCOPES.pop()
-    CALL_STACK[-1].clean()
-    CALL_STACK.pop()
-    del call_table
-
-    LAST_EVALUATED = result
-    LAST_RETURNED = LAST_EVALUATED
-    return LAST_RETURNED
+    if type(result) is TailCall:
+        result = bounce(result)
 
+    FRAME = caller
+    DEPTH -= 1
 
-# All evaluation starts here:
-def visit(AST, pc=0, string=None):
-    global LAST_RETURNED, LAST_EVALUATED
-    if conf.DEBUG: print("\nVisiting (`{}\' branch: {}):\n".format(AST.file, pc))
-    global EX
-    if string is not None:
-        if parsing.EX:
-            parsing.EX.nofile(string)
-        EX.nofile(string)
-    ret = tree.Nil({'line': 1, 'column': 1, 'filename': AST.file})
-    AST = parsing.preprocess(AST)
-    if len(AST) == 0:
-        return ret
+    LAST_EVALUATED = LAST_RETURNED = result
+    return result
+
+# Makes the `TailCall's a call ended with, one after the other, each
+#   in the frame of the one before, giving what the last one gives.
+def bounce(call):
+    global FRAME
+    while type(call) is TailCall:
+        definition, slots = call.definition, call.args
+        scope = definition.scope
+        if scope.blank:
+            slots += scope.blank
+        FRAME = Frame(scope, slots, definition.frame)
+        call = definition.call()
+    return call
+
+# Complains that `definition' was given the wrong number of `args',
+#   giving as many as it takes, should evaluation carry on regardless.
+def arity(definition, args):
+    scope = definition.scope
+    EX.throw(CURRENT_LOCATION,
+        'Wrong number of arguments to `{}\',\nexpected: {}, got {}.'.format(
+            scope.name, scope.arity, len(args)))
+    return (args + [UNBOUND] * scope.arity)[:scope.arity]
+
+
+# Evaluates one (macro expanded) top-level form, reporting
+#   anything that goes wrong while doing so.
+def visit_form(node):
+    global LAST_RETURNED, LAST_EVALUATED, FRAME, DEPTH
+    ret = None
+    frame, depth = FRAME, DEPTH
     try:
-        ret = evaluate(AST[pc])
+        if conf.ENGINE == 'closure':
+            ret = closures.compile(node)()
+        elif conf.ENGINE == 'bytecode':
+            ret = bytecode.run(bytecode.compiled(node))
+        elif conf.ENGINE == 'python':
+            ret = transpile.run(node)
+        elif conf.ENGINE == 'machine':
+            ret = machine.run(node)
+        else:
+            ret = evaluate(node)
         LAST_RETURNED = ret
         LAST_EVALUATED = LAST_RETURNED
+    except TooDeep:
+        ret = EX.throw(CURRENT_LOCATION,
+            'Recursion level too deep!\n'
+            + 'You might have an infinite loop somewhere,\n'
+            + 'or you\'re recursing over something too many times.\n\n'
+            + 'interpreter call-stack limit:  {},\n'.format(conf.DEPTH_LIMIT)
+            + 'interpreter call-stack depth:  {}.'  .format(DEPTH - depth))
     except RecursionError:
         ret = EX.throw(CURRENT_LOCATION,
             'Recursion level too deep!\n'
             + 'You might have an infinite loop somewhere,\n'
             + 'or you\'re recursing over something too many times.\n\n'
             + 'python      call-stack depth:  {},\n'.format(conf.RECURSION_LIMIT)
-            + 'interpreter call-stack depth:  {}.'  .format(len(CALL_STACK)))
+            + 'interpreter call-stack depth:  {}.'  .format(DEPTH - depth))
     except EOFError:
         raise EOFError
     except Exception as e:
@@ -1197,23 +1501,115 @@ def visit(AST, pc=0, string=None):
             'LISPY produced an internal error at around this\n'
             + 'line of code being executed. See the traceback.')
 
+    FRAME, DEPTH = frame, depth
     if conf.RECOVERING_FROM_ERROR:
         conf.RECOVERING_FROM_ERROR = False
-    if pc + 1 >= len(AST):
-        return ret
-    return visit(AST, pc + 1, string)
+    return ret
 
-def walk(AST):
-    global EX, LAST_RETURNED, LAST_EVALUATED
-    EX = err.Thrower(err.EXEC, AST.file)
-    if not symbol_declared(CURRENT_SCOPES, '$PRELUDE_LOADED'):
-        main_table = lookup_table(0x0)
+# All evaluation starts here:
+#   Top-level forms are evaluated one after another in a loop.  Macros
+#   are expanded over the whole tree up front, and a form is expanded
+#   once more just before it's evaluated if it mentions macros that
+#   only became known since (e.g. through `require').  Expanded forms
+#   have their constants folded (see "folding.py"), and when calls are
+#   inlined, that's done for each form as it's reached, once the forms
+#   before it have defined what it calls.
+def visit(AST, pc=0, string=None):
+    global EX
+    if string is not None:
+        if parsing.EX:
+            parsing.EX.nofile(string)
+        EX.nofile(string)
+    ret = tree.NIL
+    if AST.names is None:
+        AST = parsing.preprocess(AST)
+    folding.optimise_tree(AST)
+    if conf.ENGINE == 'python' and string is None:
+        transpile.prepare(AST)
+    elif conf.ENGINE == 'bytecode' and string is None:
+        bytecode.prepare(AST)
+    resolving.survey(AST)
+    horizon = resolving.horizon(AST)
+
+    while pc < len(AST):
+        if conf.DEBUG: print("\nVisiting (`{}\' branch: {}):\n".format(AST.file, pc))
+        if pc > 0 and parsing.unsettled(AST, pc):
+            AST[pc] = folding.optimise(parsing.macro_expansion(AST, pc))
+            resolving.survey(AST[pc:pc + 1])
+        else:
+            if pc > 0:
+                parsing.STATS['skipped'] += 1
+            if folding.inlining():
+                AST[pc] = folding.optimise(AST[pc])
+        if pc >= horizon:
+            resolving.check(AST[pc], FRAME.scope)
+        ret = visit_form(AST[pc])
+        pc += 1
+    return ret
+
+# Pipelined evaluation: each top-level form is macro expanded and
+#   evaluated as soon as `forms' gives it, i.e. while the rest of the
+#   file is still to be read, lexed and parsed.  Nothing keeps hold of
+#   a form once it has been evaluated.  Output is flushed after every
+#   form, and unlike `visit', a macro can only be used after the form
+#   that defines it.  Forms further on can't be looked over either, so
+#   unbound symbols aren't reported before they're evaluated.
+def visit_forms(forms, file):
+    ret = tree.NIL
+    for form in forms:
+        AST = tree.Tree(file)
+        AST.push(form)
+        del form
+        if conf.DEBUG: print("\nVisiting (`{}\' form):\n".format(file))
+        AST = parsing.preprocess(AST)
+        AST[0] = folding.optimise(AST[0])
+        resolving.survey(AST)
+        ret = visit_form(AST[0])
+        sys.stdout.flush()
+    return ret
 
-        here = os.path.dirname(os.path.abspath(__file__))
-        load_file(here + '/../prelude/prelude.lispy')
+PRELUDE = os.path.dirname(os.path.abspath(__file__)) + '/../prelude'
 
-        main_table.bind('$PRELUDE_LOADED', ATOMS[':true'])
+# Every file of the prelude, its main file first.
+def prelude_files():
+    files = sorted(f for f in os.listdir(PRELUDE) if f.endswith('.lispy'))
+    files.remove('prelude.lispy')
+    return [PRELUDE + '/' + f for f in ['prelude.lispy'] + files]
+
+def load_prelude():
+    if resolving.cell('$PRELUDE_LOADED').value is UNBOUND:
+        parallel.prefetch(prelude_files())
+        load_file(PRELUDE + '/prelude.lispy')
+
+        MAIN.bind('$PRELUDE_LOADED', ATOMS[':true'])
 
         if conf.DEBUG: print('\n\nAUTOMATICALLY LOADED PRELUDE\n\n')
 
+def walk(AST):
+    global EX
+    EX = err.Thrower(err.EXEC, AST.file)
+    load_prelude()
     return visit(AST)
+
+# Like `walk', but given the file's name, its (macro expanded) tree is
+#   read from the cache if it's there, see "cache.py".  Once the file
+#   has been run (as with `load_file'), its buffer is let go of, and
+#   only read again should a diagnostic point into it.
+def walk_file(file):
+    global EX
+    EX = err.Thrower(err.EXEC, file)
+    load_prelude()
+    try:
+        return visit(cache.expand(file))
+    finally:
+        source.unload(file)
+
+# Like `walk', but for top-level forms given one by one, see `visit_forms'.
+def walk_forms(forms, file):
+    global EX
+    EX = err.Thrower(err.EXEC, file)
+    load_prelude()
+    try:
+        return visit_forms(forms, file)
+    finally:
+        source.unload(file)